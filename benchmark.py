@@ -0,0 +1,321 @@
+"""ImageProcessor 性能基准测试
+
+生成可复现的合成图片集（多种尺寸、模式 RGB/RGBA/L/P 和格式），逐个测量
+resize_image、compress_image、random_adjust、adjust_exposure、apply_filter，
+并按不同并行数和执行后端测量 process_images_batch。
+报告 图片/秒、百万像素/秒、单张耗时 p50/p95 和峰值内存，结果保存为JSON，
+可与之前的结果对比以发现性能回退。
+
+示例:
+    python benchmark.py --output results.json
+    python benchmark.py --quick --output new.json
+    python benchmark.py --compare results.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不统计峰值内存
+    resource = None
+
+from PIL import Image
+
+from model import ImageProcessor, BatchMetrics, BATCH_BACKENDS
+
+# 图片尺寸档位
+SIZES = {
+    'small': (640, 480),
+    'medium': (1920, 1080),
+    'large': (4000, 3000),
+}
+
+# 每种模式对应的输出格式（扩展名）
+MODE_FORMATS = {
+    'RGB': ('.jpg', '.png', '.bmp'),
+    'RGBA': ('.png',),
+    'L': ('.jpg', '.png'),
+    'P': ('.png', '.gif'),
+}
+
+# 单张图片操作：(名称, 处理函数名, 参数)
+OPERATIONS = [
+    ('resize_image', 'resize_image', {'width': 800}),
+    ('compress_image', 'compress_image', {'quality': 80}),
+    ('random_adjust', 'random_adjust', {'max_rotation': 10}),
+    ('adjust_exposure', 'adjust_exposure', {'brightness_factor': 1.3}),
+    ('adjust_exposure[tone]', 'adjust_exposure',
+     {'brightness_factor': 1.1, 'contrast': 1.2, 'gamma': 1.3, 'levels': (10, 245)}),
+    ('apply_filter[grayscale]', 'apply_filter', {'filter_type': 'grayscale'}),
+    ('apply_filter[sepia]', 'apply_filter', {'filter_type': 'sepia'}),
+    ('apply_filter[negative]', 'apply_filter', {'filter_type': 'negative'}),
+    ('apply_filter[blur]', 'apply_filter', {'filter_type': 'blur'}),
+]
+
+# 批处理基准使用的操作
+BATCH_OPERATION = ('compress_image', {'quality': 80})
+
+
+def synthetic_image(size, mode, seed):
+    """生成带渐变和纹理的合成图片，压缩特性接近真实照片，同一seed结果相同"""
+    width, height = size
+    # 由小图放大得到平滑的色块，再叠加固定种子的噪声
+    base = Image.frombytes('RGB', (16, 12), bytes((seed * 7 + i * 13) % 256 for i in range(16 * 12 * 3)))
+    img = base.resize(size, Image.Resampling.BICUBIC)
+    noise = Image.effect_noise(size, 24).convert('RGB')
+    img = Image.blend(img, noise, 0.15)
+    if mode == 'RGBA':
+        alpha = Image.linear_gradient('L').resize(size)
+        img = img.convert('RGBA')
+        img.putalpha(alpha)
+    elif mode == 'L':
+        img = img.convert('L')
+    elif mode == 'P':
+        img = img.quantize(64)
+    return img
+
+
+def generate_corpus(folder, sizes, count):
+    """在folder中生成图片集，返回 [(相对路径, 像素数)]"""
+    os.makedirs(folder, exist_ok=True)
+    files = []
+    seed = 0
+    for size_name in sizes:
+        size = SIZES[size_name]
+        for mode, extensions in MODE_FORMATS.items():
+            for ext in extensions:
+                for i in range(count):
+                    seed += 1
+                    name = f"{size_name}_{mode}_{i}{ext}"
+                    path = os.path.join(folder, name)
+                    if not os.path.exists(path):
+                        img = synthetic_image(size, mode, seed)
+                        if ext == '.jpg':
+                            img.save(path, quality=90)
+                        else:
+                            img.save(path)
+                    files.append((name, size[0] * size[1]))
+    return files
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _peak_rss_mb():
+    """当前进程及其已结束子进程的峰值内存（MB）"""
+    if resource is None:
+        return None
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # macOS单位为字节
+    return round(max(self_kb, children_kb) / scale, 1)
+
+
+def _summary(name, latencies, pixels, seconds, **extra):
+    images = len(latencies) if latencies else extra.pop('images', 0)
+    result = {
+        'name': name,
+        'images': images,
+        'megapixels': round(pixels / 1e6, 3),
+        'seconds': round(seconds, 4),
+        'images_per_s': round(images / seconds, 2) if seconds else None,
+        'mp_per_s': round(pixels / 1e6 / seconds, 2) if seconds else None,
+        'p50_ms': round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    result.update(extra)
+    return result
+
+
+def run_operation_case(name, func_name, params, corpus_folder, files):
+    """逐张执行单个操作并统计耗时（在独立子进程中运行，以便单独统计峰值内存）"""
+    func = getattr(ImageProcessor, func_name)
+    output_folder = tempfile.mkdtemp(prefix='bench_out_')
+    latencies = []
+    pixels = 0
+    errors = {}
+    try:
+        started = time.perf_counter()
+        for image_file, image_pixels in files:
+            t0 = time.perf_counter()
+            try:
+                func(os.path.join(corpus_folder, image_file), os.path.join(output_folder, image_file),
+                     **params)
+            except Exception as e:
+                # 失败的图片不计入耗时统计，单独记录
+                errors[image_file] = str(e)
+                continue
+            latencies.append(time.perf_counter() - t0)
+            pixels += image_pixels
+        seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+    return _summary(name, latencies, pixels, seconds, errors=errors)
+
+
+class _LatencyMetrics(BatchMetrics):
+    """在分阶段统计之外保留每张成功图片的总耗时，用于计算批处理的 p50/p95"""
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+    
+    def add(self, image_file, ok, record):
+        super().add(image_file, ok, record)
+        if ok and record is not None:
+            self.latencies.append(record['total_s'])
+
+
+def run_batch_case(backend, workers, corpus_folder, files):
+    """用 process_images_batch 批量执行并统计吞吐量（在独立子进程中运行）"""
+    func_name, params = BATCH_OPERATION
+    output_folder = tempfile.mkdtemp(prefix='bench_out_')
+    metrics = _LatencyMetrics()
+    try:
+        started = time.perf_counter()
+        processed = ImageProcessor.process_images_batch(
+            getattr(ImageProcessor, func_name), [f for f, _ in files], corpus_folder, output_folder,
+            max_workers=workers, backend=backend, metrics=metrics, **params)
+        seconds = time.perf_counter() - started
+    finally:
+        shutil.rmtree(output_folder, ignore_errors=True)
+    pixels = sum(p for _, p in files)
+    return _summary(f"process_images_batch[{func_name},{backend},workers={workers}]",
+                    metrics.latencies, pixels, seconds, images=processed, backend=backend, workers=workers)
+
+
+def _isolated(func, *args):
+    """在全新的子进程中运行基准，避免各项之间的缓存和内存峰值相互影响"""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(func, *args).result()
+
+
+def run_benchmarks(args):
+    corpus_folder = args.corpus or os.path.join(tempfile.gettempdir(), 'image_resizer_bench_corpus')
+    files = generate_corpus(corpus_folder, args.sizes, args.count)
+    results = []
+
+    for name, func_name, params in OPERATIONS:
+        if args.operations and not any(op in name for op in args.operations):
+            continue
+        for _ in range(args.repeat):
+            result = _isolated(run_operation_case, name, func_name, params, corpus_folder, files)
+            results.append(result)
+            _print_result(result)
+
+    if not args.skip_batch:
+        for backend in args.backends:
+            for workers in args.workers:
+                result = _isolated(run_batch_case, backend, workers, corpus_folder, files)
+                results.append(result)
+                _print_result(result)
+
+    return {
+        'meta': _environment(args, corpus_folder, len(files)),
+        'results': results,
+    }
+
+
+def _environment(args, corpus_folder, file_count):
+    import PIL
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': numpy_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'corpus': corpus_folder,
+        'files': file_count,
+        'sizes': args.sizes,
+        'count': args.count,
+    }
+
+
+def _print_result(result):
+    p50 = f"{result['p50_ms']:>9.1f}" if result['p50_ms'] is not None else f"{'-':>9}"
+    p95 = f"{result['p95_ms']:>9.1f}" if result['p95_ms'] is not None else f"{'-':>9}"
+    rss = result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '-'
+    print(f"{result['name']:<58} {result['images_per_s']:>9.2f} img/s {result['mp_per_s']:>8.2f} MP/s"
+          f" p50 {p50} ms p95 {p95} ms  RSS {rss} MB", flush=True)
+    for image_file, error in result.get('errors', {}).items():
+        print(f"    失败 {image_file}: {error}", flush=True)
+
+
+def compare(baseline_path, current_path, threshold):
+    """对比两次结果的吞吐量，下降超过threshold（比例）的项视为回退，返回回退项数量"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    with open(current_path, 'r', encoding='utf-8') as f:
+        current = {r['name']: r for r in json.load(f)['results']}
+
+    regressions = 0
+    print(f"{'名称':<58} {'基准 img/s':>11} {'当前 img/s':>11} {'变化':>8}")
+    for name, result in current.items():
+        base = baseline.get(name)
+        if not base or not base.get('images_per_s') or not result.get('images_per_s'):
+            continue
+        change = result['images_per_s'] / base['images_per_s'] - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  <-- 回退'
+            regressions += 1
+        print(f"{name:<58} {base['images_per_s']:>11.2f} {result['images_per_s']:>11.2f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ImageProcessor 性能基准测试")
+    parser.add_argument('--output', help="结果保存为JSON文件")
+    parser.add_argument('--corpus', help="合成图片集目录，默认使用系统临时目录（已存在的图片会复用）")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['small', 'medium', 'large'])
+    parser.add_argument('--count', type=int, default=2, help="每种尺寸/模式/格式组合生成的图片数")
+    parser.add_argument('--repeat', type=int, default=1, help="单张操作基准的重复次数")
+    parser.add_argument('--operations', nargs='+', help="只运行名称包含这些关键字的单张操作")
+    parser.add_argument('--backends', nargs='+', choices=BATCH_BACKENDS, default=list(BATCH_BACKENDS))
+    parser.add_argument('--workers', nargs='+', type=int,
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--skip-batch', action='store_true', help="不运行批处理基准")
+    parser.add_argument('--quick', action='store_true', help="快速模式：只用小图，每种组合1张")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="对比两次结果文件，有回退时退出码为1")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="对比时吞吐量下降超过该比例视为回退，默认0.10")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.compare:
+        return 1 if compare(args.compare[0], args.compare[1], args.threshold) else 0
+
+    if args.quick:
+        args.sizes = ['small']
+        args.count = 1
+    report = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""图片批量处理工具的命令行入口
+
+用于服务器、定时任务等无图形界面的环境，不导入tkinter。
+进度和结果以JSON Lines格式输出到标准输出，处理过程中的其他信息输出到标准错误。
+
+示例:
+    python cli.py 照片目录 resize --width 1600
+    python cli.py 照片目录 compress --quality 80 --workers 16 --backend process
+    python cli.py 照片目录 pipeline --step resize:width=800 --step filter:filter_type=sepia --step compress:quality=80
+"""
+import argparse
+import contextlib
+import json
+import signal
+import sys
+import time
+
+BACKENDS = ('thread', 'process', 'hybrid')
+SORT_KEYS = ('name', 'pixels', 'width', 'height', 'format')
+ORDERS = ('cost', 'listing')
+OUTPUT_FORMATS = ('jpeg', 'webp', 'avif', 'png')
+
+
+def _parse_value(text):
+    """把命令行中的参数值解析为数字、布尔值或字符串"""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _parse_step(text):
+    """解析组合处理步骤，格式为 操作名:参数=值,参数=值"""
+    operation, _, params_text = text.partition(':')
+    params = {}
+    for item in filter(None, params_text.split(',')):
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"步骤参数格式应为 参数=值: {item}")
+        params[key.strip()] = _parse_value(value.strip())
+    return operation.strip(), params
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="图片批量处理工具（命令行版）")
+    parser.add_argument('folder', help="图片所在文件夹")
+    parser.add_argument('--subfolders', action='store_true', help="包含子文件夹中的图片")
+    parser.add_argument('--stream', action='store_true',
+                        help="边扫描边处理，不预先列出全部文件（适合超大目录）")
+    parser.add_argument('--no-sort', action='store_true',
+                        help="文件列表按扫描顺序，不排序（只在 --order listing 时影响处理顺序）")
+    parser.add_argument('--sort', choices=SORT_KEYS, default='name',
+                        help="文件列表的排序方式，按尺寸排序时从大到小（文件头信息来自元数据索引；"
+                             "只在 --order listing 时影响处理顺序）")
+    parser.add_argument('--order', choices=ORDERS, default='cost',
+                        help="处理顺序：cost 按预计耗时从大到小（默认），listing 按文件列表的顺序")
+    parser.add_argument('--min-width', type=int, default=None, help="只处理宽度不小于该值的图片")
+    parser.add_argument('--min-height', type=int, default=None, help="只处理高度不小于该值的图片")
+    parser.add_argument('--workers', type=int, default=None, help="并行数，默认由系统决定")
+    parser.add_argument('--backend', choices=BACKENDS, default='thread', help="执行方式")
+    parser.add_argument('--output', default=None,
+                        help="输出文件夹，默认在源文件夹下按操作自动命名")
+    parser.add_argument('--shards', action='store_true',
+                        help="把结果写入输出文件夹中的tar分片（WebDataset格式）并生成索引 index.jsonl，不做增量处理")
+    parser.add_argument('--shard-mb', type=float, default=None,
+                        help="单个tar分片的大小上限（MB），默认256（隐含--shards）")
+    parser.add_argument('--memory-mb', type=float, default=None,
+                        help="在途任务的内存预算（MB），按文件头估算每张图片的内存占用，超大图片单独处理")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="只输出处理计划（按预计耗时从大到小）、预计耗时和输出大小，不处理图片")
+    parser.add_argument('--no-incremental', action='store_true',
+                        help="不跳过未变化的图片，全部重新处理")
+    parser.add_argument('--hash', action='store_true',
+                        help="增量处理时用内容哈希判断源文件是否变化")
+    encoding = parser.add_argument_group('输出编码', "不指定 --format 时按源文件扩展名保持原格式")
+    encoding.add_argument('--format', choices=OUTPUT_FORMATS, help="输出格式，输出文件扩展名随之改变")
+    encoding.add_argument('--encode-quality', type=int, help="编码质量（JPEG/WebP/AVIF），压缩操作的 --quality 优先")
+    encoding.add_argument('--progressive', action='store_true', default=None, help="渐进式JPEG")
+    encoding.add_argument('--subsampling', choices=('4:4:4', '4:2:2', '4:2:0'), help="色度抽样（JPEG/AVIF）")
+    encoding.add_argument('--lossless', action='store_true', default=None, help="WebP无损压缩")
+    encoding.add_argument('--webp-method', type=int, choices=range(7), metavar='0-6',
+                          help="WebP编码方法，0最快，6文件最小")
+    encoding.add_argument('--avif-speed', type=int, choices=range(11), metavar='0-10',
+                          help="AVIF编码速度，0最慢文件最小，10最快")
+    encoding.add_argument('--png-level', type=int, choices=range(10), metavar='0-9', help="PNG压缩级别")
+    parser.add_argument('--metrics', action='store_true',
+                        help="统计各阶段耗时（读取、解码、处理、编码、写入），结果中输出汇总")
+    parser.add_argument('--metrics-jsonl', metavar='PATH',
+                        help="把每张图片的计时记录写成JSON Lines（隐含--metrics）")
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help="把汇总写成Prometheus文本格式（隐含--metrics）")
+    parser.add_argument('--progress-interval', type=float, default=0.5,
+                        help="进度输出的最小间隔（秒），0表示每张图片都输出")
+
+    ops = parser.add_subparsers(dest='operation', required=True)
+
+    resize = ops.add_parser('resize', help="调整尺寸")
+    resize.add_argument('--width', type=int)
+    resize.add_argument('--height', type=int)
+    resize.add_argument('--no-keep-ratio', action='store_true', help="不保持原始比例")
+
+    compress = ops.add_parser('compress', help="压缩")
+    compress.add_argument('--quality', type=int, default=None,
+                          help="压缩质量 1-100；按目标大小压缩时为质量上限（默认95）")
+    compress.add_argument('--max-kb', type=float, default=None,
+                          help="目标大小：每张不超过的KB数，查找满足条件的最高质量")
+    compress.add_argument('--kb-per-mp', type=float, default=None,
+                          help="目标大小：每百万像素不超过的KB数")
+    compress.add_argument('--palette-error', type=float, default=None,
+                          help="PNG输出转为256色调色板时允许的均方根误差（0-255刻度，默认2，0表示只接受无损）")
+
+    random_adjust = ops.add_parser('random', help="随机微调")
+    random_adjust.add_argument('--max-rotation', type=int, required=True, help="最大旋转角度 1-45")
+    random_adjust.add_argument('--seed', help="随机种子，指定后结果可重复（与并行数和处理顺序无关）")
+    random_adjust.add_argument('--variants', type=int, default=1,
+                               help="每张图片生成的变体数，第2个起保存为 名称_2.扩展名 等")
+
+    exposure = ops.add_parser('exposure', help="曝光度调整")
+    exposure.add_argument('--factor', type=float, default=1.0, help="曝光度系数 0.1-2.0，默认1.0")
+    exposure.add_argument('--contrast', type=float, default=1.0, help="对比度系数，以中灰为中心，默认1.0")
+    exposure.add_argument('--gamma', type=float, default=1.0, help="伽马，大于1时提亮暗部，默认1.0")
+    exposure.add_argument('--levels', type=int, nargs=2, metavar=('BLACK', 'WHITE'),
+                          help="色阶：把输入的 [BLACK, WHITE] 拉伸到 0-255")
+
+    filter_parser = ops.add_parser('filter', help="滤镜")
+    filter_parser.add_argument('--type', dest='filter_type', required=True, help="滤镜类型")
+
+    pipeline = ops.add_parser('pipeline', help="组合处理，每张图片只解码和编码一次")
+    pipeline.add_argument('--step', dest='steps', type=_parse_step, action='append', required=True,
+                          help="处理步骤，可重复，格式为 操作名:参数=值,参数=值")
+    return parser
+
+
+class JsonProgress:
+    """把批处理进度输出为JSON行，按时间间隔节流"""
+    def __init__(self, stream, interval):
+        self.stream = stream
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last = 0.0
+
+    def emit(self, event, **fields):
+        fields = {'event': event, 'elapsed': round(time.perf_counter() - self.started, 3), **fields}
+        self.stream.write(json.dumps(fields, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+    def __call__(self, done, total):
+        now = time.perf_counter()
+        if now - self._last >= self.interval or done == total:
+            self._last = now
+            self.emit('progress', done=done, total=total)
+
+
+def run(controller, args):
+    """按命令行参数调用控制器，返回 (是否成功, 提示信息)"""
+    op = args.operation
+    if op == 'resize':
+        return controller.process_resize(args.width, args.height, not args.no_keep_ratio)
+    elif op == 'compress':
+        if args.quality is None and not (args.max_kb or args.kb_per_mp or args.format == 'png'):
+            return False, "请指定 --quality 或目标大小（--max-kb / --kb-per-mp）"
+        return controller.process_compress(
+            args.quality,
+            max_bytes=int(args.max_kb * 1024) if args.max_kb else None,
+            bytes_per_megapixel=int(args.kb_per_mp * 1024) if args.kb_per_mp else None,
+            palette_max_error=args.palette_error)
+    elif op == 'random':
+        return controller.process_random(args.max_rotation, seed=args.seed, variants=args.variants)
+    elif op == 'exposure':
+        return controller.process_exposure(args.factor, args.contrast, args.gamma, args.levels)
+    elif op == 'filter':
+        return controller.process_filter(args.filter_type)
+    elif op == 'pipeline':
+        controller.clear_pipeline()
+        for operation, params in args.steps:
+            controller.add_pipeline_step(operation, **params)
+        return controller.process_pipeline()
+    return False, f"未知的操作: {op}"
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = sys.stdout
+    progress = JsonProgress(out, args.progress_interval)
+
+    # 处理过程中的打印信息转到标准错误，标准输出只保留JSON行
+    with contextlib.redirect_stdout(sys.stderr):
+        # 解析参数之后再导入，--help 等不需要加载Pillow
+        from controller import ImageResizerController
+
+        controller = ImageResizerController()
+        controller.set_max_workers(args.workers)
+        controller.set_backend(args.backend)
+        controller.set_output_folder(args.output)
+        controller.set_incremental(not args.no_incremental, args.hash)
+        controller.set_dry_run(args.dry_run)
+        controller.set_largest_first(args.order == 'cost')
+        try:
+            controller.set_shard_output(args.shards or args.shard_mb is not None, args.shard_mb)
+            controller.set_memory_budget(args.memory_mb)
+            controller.set_listing(args.sort, args.min_width, args.min_height)
+            controller.set_output_encoder(
+                args.format, quality=args.encode_quality, progressive=args.progressive,
+                subsampling=args.subsampling, lossless=args.lossless, method=args.webp_method,
+                speed=args.avif_speed, compress_level=args.png_level)
+        except ValueError as e:
+            progress.emit('result', success=False, message=str(e), skipped=0, cancelled=False)
+            return 1
+        controller.set_metrics(args.metrics or bool(args.metrics_jsonl or args.metrics_prom),
+                               args.metrics_jsonl, args.metrics_prom)
+        controller.set_progress_callback(progress)
+        
+        def interrupt(signum, frame):
+            # 第一次Ctrl+C取消批处理，等待正在处理的图片完成；再次按下时立即退出
+            if controller.batch_control.cancelled:
+                raise KeyboardInterrupt
+            controller.cancel_batch()
+            print("正在取消，等待处理中的图片完成（再次按 Ctrl+C 立即退出）")
+        
+        signal.signal(signal.SIGINT, interrupt)
+        controller.select_folder(args.folder)
+        try:
+            controller.load_images(args.subfolders, sort=not args.no_sort, streaming=args.stream)
+            progress.emit('start', operation=args.operation, folder=args.folder,
+                          total=None if args.stream else controller.file_count())
+            success, message = run(controller, args)
+        except (ValueError, OSError) as e:
+            success, message = False, str(e)
+
+    plan = controller.last_plan
+    if args.dry_run and plan is not None:
+        # 按处理顺序列出每张图片的预估，便于脚本读取
+        progress.emit('plan', seconds=round(plan.estimated_seconds(controller.plan_workers()), 2),
+                      cpu_seconds=round(plan.total_seconds, 2), output_bytes=plan.total_bytes,
+                      skipped=plan.skipped, unchanged=plan.unchanged,
+                      tasks=[{'file': task.image_file, 'seconds': round(task.seconds, 4),
+                              'output_bytes': task.output_bytes} for task in plan.tasks])
+    manifest = controller.last_manifest
+    metrics = controller.last_metrics
+    cancelled = controller.batch_control.cancelled
+    progress.emit('result', success=success, message=message,
+                  skipped=manifest.skipped if manifest else 0, cancelled=cancelled,
+                  **({'metrics': metrics.summary()} if metrics else {}))
+    if cancelled:
+        return 130  # 与被SIGINT中断的命令行程序约定一致
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,44 +1,444 @@
 import os
-from model import ImageProcessor, ImageFileManager
+from model import ImageProcessor, ImageFileManager, ImageFileStream, PreviewCache, PreviewRenderer, ThumbnailStore, BatchMetrics, BatchControl, ProgressTracker, OutputEncoder, ShardedTarSink, MemoryBudget, ImageMetadataIndex, BATCH_BACKENDS, DEFAULT_SHARD_BYTES, MANIFEST_NAME
+
+# 界面中可选的输出格式预设：名称 -> (OutputEncoder的格式, 编码参数)
+OUTPUT_PRESETS = {
+    'original': (None, {}),
+    'jpeg': ('jpeg', {}),
+    'jpeg_progressive': ('jpeg', {'progressive': True}),
+    'webp': ('webp', {}),
+    'webp_lossless': ('webp', {'lossless': True}),
+    'avif': ('avif', {}),
+    'png': ('png', {}),
+}
 
 class ImageResizerController:
     def __init__(self):
         self.current_folder = ""
-        self.image_files = []
+        self.image_files = []  # 按排序和筛选设置得到的待处理列表，见 set_listing
+        self.all_image_files = []  # 文件夹中的全部图片（筛选前）
+        self.image_info = None  # 全部图片的文件头信息 {相对路径: ImageInfo}，需要时由 scan_metadata 读取
         self.image_processor = ImageProcessor()
         self.file_manager = ImageFileManager()
+        self.thumbnail_store = ThumbnailStore()
+        self.metadata_index = ImageMetadataIndex()
+        self.preview_cache = PreviewCache(store=self.thumbnail_store)
+        self.preview_renderer = PreviewRenderer(self.preview_cache)
         self.progress_callback = None
+        self.progress_tracker = ProgressTracker()  # 供界面轮询的进度，见 set_progress_callback
         self.max_workers = None  # 默认使用系统决定的线程数
+        self.backend = 'thread'  # 批处理执行后端，见 BATCH_BACKENDS
+        self.incremental = True  # 增量处理：跳过输出已是最新的图片
+        self.use_hash = False  # 增量处理时用内容哈希代替修改时间判断源文件是否变化
+        self.last_manifest = None  # 最近一次批处理使用的输出清单
+        self.collect_metrics = False  # 是否统计各阶段耗时
+        self.metrics_jsonl = None  # 每张图片的计时记录输出路径（JSON Lines）
+        self.metrics_prometheus = None  # 汇总的Prometheus文本输出路径
+        self.last_metrics = None  # 最近一次批处理的分阶段统计
+        self.batch_control = BatchControl()  # 当前批处理的暂停/取消控制，每次开始处理时重新创建
+        self.output_folder = None  # 指定的输出文件夹，为None时在源文件夹下按操作自动命名
+        self.encoder = None  # 输出编码设置 OutputEncoder，为None时按扩展名保持原格式和默认参数
+        self.shard_bytes = None  # 输出为tar分片时单个分片的大小上限（字节），为None时逐个文件输出
+        self.last_sink = None  # 最近一次批处理使用的分片写入器
+        self.memory_budget = None  # 在途任务的内存预算（字节），为None时不限制
+        self.last_budget = None  # 最近一次批处理的内存预算统计
+        self.last_plan = None  # 最近一次批处理的处理计划 BatchPlan（流式来源或按列表顺序处理时为None）
+        self.dry_run = False  # 只生成处理计划并预估耗时和输出大小，不处理图片
+        self.largest_first = True  # 按预计耗时从大到小处理；为False时按文件列表的顺序（见 set_listing）处理
+        self.sort_by = 'name'  # 文件列表的排序方式，见 sort_types
+        self.min_width = None  # 只处理宽度不小于该值的图片
+        self.min_height = None  # 只处理高度不小于该值的图片
+        self.sort_types = {
+            'name': '名称',
+            'pixels': '像素数',
+            'width': '宽度',
+            'height': '高度',
+            'format': '格式'
+        }
+        self.output_format_types = {
+            'original': '保持原格式',
+            'jpeg': 'JPEG',
+            'jpeg_progressive': '渐进式JPEG',
+            'webp': 'WebP',
+            'webp_lossless': 'WebP无损',
+            'avif': 'AVIF',
+            'png': 'PNG'
+        }
+        self.backend_types = {
+            'thread': '多线程',
+            'process': '多进程',
+            'hybrid': '混合'
+        }
         self.filter_types = {
             'grayscale': '灰度',
             'sepia': '复古棕褐色',
             'negative': '负片',
             'blur': '模糊',
             'sharpen': '锐化',
-            'contour': '轮廓'
+            'contour': '轮廓',
+            'warm': '暖色调',
+            'cool': '冷色调',
+            'vintage': '怀旧'
+        }
+        self.operation_types = {
+            'resize': '调整尺寸',
+            'exposure': '曝光度',
+            'filter': '滤镜',
+            'random': '随机微调',
+            'compress': '压缩'
         }
+        self.pipeline = []  # 组合处理步骤 [(操作名, 参数字典)]
     
     def select_folder(self, folder_path):
         """选择文件夹并加载图片"""
         self.current_folder = folder_path
         return self.current_folder
     
-    def load_images(self, include_subfolders=False):
-        """加载图片文件列表"""
+    def load_images(self, include_subfolders=False, sort=True, streaming=False):
+        """加载图片文件列表，并按 set_listing 的设置排序和筛选
+        
+        Args:
+            include_subfolders: 是否包含子文件夹
+            sort: 是否排序（按 sort_by），为False时按扫描顺序
+            streaming: 为True时不预先扫描，批处理时边扫描边处理（适合超大目录，忽略sort，不支持筛选）
+        """
         if not self.current_folder:
             return []
-        self.image_files = self.file_manager.get_image_files(
-            self.current_folder, include_subfolders)
+        self.image_info = None
+        if streaming:
+            if self._filtering():
+                raise ValueError("流式处理时不支持按尺寸筛选")
+            self.all_image_files = []
+            self.image_files = ImageFileStream(self.current_folder, include_subfolders)
+            return self.image_files
+        self.all_image_files = self.file_manager.get_image_files(
+            self.current_folder, include_subfolders, sort)
+        self._apply_listing(sort)
         return self.image_files
     
+    def _filtering(self):
+        return bool(self.min_width or self.min_height)
+    
+    def set_listing(self, sort_by='name', min_width=None, min_height=None):
+        """设置文件列表的排序方式（见 sort_types，尺寸类按从大到小）和最小宽高筛选，返回新的列表
+        
+        排序只在关闭大图优先（set_largest_first(False)）时决定处理顺序，否则只影响列表显示
+        
+        除按名称排序且不筛选外，都使用元数据索引中的文件头信息，无法识别的图片排在最后、筛选时排除
+        """
+        if sort_by not in self.sort_types:
+            raise ValueError(f"未知的排序方式: {sort_by}")
+        if (min_width and min_width < 0) or (min_height and min_height < 0):
+            raise ValueError("最小宽度和高度不能为负数")
+        self.sort_by = sort_by
+        self.min_width = min_width or None
+        self.min_height = min_height or None
+        if not isinstance(self.image_files, ImageFileStream):
+            self._apply_listing()
+        return self.image_files
+    
+    def scan_metadata(self):
+        """读取全部图片的文件头信息（通过元数据索引，只读取新增或变化的文件），返回 {相对路径: ImageInfo}"""
+        if self.image_info is None:
+            self.image_info = self.metadata_index.scan(self.current_folder, self.all_image_files)
+        return self.image_info
+    
+    def _apply_listing(self, sort=True):
+        """按当前的排序和筛选设置由 all_image_files 生成 image_files"""
+        image_files = self.all_image_files
+        if self._filtering():
+            info = self.scan_metadata()
+            image_files = [f for f in image_files if info.get(f) is not None
+                           and info[f].width >= (self.min_width or 0)
+                           and info[f].height >= (self.min_height or 0)]
+        if sort and self.sort_by != 'name':
+            info = self.scan_metadata()
+            key = {
+                'pixels': lambda i: -i.pixels,
+                'width': lambda i: -i.width,
+                'height': lambda i: -i.height,
+                'format': lambda i: i.format,
+            }[self.sort_by]
+            # 稳定排序，值相同的图片保持按名称的顺序
+            image_files = sorted(image_files, key=lambda f: (info.get(f) is None,
+                                                             key(info[f]) if info.get(f) else 0))
+        self.image_files = list(image_files)
+    
+    def remove_image(self, index):
+        """从待处理列表中移除第index张图片"""
+        image_file = self.image_files.pop(index)
+        self.all_image_files.remove(image_file)
+    
+    def warm_thumbnails(self):
+        """在后台为当前图片列表填充磁盘缩略图缓存，再次打开同一文件夹时预览可直接读取"""
+        if isinstance(self.image_files, ImageFileStream):
+            return
+        self.thumbnail_store.fill_async([os.path.join(self.current_folder, f) for f in self.image_files])
+    
+    def file_count(self):
+        """当前图片来源的文件数，流式来源为最近一次扫描到的数量"""
+        if isinstance(self.image_files, ImageFileStream):
+            return self.image_files.count
+        return len(self.image_files)
+    
+    def get_image_path(self, index):
+        """列表中第index张图片的完整路径"""
+        return os.path.join(self.current_folder, self.image_files[index])
+    
+    def get_image_info(self, image_path):
+        """图片的文件头信息 ImageInfo（优先使用元数据索引），无法识别时抛出异常"""
+        info = self.metadata_index.get(image_path)
+        if info is None:
+            # 重新打开以抛出无法识别的具体原因
+            return self.image_processor.read_image_info(image_path)
+        return info
+    
+    def get_image_size(self, image_path):
+        """图片尺寸（优先使用元数据索引），不解码像素"""
+        return self.get_image_info(image_path).size
+    
+    def prefetch_previews(self, index):
+        """在后台预取第index张图片前后相邻图片的预览缩略图"""
+        self.preview_cache.prefetch([self.get_image_path(i) for i in (index + 1, index - 1)
+                                     if 0 <= i < len(self.image_files)])
+    
+    def render_preview(self, image_path, process_type, params, callback):
+        """在后台线程中基于缩略图渲染效果预览，只保留最新一次请求
+        
+        process_type为None时显示原图缩略图；callback(路径, 预览图, 错误) 在后台线程中调用
+        """
+        self.preview_renderer.submit(image_path, process_type, params, callback)
+    
+    def cancel_preview(self):
+        """取消尚未完成的预览渲染"""
+        self.preview_renderer.cancel()
+    
     def set_progress_callback(self, callback):
-        """设置进度回调函数"""
+        """设置进度回调函数
+
+        回调在批处理线程中调用，不能直接操作界面；图形界面应传入 progress_tracker 并在主线程中轮询
+        """
         self.progress_callback = callback
     
     def set_max_workers(self, max_workers):
         """设置最大工作线程数"""
         self.max_workers = max_workers
     
+    def set_backend(self, backend):
+        """设置批处理执行后端（'thread'、'process' 或 'hybrid'）"""
+        if backend not in BATCH_BACKENDS:
+            raise ValueError(f"未知的执行后端: {backend}")
+        self.backend = backend
+    
+    def set_output_folder(self, output_folder):
+        """指定输出文件夹，传入None恢复为按操作自动命名的 output_* 子文件夹"""
+        self.output_folder = output_folder
+    
+    def _output_folder(self, suffix):
+        """确定本次处理的输出文件夹并确保其存在（只预估时不创建）"""
+        if self.dry_run:
+            return self.output_folder or self.file_manager.output_folder_path(self.current_folder, suffix)
+        if self.output_folder:
+            os.makedirs(self.output_folder, exist_ok=True)
+            return self.output_folder
+        return self.file_manager.ensure_output_folder(self.current_folder, suffix)
+    
+    def set_output_encoder(self, format=None, **options):
+        """设置输出格式和编码参数（见 OutputEncoder），都不指定时恢复为保持原格式"""
+        options = {k: v for k, v in options.items() if v is not None}
+        self.encoder = OutputEncoder(format, **options) if format or options else None
+    
+    def set_output_format(self, preset):
+        """按 output_format_types 中的预设设置输出格式"""
+        if preset not in OUTPUT_PRESETS:
+            raise ValueError(f"未知的输出格式: {preset}")
+        format, options = OUTPUT_PRESETS[preset]
+        self.set_output_encoder(format, **options)
+    
+    def set_shard_output(self, enabled, max_mb=None):
+        """设置是否把结果写入tar分片（WebDataset格式，见 ShardedTarSink），max_mb为单个分片的大小上限"""
+        if not enabled:
+            self.shard_bytes = None
+        elif max_mb is not None and max_mb <= 0:
+            raise ValueError("分片大小必须大于0")
+        else:
+            self.shard_bytes = int(max_mb * 1024 * 1024) if max_mb else DEFAULT_SHARD_BYTES
+    
+    def set_memory_budget(self, max_mb):
+        """设置在途任务的内存预算（MB，按文件头估算，见 MemoryBudget），为None或0时不限制"""
+        if max_mb is not None and max_mb < 0:
+            raise ValueError("内存预算不能为负数")
+        self.memory_budget = int(max_mb * 1024 * 1024) if max_mb else None
+    
+    def set_largest_first(self, enabled):
+        """设置处理顺序：True按预计耗时从大到小（缩短批处理末尾只剩大图的时间），False按文件列表的顺序"""
+        self.largest_first = enabled
+    
+    def set_dry_run(self, enabled):
+        """设置是否只预估：处理操作只返回处理计划、预计耗时和输出大小，不创建输出文件夹或写入文件"""
+        self.dry_run = enabled
+    
+    def set_incremental(self, enabled, use_hash=False):
+        """设置是否增量处理（根据输出清单跳过未变化的图片）"""
+        self.incremental = enabled
+        self.use_hash = use_hash
+    
+    def set_metrics(self, enabled, jsonl_path=None, prometheus_path=None):
+        """设置是否统计各阶段耗时，可选输出每张图片的JSON Lines记录和Prometheus文本汇总"""
+        self.collect_metrics = enabled
+        self.metrics_jsonl = jsonl_path
+        self.metrics_prometheus = prometheus_path
+    
+    def pause_batch(self):
+        """暂停当前批处理：不再开始新的图片，正在处理的图片会完成"""
+        self.batch_control.pause()
+    
+    def resume_batch(self):
+        """继续已暂停的批处理"""
+        self.batch_control.resume()
+    
+    def cancel_batch(self):
+        """取消当前批处理：撤销尚未开始的图片，已完成的图片保留"""
+        self.batch_control.cancel()
+    
+    def _run_batch(self, process_func, output_folder, collect_metrics=False, **kwargs):
+        """使用当前的工作线程数和执行后端运行批处理，返回成功处理的数量（含直接复制的图片）
+
+        collect_metrics 为True时即使未开启统计也收集每张图片的记录（用于汇报单张的处理结果）
+        非流式来源按预计耗时从大到小处理（见 set_largest_first）或只预估时先生成处理计划（见 plan_batch），
+        否则按列表顺序处理，不读取文件头。
+        处理后不会变化的图片由处理函数直接复制，与其他图片一样计入进度、清单和取消，
+        可能有这类图片时收集记录以汇报复制数量。
+        只预估时（见 set_dry_run）生成计划后即返回0，不写入任何文件。
+        输出为tar分片时不做增量处理
+        """
+        if self.encoder is not None:
+            kwargs['encoder'] = self.encoder
+        self.last_plan = self._plan(process_func, output_folder, kwargs)
+        if self.dry_run:
+            return 0
+        if self.last_plan is not None:
+            image_files = self.last_plan.image_files
+            collect_metrics = collect_metrics or bool(self.last_plan.unchanged)
+        else:
+            image_files = self.image_files
+            collect_metrics = collect_metrics or self._may_copy_unchanged(process_func, kwargs)
+        if isinstance(self.image_files, ImageFileStream):
+            # 流式扫描与处理同时进行，跳过输出文件夹以免处理刚写出的图片
+            self.image_files.exclude_dirs.add(os.path.relpath(output_folder, self.current_folder))
+        self.last_sink = (ShardedTarSink(output_folder, max_bytes=self.shard_bytes)
+                          if self.shard_bytes else None)
+        self.last_manifest = (self.file_manager.open_manifest(output_folder, self.use_hash)
+                              if self.incremental and self.last_sink is None else None)
+        self.last_metrics = (BatchMetrics(self.metrics_jsonl, self.metrics_prometheus)
+                             if self.collect_metrics or collect_metrics else None)
+        self.batch_control = BatchControl()
+        self.last_budget = MemoryBudget(self.memory_budget) if self.memory_budget else None
+        try:
+            return self.image_processor.process_images_batch(
+                process_func,
+                image_files,
+                self.current_folder,
+                output_folder,
+                max_workers=self.max_workers,
+                progress_callback=self.progress_callback,
+                backend=self.backend,
+                manifest=self.last_manifest,
+                metrics=self.last_metrics,
+                control=self.batch_control,
+                sink=self.last_sink,
+                memory_budget=self.last_budget,
+                **kwargs
+            )
+        finally:
+            if self.last_sink is not None:
+                self.last_sink.close()
+    
+    def _plan(self, process_func, output_folder, kwargs):
+        """为当前列表生成处理计划；流式来源，或既不按耗时排序也不只预估时返回None（不扫描文件头）
+
+        只预估时按输出清单排除已是最新的图片（实际处理时由批处理自行跳过，计划只决定顺序）
+        """
+        if isinstance(self.image_files, ImageFileStream):
+            return None
+        if not (self.largest_first or self.dry_run):
+            return None
+        image_files = self.image_files
+        skipped = 0
+        if (self.dry_run and self.incremental and not self.shard_bytes
+                and os.path.exists(os.path.join(output_folder, MANIFEST_NAME))):
+            manifest = self.file_manager.open_manifest(output_folder, self.use_hash)
+            image_files = list(manifest.filter_pending(
+                image_files, self.current_folder, output_folder, manifest.params_key(process_func, kwargs),
+                output_name=self.encoder.output_name if self.encoder is not None else None))
+            skipped = manifest.skipped
+        plan = self.image_processor.plan_batch(
+            process_func, image_files, self.current_folder, self.scan_metadata(),
+            largest_first=self.largest_first, **kwargs)
+        plan.skipped = skipped
+        return plan
+    
+    def _may_copy_unchanged(self, process_func, kwargs):
+        """处理函数是否可能直接复制尺寸不变的图片：只调整尺寸且未指定输出编码（见 resize_image）"""
+        if self.encoder is not None:
+            return False
+        name = getattr(process_func, '__name__', '')
+        if name == 'run_pipeline':
+            operations = kwargs.get('operations') or ()
+            return len(operations) == 1 and operations[0][0] == 'resize'
+        return name == 'resize_image'
+    
+    def plan_workers(self):
+        """预估耗时使用的并行数：图片处理以CPU为主，不超过CPU核心数"""
+        cpus = os.cpu_count() or 1
+        return min(self.max_workers or cpus, cpus)
+    
+    def _batch_result(self, processed_count, output_folder, done_message, details=()):
+        """根据处理数量和跳过数量生成 (是否成功, 提示信息)"""
+        if self.dry_run:
+            if self.last_plan is None:
+                return False, "流式处理时无法预估，请去掉流式选项"
+            lines = ["仅预估，未处理任何图片"]
+            lines.extend(details)
+            lines.extend(self.last_plan.format_lines(self.plan_workers()))
+            lines.append(f"输出位置: {output_folder}")
+            return True, "\n".join(lines)
+        skipped = self.last_manifest.skipped if self.last_manifest else 0
+        finished = processed_count + skipped
+        total = self.file_count()
+        cancelled = self.batch_control.cancelled
+        if finished == 0:
+            if cancelled:
+                return False, "处理已取消，没有图片被处理"
+            if total == 0:
+                return False, "没有找到需要处理的图片"
+            return False, "处理过程中出现错误，没有图片被成功处理"
+        
+        if cancelled:
+            lines = [f"处理已取消，已完成 {finished}/{total} 张"]
+        elif finished >= total:
+            lines = [done_message]
+        else:
+            lines = [f"部分图片处理完成 ({finished}/{total})"]
+        lines.extend(details)
+        if self.last_metrics and self.last_metrics.copied:
+            lines.append(f"{self.last_metrics.copied} 张图片处理后不会变化，已直接复制")
+        if self.encoder is not None:
+            lines.append(f"输出编码: {self.encoder}")
+        if skipped:
+            lines.append(f"新处理 {processed_count} 张，跳过未变化的 {skipped} 张")
+        if self.last_sink is not None:
+            lines.append(f"已写入 {len(self.last_sink.shards)} 个tar分片，"
+                         f"索引: {os.path.basename(self.last_sink.index_path)}")
+        if self.last_budget is not None and self.last_budget.deferred:
+            lines.append(f"内存预算 {self.last_budget.max_bytes / 1024 / 1024:.0f} MB，"
+                         f"估算峰值 {self.last_budget.peak / 1024 / 1024:.0f} MB，"
+                         f"因预算不足推迟提交 {self.last_budget.deferred} 次")
+        if self.last_metrics:
+            lines.extend(self.last_metrics.format_summary())
+        lines.append(f"保存在: {output_folder}")
+        return True, "\n".join(lines)
+    
     def process_resize(self, width=None, height=None, keep_ratio=True):
         """处理调整尺寸的功能"""
         if not self.image_files:
@@ -48,127 +448,142 @@ class ImageResizerController:
             return False, "请至少输入宽度或高度！"
         
         try:
-            output_folder = self.file_manager.ensure_output_folder(
-                self.current_folder, "resized")
+            output_folder = self._output_folder("resized")
             
-            # 使用多线程批处理
-            processed_count = self.image_processor.process_images_batch(
+            # 使用多线程/多进程批处理
+            processed_count = self._run_batch(
                 self.image_processor.resize_image,
-                self.image_files,
-                self.current_folder,
                 output_folder,
-                max_workers=self.max_workers,
-                progress_callback=self.progress_callback,
                 width=width,
                 height=height,
                 keep_ratio=keep_ratio
             )
             
-            if processed_count == 0:
-                return False, "处理过程中出现错误，没有图片被成功处理"
-            elif processed_count < len(self.image_files):
-                return True, f"部分图片处理完成 ({processed_count}/{len(self.image_files)})\n保存在: {output_folder}"
-            else:
-                return True, f"调整尺寸完成！\n保存在: {output_folder}"
+            return self._batch_result(processed_count, output_folder, "调整尺寸完成！")
             
         except ValueError:
             return False, "请输入有效的数字！"
         except Exception as e:
             return False, f"处理图片时出错: {str(e)}"
     
-    def process_compress(self, quality):
-        """处理压缩的功能"""
+    def _lossless_outputs(self):
+        """本次输出中是否可能有PNG/GIF（压缩时据此收集每张图片的记录，以汇报无损优化节省的字节数）"""
+        if self.encoder is not None and self.encoder.format is not None:
+            return self.encoder.format == 'png'
+        if isinstance(self.image_files, ImageFileStream):
+            return True
+        return any(os.path.splitext(f)[1].lower() in ('.png', '.gif') for f in self.image_files)
+    
+    def process_compress(self, quality, max_bytes=None, bytes_per_megapixel=None, palette_max_error=None):
+        """处理压缩的功能
+        
+        指定 max_bytes 或 bytes_per_megapixel 时按目标大小压缩，quality 为查找的质量上限。
+        PNG/GIF输出做保留透明度的无损优化，palette_max_error 为调色板量化允许的误差（为None时使用默认值）
+        """
         if not self.image_files:
             return False, "请先选择需要处理的图片！"
         
+        target_mode = bool(max_bytes or bytes_per_megapixel)
         try:
-            output_folder = self.file_manager.ensure_output_folder(
-                self.current_folder, "compressed")
+            output_folder = self._output_folder("compressed")
             
-            # 使用多线程批处理
-            processed_count = self.image_processor.process_images_batch(
+            # 使用多线程/多进程批处理
+            kwargs = {'quality': quality}
+            if target_mode:
+                kwargs.update(max_bytes=max_bytes or None, bytes_per_megapixel=bytes_per_megapixel or None)
+            if palette_max_error is not None:
+                kwargs['palette_max_error'] = palette_max_error
+            processed_count = self._run_batch(
                 self.image_processor.compress_image,
-                self.image_files,
-                self.current_folder,
                 output_folder,
-                max_workers=self.max_workers,
-                progress_callback=self.progress_callback,
-                quality=quality
+                collect_metrics=target_mode or self._lossless_outputs(),
+                **kwargs
             )
             
-            if processed_count == 0:
-                return False, "处理过程中出现错误，没有图片被成功处理"
-            elif processed_count < len(self.image_files):
-                return True, f"部分图片处理完成 ({processed_count}/{len(self.image_files)})\n保存在: {output_folder}"
-            else:
-                return True, f"压缩完成！\n保存在: {output_folder}"
+            details = []
+            if max_bytes:
+                details.append(f"目标大小: 不超过 {max_bytes / 1024:.0f} KB")
+            if bytes_per_megapixel:
+                details.append(f"目标大小: 每百万像素不超过 {bytes_per_megapixel / 1024:.0f} KB")
+            return self._batch_result(processed_count, output_folder, "压缩完成！", details)
             
         except Exception as e:
             return False, f"处理图片时出错: {str(e)}"
     
-    def process_random(self, max_rotation):
-        """处理随机微调的功能"""
+    def process_random(self, max_rotation, seed=None, variants=1):
+        """处理随机微调的功能
+        
+        每张图片生成 variants 个变体；指定 seed 时结果可重复
+        """
         if not self.image_files:
             return False, "请先选择需要处理的图片！"
         
+        if variants < 1:
+            return False, "变体数至少为1！"
+        if variants > 1 and self.backend == 'hybrid':
+            return False, "混合模式不支持生成多个变体，请选择多线程或多进程"
+        if variants > 1 and self.shard_bytes:
+            return False, "输出为tar分片时不支持生成多个变体"
+        
         try:
-            output_folder = self.file_manager.ensure_output_folder(
-                self.current_folder, "random_adjusted")
+            output_folder = self._output_folder("random_adjusted")
             
-            # 使用多线程批处理
-            processed_count = self.image_processor.process_images_batch(
+            # 使用多线程/多进程批处理
+            processed_count = self._run_batch(
                 self.image_processor.random_adjust,
-                self.image_files,
-                self.current_folder,
                 output_folder,
-                max_workers=self.max_workers,
-                progress_callback=self.progress_callback,
-                max_rotation=max_rotation
+                max_rotation=max_rotation,
+                seed=seed,
+                variants=variants
             )
             
-            if processed_count == 0:
-                return False, "处理过程中出现错误，没有图片被成功处理"
-            elif processed_count < len(self.image_files):
-                return True, f"部分图片处理完成 ({processed_count}/{len(self.image_files)})\n保存在: {output_folder}"
-            else:
-                return True, f"随机微调完成！\n保存在: {output_folder}"
+            details = []
+            if variants > 1:
+                details.append(f"每张生成 {variants} 个变体")
+            if seed is not None:
+                details.append(f"随机种子: {seed}")
+            return self._batch_result(processed_count, output_folder, "随机微调完成！", details)
             
         except Exception as e:
             return False, f"处理图片时出错: {str(e)}"
     
-    def process_exposure(self, brightness_factor):
-        """处理调整曝光度的功能"""
+    def process_exposure(self, brightness_factor, contrast=1.0, gamma=1.0, levels=None):
+        """处理调整曝光度的功能，可同时调整对比度、伽马和色阶 (黑点, 白点)"""
         if not self.image_files:
             return False, "请先选择需要处理的图片！"
         
-        if brightness_factor == 1.0:
+        # 只传递偏离默认值的参数，只调曝光度时处理参数（及增量处理的清单）与之前相同
+        tone = {}
+        if contrast != 1.0:
+            tone['contrast'] = contrast
+        if gamma != 1.0:
+            tone['gamma'] = gamma
+        if levels is not None and tuple(levels) != (0, 255):
+            tone['levels'] = tuple(levels)
+        if brightness_factor == 1.0 and not tone:
             return False, "曝光度设置为1.0，图片将保持原样"
         
         try:
-            output_folder = self.file_manager.ensure_output_folder(
-                self.current_folder, "exposure_adjusted")
+            # 参数无效时在处理前报告
+            self.image_processor.tone_lut(brightness_factor, **tone)
+        except ValueError as e:
+            return False, str(e)
+        
+        try:
+            output_folder = self._output_folder("exposure_adjusted")
             
-            # 使用多线程批处理
-            processed_count = self.image_processor.process_images_batch(
+            # 使用多线程/多进程批处理
+            processed_count = self._run_batch(
                 self.image_processor.adjust_exposure,
-                self.image_files,
-                self.current_folder,
                 output_folder,
-                max_workers=self.max_workers,
-                progress_callback=self.progress_callback,
-                brightness_factor=brightness_factor
+                brightness_factor=brightness_factor,
+                **tone
             )
             
-            if processed_count == 0:
-                return False, "处理过程中出现错误，没有图片被成功处理"
-            elif processed_count < len(self.image_files):
-                return True, (f"部分图片处理完成 ({processed_count}/{len(self.image_files)})\n"
-                             f"调整系数: {brightness_factor}\n"
-                             f"保存在: {output_folder}")
-            else:
-                return True, (f"曝光度调整完成！\n"
-                             f"调整系数: {brightness_factor}\n"
-                             f"保存在: {output_folder}")
+            details = [f"调整系数: {brightness_factor}"]
+            names = {'contrast': '对比度', 'gamma': '伽马', 'levels': '色阶'}
+            details.extend(f"{names[key]}: {value}" for key, value in tone.items())
+            return self._batch_result(processed_count, output_folder, "曝光度调整完成！", details)
             
         except Exception as e:
             return False, f"处理图片时出错: {str(e)}"
@@ -182,30 +597,66 @@ class ImageResizerController:
             return False, "无效的滤镜类型"
         
         try:
-            output_folder = self.file_manager.ensure_output_folder(
-                self.current_folder, f"filter_{filter_type}")
+            output_folder = self._output_folder(f"filter_{filter_type}")
             
-            # 使用多线程批处理
-            processed_count = self.image_processor.process_images_batch(
+            # 使用多线程/多进程批处理
+            processed_count = self._run_batch(
                 self.image_processor.apply_filter,
-                self.image_files,
-                self.current_folder,
                 output_folder,
-                max_workers=self.max_workers,
-                progress_callback=self.progress_callback,
                 filter_type=filter_type
             )
             
-            if processed_count == 0:
-                return False, "处理过程中出现错误，没有图片被成功处理"
-            elif processed_count < len(self.image_files):
-                return True, (f"部分图片处理完成 ({processed_count}/{len(self.image_files)})\n"
-                             f"滤镜类型: {self.filter_types[filter_type]}\n"
-                             f"保存在: {output_folder}")
-            else:
-                return True, (f"滤镜效果应用完成！\n"
-                             f"滤镜类型: {self.filter_types[filter_type]}\n"
-                             f"保存在: {output_folder}")
+            return self._batch_result(processed_count, output_folder, "滤镜效果应用完成！",
+                                      [f"滤镜类型: {self.filter_types[filter_type]}"])
+            
+        except Exception as e:
+            return False, f"处理图片时出错: {str(e)}"
+    
+    def add_pipeline_step(self, operation, **params):
+        """向组合处理配方末尾添加一个步骤"""
+        step = (operation, params)
+        self.image_processor.validate_pipeline([step])
+        self.pipeline.append(step)
+        return step
+    
+    def remove_pipeline_step(self, index):
+        """删除组合处理配方中的一个步骤"""
+        del self.pipeline[index]
+    
+    def clear_pipeline(self):
+        """清空组合处理配方"""
+        self.pipeline = []
+    
+    def describe_pipeline_step(self, step):
+        """生成步骤的文字说明，用于界面显示"""
+        operation, params = step
+        name = self.operation_types.get(operation, operation)
+        if operation == 'filter':
+            return f"{name}: {self.filter_types.get(params['filter_type'], params['filter_type'])}"
+        details = ", ".join(f"{k}={v}" for k, v in params.items() if v is not None)
+        return f"{name}: {details}" if details else name
+    
+    def process_pipeline(self):
+        """按配方依次执行多个操作，每张图片只解码和编码一次"""
+        if not self.image_files:
+            return False, "请先选择需要处理的图片！"
+        
+        if not self.pipeline:
+            return False, "请先添加处理步骤！"
+        
+        try:
+            output_folder = self._output_folder("pipeline")
+            
+            # 使用多线程/多进程批处理
+            processed_count = self._run_batch(
+                self.image_processor.run_pipeline,
+                output_folder,
+                operations=list(self.pipeline)
+            )
+            
+            steps = " -> ".join(self.operation_types[op] for op, _ in self.pipeline)
+            return self._batch_result(processed_count, output_folder, "组合处理完成！",
+                                      [f"处理步骤: {steps}"])
             
         except Exception as e:
-            return False, f"处理图片时出错: {str(e)}"
\ No newline at end of file
+            return False, f"处理图片时出错: {str(e)}"
@@ -1,47 +1,329 @@
-from PIL import Image, ImageEnhance
+from PIL import Image
 import os
 import random
 import math
+import io
+import json
+import functools
+import hashlib
+import heapq
+import pathlib
+import struct
 import threading
-from concurrent.futures import ThreadPoolExecutor
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import traceback
+from collections import OrderedDict, deque, namedtuple
+
+# Pillow子模块、NumPy以及tarfile、sqlite3等只有部分功能使用的模块按需导入，缩短命令行等场景的启动时间
+_numpy = None
+
+
+def _import_numpy():
+    """按需导入NumPy，未安装时返回None（NumPy为可选依赖，缺失时退回Pillow的矩阵转换）"""
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+# 颜色矩阵滤镜：每行对应输出的R、G、B通道，输入为(r, g, b)
+COLOR_MATRIX_FILTERS = {
+    'sepia': ((0.393, 0.769, 0.189),
+              (0.349, 0.686, 0.168),
+              (0.272, 0.534, 0.131)),
+    'warm': ((1.10, 0.00, 0.00),
+             (0.00, 1.00, 0.00),
+             (0.00, 0.00, 0.85)),
+    'cool': ((0.90, 0.00, 0.00),
+             (0.00, 1.00, 0.00),
+             (0.00, 0.00, 1.15)),
+    'vintage': ((0.50, 0.40, 0.10),
+                (0.30, 0.60, 0.10),
+                (0.20, 0.30, 0.50)),
+}
+
+# 查找表滤镜：对每个通道应用同一张256项的查找表
+LUT_FILTERS = {
+    'negative': [255 - i for i in range(256)],
+}
+
+# 色调调整（exposure_image）的默认色阶
+TONE_LEVELS = (0, 255)
+
+# 逐通道处理的8位模式及其 (颜色通道数, 透明通道数)，其他模式先由 _band_image 规范为其中之一
+BAND_LAYOUTS = {
+    'L': (1, 0),
+    'LA': (1, 1),
+    'RGB': (3, 0),
+    'RGBA': (3, 1),
+}
+_IDENTITY_LUT = list(range(256))
+
+# 16位灰度模式：曝光度、查找表滤镜和卷积滤镜按16位精度处理，结果为 I;16；
+# 保存为支持16位灰度的格式时保持16位，其他格式保存时才按比例缩放为8位（见 OutputEncoder）
+GRAY16_MODES = ('I', 'I;16', 'I;16L', 'I;16B', 'I;16N')
+HIGH_DEPTH_FORMATS = ('PNG', 'TIFF')
+
+# 卷积核滤镜：ImageFilter中的滤镜名及参数
+KERNEL_FILTERS = {
+    'blur': ('GaussianBlur', {'radius': 2}),
+    'sharpen': ('SHARPEN', None),
+    'contour': ('CONTOUR', None),
+}
+
+# filter_image 支持的全部滤镜类型
+FILTER_TYPES = ('grayscale',) + tuple(COLOR_MATRIX_FILTERS) + tuple(LUT_FILTERS) + tuple(KERNEL_FILTERS)
+
+# 支持的图片扩展名
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
+
+# 预览缩略图尺寸和内存缓存上限
+PREVIEW_SIZE = (300, 300)
+PREVIEW_CACHE_BYTES = 64 * 1024 * 1024
+
+# 磁盘缩略图缓存的总大小上限，超出后按最近使用时间淘汰
+THUMBNAIL_STORE_BYTES = 256 * 1024 * 1024
+
+# 图片元数据索引（SQLite）的文件名，默认与缩略图缓存放在同一缓存目录下
+METADATA_INDEX_NAME = 'metadata.sqlite3'
+
+# EXIF中的方向标签，5-8表示显示时需要交换宽高
+EXIF_ORIENTATION = 0x0112
+
+# 输出文件夹中处理清单的文件名
+MANIFEST_NAME = '.manifest.jsonl'
+
+# tar分片输出：单个分片的默认大小上限和索引文件名
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+SHARD_INDEX_NAME = 'index.jsonl'
+
+# 组合处理支持的操作及其 (必需参数, 可选参数)；resize 的 width、height 至少指定一个
+PIPELINE_OPERATIONS = {
+    'resize': ((), ('width', 'height', 'keep_ratio')),
+    'exposure': (('brightness_factor',), ('contrast', 'gamma', 'levels')),
+    'filter': (('filter_type',), ()),
+    'random': (('max_rotation',), ('angle', 'seed')),
+    'compress': (('quality',), ()),
+}
+
+# 批处理函数对应的组合处理步骤，用于成本估算
+BATCH_FUNCTION_STEPS = {
+    'resize_image': 'resize',
+    'compress_image': 'compress',
+    'random_adjust': 'random',
+    'adjust_exposure': 'exposure',
+    'apply_filter': 'filter',
+}
+
+# 批处理执行后端：
+#   thread  - 线程池，在当前进程内处理
+#   process - 进程池，按路径分发任务，子进程自行读写文件
+#   hybrid  - I/O线程读写文件，进程池只负责解码、处理和编码
+BATCH_BACKENDS = ('thread', 'process', 'hybrid')
+
+# 内存预算：单张图片处理时的工作集约为解码后像素数据的倍数（源图、模式转换/NumPy中间结果、输出、编码缓冲）
+MEMORY_WORKING_SET_FACTOR = 4
+
+# 成本估算（见 plan_batch）：单核每百万像素的大致耗时（秒），只用于安排处理顺序和预估总时间
+DECODE_SECONDS_PER_MP = {'JPEG': 0.005, 'PNG': 0.03, 'GIF': 0.015, 'BMP': 0.003}
+ENCODE_SECONDS_PER_MP = {'JPEG': 0.007, 'PNG': 0.4, 'GIF': 0.25, 'BMP': 0.003, 'WEBP': 0.17, 'AVIF': 0.5}
+STEP_SECONDS_PER_MP = {'resize': 0.025, 'random': 0.11, 'exposure': 0.002, 'compress': 0.0}
+FILTER_SECONDS_PER_MP = {
+    'grayscale': 0.001, 'negative': 0.003, 'sepia': 0.047, 'warm': 0.024, 'cool': 0.024,
+    'vintage': 0.024, 'blur': 0.074, 'sharpen': 0.029, 'contour': 0.034,
+}
+_DEFAULT_SECONDS_PER_MP = 0.02
+# 按目标大小压缩时查找质量的大致编码次数，PNG/GIF无损优化比较的候选数
+_TARGET_SEARCH_ENCODES = 5
+_LOSSLESS_CANDIDATES = 3
+# 输出为其他格式时每百万像素的大致字节数（与源格式相同时按源文件字节数和像素数的比例估算）
+OUTPUT_BYTES_PER_MP = {
+    'JPEG': 300 * 1024, 'WEBP': 200 * 1024, 'AVIF': 120 * 1024,
+    'PNG': 1500 * 1024, 'GIF': 650 * 1024, 'BMP': 3 * 1024 * 1024,
+}
+
+# 进程后端按文件大小打包任务：小文件合并为一块，减少进程间往返；
+# 文件总数已知时每块不超过 总数 / (_CHUNKS_PER_WORKER * 进程数)（与 Executor.map 的分块相同），保证各进程都有任务
+_CHUNK_BYTES = 4 * 1024 * 1024
+_CHUNK_MAX_FILES = 32
+_CHUNKS_PER_WORKER = 4
+
+# 可选的输出编码格式：名称 -> (Pillow格式名, 扩展名)，不指定时按源文件扩展名保持原格式
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+    'avif': ('AVIF', '.avif'),
+    'png': ('PNG', '.png'),
+}
+
+# 目标大小压缩：查找质量的下限，以及支持质量参数的输出格式
+COMPRESS_MIN_QUALITY = 10
+QUALITY_FORMATS = ('JPEG', 'WEBP', 'AVIF')
+
+# 无损体积优化：输出为这些格式时压缩操作改为保留透明度的无损优化，
+# 调色板量化的误差上限（0-255刻度的均方根误差，2约相当于PSNR 42dB，0表示只接受无损的调色板）
+LOSSLESS_OPTIMIZE_FORMATS = ('PNG', 'GIF')
+PALETTE_MAX_ERROR = 2.0
+
+# 估算调色板误差时先在不超过该像素数的缩小图上试算，误差明显超限时不再量化原图
+_PALETTE_SAMPLE_PIXELS = 256 * 256
+
+# 缩小图片时解码/整数倍缩小后保留的目标尺寸倍数，之后再做一次LANCZOS重采样
+# （与Pillow的thumbnail默认值一致，质量与完整重采样几乎无差别）
+RESIZE_REDUCING_GAP = 2.0
+
+# NumPy分块处理时每块的最大像素数，控制float64临时数组的内存占用
+_MATRIX_CHUNK_PIXELS = 1 << 16
 
 class ImageProcessor:
     @staticmethod
-    def preview_image(image_path, process_type, **kwargs):
+    def preview_image(image_path, process_type, proxy=None, **kwargs):
         """生成预览图片
+        
+        效果在低分辨率的预览代理图上渲染，耗时与原图大小无关。
+        
         Args:
             image_path: 输入图片路径
             process_type: 处理类型，可选值：'resize', 'compress', 'random', 'exposure', 'filter'
+            proxy: 预览代理图（例如 PreviewCache 中的缩略图），为None时从文件生成
             **kwargs: 处理参数
         Returns:
             PIL.Image对象
         """
         try:
-            with Image.open(image_path) as img:
-                preview_img = img.copy()
-                if process_type == 'resize':
-                    width = kwargs.get('width')
-                    height = kwargs.get('height')
-                    keep_ratio = kwargs.get('keep_ratio', True)
-                    return ImageProcessor._preview_resize(preview_img, width, height, keep_ratio)
-                elif process_type == 'exposure':
-                    brightness_factor = kwargs.get('brightness_factor', 1.0)
-                    return ImageProcessor._preview_exposure(preview_img, brightness_factor)
-                elif process_type == 'filter':
-                    filter_type = kwargs.get('filter_type')
-                    return ImageProcessor._preview_filter(preview_img, filter_type)
-                return preview_img
+            if proxy is None:
+                proxy = ImageProcessor.make_thumbnail(image_path)
+            source_size = None
+            if process_type == 'resize':
+                source_size = ImageProcessor.read_image_size(image_path)
+            return ImageProcessor.render_preview(proxy, process_type, source_size, **kwargs)
         except Exception as e:
             print(f"生成预览图片时出错: {str(e)}")
             raise
     
     @staticmethod
-    def _preview_resize(img, width=None, height=None, keep_ratio=True):
-        """预览调整尺寸效果"""
-        original_width, original_height = img.size
-        new_width = width
-        new_height = height
+    def render_preview(proxy, process_type, source_size=None, **kwargs):
+        """在预览代理图上渲染处理效果，不修改代理图本身
+        
+        Args:
+            proxy: 预览代理图
+            process_type: 处理类型，同 preview_image
+            source_size: 原图尺寸，调整尺寸预览用来计算输出比例
+            **kwargs: 处理参数
+        """
+        if process_type == 'resize':
+            width = kwargs.get('width')
+            height = kwargs.get('height')
+            keep_ratio = kwargs.get('keep_ratio', True)
+            return ImageProcessor._preview_resize(proxy, width, height, keep_ratio, source_size)
+        elif process_type == 'exposure':
+            brightness_factor = kwargs.get('brightness_factor', 1.0)
+            tone = {k: kwargs[k] for k in ('contrast', 'gamma', 'levels') if k in kwargs}
+            return ImageProcessor._preview_exposure(proxy, brightness_factor, **tone)
+        elif process_type == 'filter':
+            filter_type = kwargs.get('filter_type')
+            return ImageProcessor._preview_filter(proxy, filter_type)
+        elif process_type == 'random':
+            # 预览按最大角度旋转，展示最强的效果
+            max_rotation = kwargs.get('max_rotation', 0)
+            return ImageProcessor.random_adjust_image(proxy, max_rotation, angle=max_rotation)
+        elif process_type == 'compress':
+            return ImageProcessor._preview_compress(proxy, kwargs.get('quality', 85))
+        return proxy
+    
+    @staticmethod
+    def read_image_size(image_path):
+        """只读取文件头获取图片尺寸，不解码像素"""
+        with Image.open(image_path) as img:
+            return img.size
+    
+    @staticmethod
+    def read_image_info(image_path):
+        """只读取文件头获取图片信息 ImageInfo（格式、尺寸、模式、帧数、EXIF方向），不解码像素
+
+        EXIF只从文件头中已读到的数据获取（JPEG的APP1段、PNG位于图像数据之前的eXIf块），
+        不会为读取位于图像数据之后的EXIF而解码整张图片。
+        """
+        with Image.open(image_path) as img:
+            orientation = 1
+            if img.format == 'JPEG' or 'exif' in img.info:
+                orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+            return ImageInfo(img.format, img.width, img.height, img.mode,
+                             getattr(img, 'n_frames', 1), orientation)
+    
+    @staticmethod
+    def estimate_memory(image_path):
+        """只读取文件头，估算处理该图片时的内存工作集（字节），无法读取时返回0
+
+        Pillow在内存中按模式存储像素：1位图、L、P每像素1字节，16位灰度2字节，其他（RGB、RGBA等）4字节。
+        """
+        try:
+            with Image.open(image_path) as img:
+                width, height = img.size
+                mode = img.mode
+        except (OSError, ValueError):
+            return 0
+        if mode in ('1', 'L', 'P'):
+            pixel_bytes = 1
+        elif mode.startswith('I;16'):
+            pixel_bytes = 2
+        else:
+            pixel_bytes = 4
+        return width * height * pixel_bytes * MEMORY_WORKING_SET_FACTOR
+    
+    @staticmethod
+    def make_thumbnail(image_path, size=PREVIEW_SIZE):
+        """生成缩略图，JPEG会按缩略图尺寸降采样解码"""
+        with Image.open(image_path) as img:
+            img.thumbnail(size, Image.Resampling.LANCZOS)
+            img.load()
+            return img
+    
+    @staticmethod
+    def _preview_resize(img, width=None, height=None, keep_ratio=True, source_size=None):
+        """预览调整尺寸效果
+
+        按原图尺寸计算输出尺寸，再把输出按比例缩放到不超过代理图的大小显示
+        """
+        target = ImageProcessor.calc_resize_size(source_size or img.size, width, height, keep_ratio)
+        fit = min(1.0, img.width / target[0], img.height / target[1])
+        display_size = (max(1, int(target[0] * fit)), max(1, int(target[1] * fit)))
+        return img.resize(display_size, Image.Resampling.LANCZOS)
+    
+    @staticmethod
+    def _preview_compress(img, quality):
+        """预览压缩效果：在内存中按指定质量编码为JPEG后再解码"""
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=quality)
+        buffer.seek(0)
+        compressed = Image.open(buffer)
+        compressed.load()
+        return compressed
+    
+    @staticmethod
+    def scale_image(img, width=None, height=None, keep_ratio=True):
+        """调整内存中图片的尺寸
+
+        对尚未解码的JPEG会先按目标尺寸选择较低的解码分辨率（见 draft_for_size），
+        再由reducing_gap先做整数倍reduce，最后只做一次LANCZOS重采样。
+        """
+        new_size = ImageProcessor.calc_resize_size(img.size, width, height, keep_ratio)
+        ImageProcessor.draft_for_size(img, new_size)
+        return img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=RESIZE_REDUCING_GAP)
+    
+    @staticmethod
+    def calc_resize_size(original_size, width=None, height=None, keep_ratio=True):
+        """根据目标宽高计算输出尺寸"""
+        original_width, original_height = original_size
+        new_width = width or original_width
+        new_height = height or original_height
         
         if keep_ratio:
             if width and height:
@@ -59,73 +341,241 @@ class ImageProcessor:
                 new_height = height
                 new_width = int(original_width * ratio)
         
-        return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        return max(1, new_width), max(1, new_height)
+    
+    @staticmethod
+    def is_noop_resize(info, width=None, height=None, keep_ratio=True):
+        """按文件头信息 ImageInfo 判断调整尺寸是否不会改变图片（输出尺寸等于原尺寸的单帧图片）
+
+        动画图片调整尺寸时只输出第一帧，不视为不变。
+        """
+        if info is None or info.frames != 1:
+            return False
+        return ImageProcessor.calc_resize_size(info.size, width, height, keep_ratio) == info.size
+    
+    @staticmethod
+    def draft_for_size(img, size):
+        """在解码前选择目标尺寸允许的最低解码分辨率
+
+        对JPEG使用DCT缩放（draft），解码尺寸不小于目标尺寸的 RESIZE_REDUCING_GAP 倍，
+        保证后续高质量重采样仍有足够的像素。其他格式不做处理。
+        必须在访问像素数据之前调用，已解码的图片不受影响。
+        """
+        if img.format != 'JPEG':
+            return
+        if size[0] >= img.width or size[1] >= img.height:
+            return
+        img.draft(img.mode, (int(size[0] * RESIZE_REDUCING_GAP),
+                             int(size[1] * RESIZE_REDUCING_GAP)))
     
     @staticmethod
-    def _preview_exposure(img, brightness_factor):
+    def _preview_exposure(img, brightness_factor, **tone):
         """预览曝光度调整效果"""
-        if img.mode in ('RGBA', 'LA'):
-            alpha = img.getchannel('A')
-            img = img.convert('RGB')
-            enhancer = ImageEnhance.Brightness(img)
-            adjusted = enhancer.enhance(brightness_factor)
-            adjusted = adjusted.convert('RGBA')
-            adjusted.putalpha(alpha)
-            return adjusted
-        else:
-            enhancer = ImageEnhance.Brightness(img)
-            return enhancer.enhance(brightness_factor)
+        return ImageProcessor.exposure_image(img, brightness_factor, **tone)
+    
+    @staticmethod
+    def exposure_image(img, brightness_factor, contrast=1.0, gamma=1.0, levels=TONE_LEVELS):
+        """调整内存中图片的曝光度、对比度、伽马和色阶
+
+        所有调整合成一张256项的查找表（见 tone_lut），每个颜色通道只查表一次，
+        透明通道原样保留，图片模式不变（L、LA、RGB、RGBA；调色板图片只调整调色板）。
+        16位灰度使用65536项的查找表，结果为 I;16，不损失位深；其他模式先由 _band_image 规范为上述模式之一。
+        """
+        if img.mode in GRAY16_MODES:
+            return _point16(img, _tone_tables16(brightness_factor, contrast, gamma, tuple(levels)))
+        lut = ImageProcessor.tone_lut(brightness_factor, contrast, gamma, levels)
+        if img.mode == 'P':
+            return _tone_palette(img, lut)
+        img = _band_image(img)
+        color_bands, alpha_bands = BAND_LAYOUTS[img.mode]
+        return img.point(lut * color_bands + _IDENTITY_LUT * alpha_bands)
+    
+    @staticmethod
+    def tone_lut(brightness_factor=1.0, contrast=1.0, gamma=1.0, levels=TONE_LEVELS, depth=8):
+        """生成色调调整的查找表（depth=8时256项，depth=16时65536项，参数仍按0-255刻度），依次应用：
+
+        1. 色阶 levels=(黑点, 白点)：把输入的 [黑点, 白点] 拉伸到 [0, 255]
+        2. 伽马：大于1时提亮暗部，out = 255 * (x / 255) ** (1 / gamma)
+        3. 亮度：乘以 brightness_factor（按单精度计算，只调亮度时与 ImageEnhance.Brightness 结果相同）
+        4. 对比度：以中灰128为中心缩放（不依赖图片的平均亮度，预览缩略图和原图结果一致）
+        中间结果不取整，最后截断取整并限制在 0-255。
+        """
+        black, white = levels
+        if not 0 <= black < white <= 255:
+            raise ValueError(f"色阶应满足 0 <= 黑点 < 白点 <= 255: {levels}")
+        if gamma <= 0 or contrast < 0 or brightness_factor < 0:
+            raise ValueError("伽马必须大于0，亮度和对比度不能为负数")
+        
+        brightness = _float32(brightness_factor)
+        scale = 257 if depth == 16 else 1  # 16位值 / 257 为0-255刻度
+        top = 255 * scale
+        lut = []
+        for value in range(top + 1):
+            x = value / scale if scale != 1 else float(value)
+            if (black, white) != TONE_LEVELS:
+                x = min(max((x - black) / (white - black), 0.0), 1.0) * 255
+            if gamma != 1.0:
+                x = 255 * (x / 255) ** (1 / gamma)
+            if brightness_factor != 1.0:
+                x = min(_float32(x * brightness), 255.0)
+            if contrast != 1.0:
+                x = 128 + contrast * (x - 128)
+            lut.append(min(max(int(x * scale), 0), top))
+        return lut
+    
+    @staticmethod
+    def random_adjust_image(img, max_rotation, angle=None, rng=None):
+        """随机旋转内存中的图片并裁剪回原始尺寸，指定angle时使用固定角度
+
+        放大、旋转和居中裁剪合成为一次仿射变换，直接按原始尺寸采样，只重采样一次。
+        rng 为 random.Random 实例（见 random_rng），默认使用模块级的随机数。
+        """
+        width, height = img.size
+        if angle is None:
+            angle = (rng or random).uniform(-max_rotation, max_rotation)
+        
+        radian = math.radians(abs(angle))
+        cos_a = math.cos(radian)
+        sin_a = math.sin(radian)
+        new_width = int(width * cos_a + height * sin_a)
+        new_height = int(height * cos_a + width * sin_a)
+        
+        scale = max(width / new_width, height / new_height)
+        scale *= 1.2
+        
+        # 输出像素 -> 源像素：以中心为原点逆向旋转（与 Image.rotate 相同的方向）再缩小scale倍
+        radian = math.radians(angle)
+        a, b = math.cos(radian) / scale, math.sin(radian) / scale
+        cx, cy = width / 2, height / 2
+        matrix = (a, -b, cx - a * cx + b * cy,
+                  b, a, cy - b * cx - a * cy)
+        return img.transform(img.size, Image.Transform.AFFINE, matrix, Image.Resampling.BICUBIC)
+    
+    @staticmethod
+    def random_rng(seed, key, variant=0):
+        """单个任务的随机数生成器
+
+        seed为None时每个任务使用独立的随机种子；否则由 seed、key（批处理中为输出的相对路径，见 _task_key）
+        和变体序号确定，
+        与线程、进程和处理顺序无关，相同参数重复运行得到相同的结果。
+        """
+        if seed is None:
+            return random.Random()
+        return random.Random(f"{seed}:{key}:{variant}")
     
     @staticmethod
     def _preview_filter(img, filter_type):
         """预览滤镜效果"""
+        return ImageProcessor.filter_image(img, filter_type)
+
+    @staticmethod
+    def filter_image(img, filter_type):
+        """对内存中的图片应用滤镜，所有滤镜均为整图操作
+
+        图片先由 _band_image 规范为 L、LA、RGB 或 RGBA，滤镜只作用于颜色通道，透明通道原样保留；
+        单通道图片除颜色矩阵滤镜外保持单通道（灰度滤镜输出 L/LA）。
+        16位灰度的灰度、查找表和卷积滤镜按16位精度处理（结果为 I;16），
+        颜色矩阵滤镜输出彩色，先按比例缩放为8位。
+
+        Args:
+            img: PIL.Image对象
+            filter_type: 滤镜类型，见 COLOR_MATRIX_FILTERS、LUT_FILTERS、KERNEL_FILTERS 及 'grayscale'
+        Returns:
+            处理后的PIL.Image对象
+        """
+        if img.mode in GRAY16_MODES and filter_type not in COLOR_MATRIX_FILTERS:
+            return _filter_gray16(img, filter_type)
+        img = _band_image(img)
+        color_bands, alpha_bands = BAND_LAYOUTS[img.mode]
+
         if filter_type == 'grayscale':
-            return img.convert('L').convert('RGB')
-        elif filter_type == 'blur':
-            from PIL import ImageFilter
-            return img.filter(ImageFilter.GaussianBlur(radius=2))
-        elif filter_type == 'sharpen':
+            if color_bands == 1:
+                return img.copy()
+            return img.convert('LA' if alpha_bands else 'L')
+        elif filter_type in COLOR_MATRIX_FILTERS:
+            if color_bands == 1:
+                img = img.convert('RGBA' if alpha_bands else 'RGB')
+            return ImageProcessor._apply_color_matrix(img, COLOR_MATRIX_FILTERS[filter_type])
+        elif filter_type in LUT_FILTERS:
+            return img.point(LUT_FILTERS[filter_type] * color_bands + _IDENTITY_LUT * alpha_bands)
+        elif filter_type in KERNEL_FILTERS:
             from PIL import ImageFilter
-            return img.filter(ImageFilter.SHARPEN)
-        elif filter_type == 'contour':
-            from PIL import ImageFilter
-            return img.filter(ImageFilter.CONTOUR)
-        return img
+            name, params = KERNEL_FILTERS[filter_type]
+            kernel = getattr(ImageFilter, name)
+            # 卷积逐通道进行，之后用原透明通道覆盖被卷积的透明通道
+            filtered = img.filter(kernel(**params) if params is not None else kernel)
+            if alpha_bands:
+                filtered.putalpha(img.getchannel('A'))
+            return filtered
+        # 默认不做处理
+        return img.copy()
+
+    @staticmethod
+    def _apply_color_matrix(img, matrix):
+        """对RGB/RGBA图片的颜色通道应用3x3颜色矩阵，结果截断取整并限制在255以内，透明通道原样保留
+
+        有NumPy时按行分块以float64计算，与逐像素公式 int(a*r + b*g + c*b) 结果完全一致；
+        否则使用Pillow的矩阵转换（个别像素可能因单精度舍入相差1）。
+        """
+        np = _import_numpy()
+        if np is None:
+            flat = []
+            for row in matrix:
+                # Pillow内部会加0.5后截断，这里抵消以得到截断取整
+                flat.extend(row + (-0.5,))
+            if img.mode == 'RGBA':
+                # Pillow的矩阵转换只接受RGB输入
+                filtered = img.convert('RGB').convert('RGB', tuple(flat))
+                filtered.putalpha(img.getchannel('A'))
+                return filtered
+            return img.convert('RGB', tuple(flat))
+
+        src = np.asarray(img)
+        height, width, bands = src.shape
+        out = np.empty((height, width, bands), dtype=np.uint8)
+        if bands == 4:
+            out[..., 3] = src[..., 3]
+        rows = max(1, _MATRIX_CHUNK_PIXELS // max(width, 1))
+        # 复用两个分块大小的累加缓冲区，避免每块重新分配
+        acc = np.empty((rows, width), dtype=np.float64)
+        tmp = np.empty((rows, width), dtype=np.float64)
+        for top in range(0, height, rows):
+            block = src[top:top + rows]
+            n = block.shape[0]
+            a, t = acc[:n], tmp[:n]
+            for channel, (cr, cg, cb) in enumerate(matrix):
+                # 运算顺序与 cr*r + cg*g + cb*b 相同，保证结果逐位一致
+                np.multiply(block[..., 0], cr, out=a)
+                np.multiply(block[..., 1], cg, out=t)
+                a += t
+                np.multiply(block[..., 2], cb, out=t)
+                a += t
+                np.clip(a, 0, 255, out=a)
+                # 赋值给uint8时向零截断，等同于 int()
+                out[top:top + n, :, channel] = a
+        return Image.fromarray(out, img.mode)
 
     @staticmethod
-    def resize_image(image_path, output_path, width=None, height=None, keep_ratio=True, callback=None):
-        """调整图片尺寸"""
+    def resize_image(image_path, output_path, width=None, height=None, keep_ratio=True, callback=None,
+                     encoder=None):
+        """调整图片尺寸，encoder 为输出编码设置 OutputEncoder，默认按扩展名保持原格式
+
+        未指定输出编码且尺寸不变的单帧图片不解码，直接复制源文件字节（与 is_noop_resize 一致）。
+
+        Returns:
+            直接复制时返回 {'copied': True}，否则返回None
+        """
         try:
             # 使用with语句确保图片文件正确关闭
             with Image.open(image_path) as img:
-                original_width, original_height = img.size
-                new_width = width
-                new_height = height
-                
-                if keep_ratio:
-                    if width and height:
-                        ratio_w = width / original_width
-                        ratio_h = height / original_height
-                        ratio = min(ratio_w, ratio_h)
-                        new_width = int(original_width * ratio)
-                        new_height = int(original_height * ratio)
-                    elif width:
-                        ratio = width / original_width
-                        new_width = width
-                        new_height = int(original_height * ratio)
-                    else:
-                        ratio = height / original_height
-                        new_height = height
-                        new_width = int(original_width * ratio)
-                
-                # 优化内存使用：对于大图片，先缩小再处理
-                if original_width > 3000 or original_height > 3000:
-                    # 先进行粗略缩小以减少内存使用
-                    intermediate_size = (min(original_width, 3000), min(original_height, 3000))
-                    img.thumbnail(intermediate_size, Image.Resampling.LANCZOS)
-                
-                resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                resized_img.save(output_path)
+                size = ImageProcessor.calc_resize_size(img.size, width, height, keep_ratio)
+                if encoder is None and _copy_if_unchanged(img, image_path, output_path, size):
+                    if callback:
+                        callback()
+                    return {'copied': True}
+                _decode_image(img, size)
+                resized_img = ImageProcessor.scale_image(img, width, height, keep_ratio)
+                (encoder or DEFAULT_ENCODER).save(resized_img, output_path)
                 
                 if callback:
                     callback()
@@ -134,64 +584,203 @@ class ImageProcessor:
             raise
     
     @staticmethod
-    def compress_image(image_path, output_path, quality, callback=None):
-        """压缩图片"""
+    def compress_image(image_path, output_path, quality=None, callback=None, max_bytes=None,
+                       bytes_per_megapixel=None, min_quality=COMPRESS_MIN_QUALITY, encoder=None,
+                       palette_max_error=PALETTE_MAX_ERROR):
+        """压缩图片
+        
+        指定 max_bytes 或 bytes_per_megapixel（按像素数折算字节数，两者都指定时取较小值）时为目标大小模式：
+        在 min_quality 到 quality（默认95）之间二分查找不超过目标大小的最高质量，
+        每次尝试只在内存中编码，图片只解码一次，最终结果只写盘一次。
+        只对有质量参数的格式（JPEG、WebP、AVIF）查找，其他格式按原方式保存。
+        quality 优先于 encoder 中的质量设置。
+        
+        输出为PNG或GIF时忽略质量，改为保留透明度的无损优化（见 _optimize_lossless），
+        palette_max_error 为允许调色板量化的误差上限。
+        
+        Returns:
+            目标大小模式下返回本张图片的查找统计 {'quality', 'trials', 'bytes', 'target_bytes', 'fits'}；
+            无损优化时返回优化统计（见 _optimize_lossless）；否则返回None
+        """
         with Image.open(image_path) as img:
-            if img.format == 'PNG' and img.mode in ('RGBA', 'LA'):
-                img = img.convert('RGB')
-            img.save(output_path, quality=quality, optimize=True)
+            _decode_image(img)
+            encoder = encoder or DEFAULT_ENCODER
+            targets = [t for t in (max_bytes, bytes_per_megapixel and
+                                   int(bytes_per_megapixel * img.width * img.height / 1e6)) if t]
+            
+            if encoder.image_format(output_path) in LOSSLESS_OPTIMIZE_FORMATS:
+                stats = ImageProcessor._optimize_lossless(img, image_path, output_path, encoder,
+                                                          palette_max_error)
+                if targets:
+                    stats.update(quality=None, trials=1, target_bytes=min(targets),
+                                 fits=stats['bytes'] <= min(targets))
+            elif not targets:
+                if quality is None and 'quality' not in encoder.options:
+                    raise ValueError("请指定压缩质量或目标大小")
+                encoder.save(img, output_path, {'optimize': True},
+                             **({'quality': quality} if quality is not None else {}))
+                stats = None
+            else:
+                stats = ImageProcessor._compress_to_target(
+                    img, output_path, min(targets), quality or encoder.options.get('quality', 95),
+                    min_quality, encoder)
             
             if callback:
                 callback()
+            return stats
+    
+    @staticmethod
+    def _optimize_lossless(img, image_path, output_path, encoder, max_error):
+        """PNG/GIF的体积优化，保留透明度
+
+        1. 无损缩减：完全不透明的RGBA/LA去掉透明通道，各通道相同的RGB转为灰度
+        2. 调色板：真彩色图片量化为不超过256色，误差不超过max_error时采用（颜色不超过256种时无损）；
+           GIF总是调色板图片，由Pillow量化
+        3. zlib：8位及以下的图片在最高级别下比较默认和过滤两种策略，取较小者；
+           真彩色图片只用默认级别编码一次（与 optimize=True 相比体积相近而快得多）
+        4. 结果不比源文件小且格式相同时直接保留源文件的字节
+        encoder 中指定的 compress_level 优先。
+
+        Returns:
+            {'bytes_in', 'bytes', 'saved', 'mode', 'palette', 'palette_error', 'compress_level', 'kept_original'}
+        """
+        image_format = encoder.image_format(output_path)
+        source_format = img.format
+        reduced = _reduce_lossless(img)
+        
+        palette_error = None
+        if reduced.mode in ('RGB', 'RGBA') and image_format != 'GIF':
+            quantized, palette_error = _try_palette(reduced, max_error)
+            if quantized is not None:
+                reduced = quantized
+        
+        compress_level = encoder.options.get('compress_level')
+        if image_format == 'GIF':
+            # GIF只能保存调色板图片，交给Pillow量化，它会为透明像素保留一个透明色索引
+            data = encoder.encode(reduced, output_path, {'optimize': True})
+        elif reduced.mode in ('P', 'L', '1', 'LA'):
+            compress_level = 9 if compress_level is None else compress_level
+            # 0: Z_DEFAULT_STRATEGY，1: Z_FILTERED
+            data = min((encoder.encode(reduced, output_path, compress_level=compress_level, compress_type=strategy)
+                        for strategy in (0, 1)), key=len)
+        else:
+            compress_level = 6 if compress_level is None else compress_level
+            data = encoder.encode(reduced, output_path, compress_level=compress_level)
+        
+        original = _read_source_bytes(image_path)
+        kept_original = source_format == image_format and original is not None and len(original) <= len(data)
+        if kept_original:
+            data = original
+        _write_encoded(output_path, data)
+        
+        bytes_in = len(original) if original is not None else None
+        if kept_original:
+            # 写出的是源文件本身，汇报源文件的模式，丢弃的候选不计入调色板转换
+            mode, palette, palette_error, compress_level = img.mode, False, None, None
+        else:
+            mode = 'P' if image_format == 'GIF' else reduced.mode
+            palette = img.mode != 'P' and (image_format == 'GIF' or reduced.mode == 'P')
+        return {
+            'bytes_in': bytes_in,
+            'bytes': len(data),
+            'saved': bytes_in - len(data) if bytes_in is not None else None,
+            'mode': mode,
+            'palette': palette,
+            'palette_error': round(palette_error, 3) if palette_error is not None else None,
+            'compress_level': compress_level,
+            'kept_original': kept_original,
+        }
+    
+    @staticmethod
+    def _compress_to_target(img, output_path, target_bytes, max_quality, min_quality, encoder):
+        """二分查找不超过target_bytes的最高质量并写出，返回查找统计
+
+        连最低质量也超出目标时写出最低质量的结果，统计中 fits 为False。
+        """
+        if encoder.image_format(output_path) not in QUALITY_FORMATS:
+            data = encoder.encode(img, output_path, {'optimize': True})
+            _write_encoded(output_path, data)
+            return {'quality': None, 'trials': 1, 'bytes': len(data),
+                    'target_bytes': target_bytes, 'fits': len(data) <= target_bytes}
+        
+        min_quality = min(min_quality, max_quality)
+        trials = {}
+        
+        def encode(q):
+            if q not in trials:
+                trials[q] = encoder.encode(img, output_path, {'optimize': True}, quality=q)
+            return trials[q]
+        
+        # 文件大小随质量单调增加：先试最高质量，超出时在 [min_quality, max_quality) 中查找。
+        # 按区间两端的字节数线性插值猜测质量（下端未尝试时以 (质量0, 0字节) 代替）；
+        # 猜测限制在尝试后两侧剩余区间都能在剩余次数内二分完成的范围内，猜测落到区间端点上后改为只取中点，
+        # 因此区间内的尝试次数不超过二分的 ceil(log2(区间大小 + 1)) 次
+        best = None
+        if len(encode(max_quality)) <= target_bytes:
+            best = max_quality
+        else:
+            low, high = min_quality, max_quality - 1
+            remaining = math.ceil(math.log2(high - low + 2))
+            interpolate = True
+            while low <= high:
+                quality = (low + high) // 2
+                if interpolate:
+                    below_q = low - 1 if low - 1 in trials else 0
+                    below = len(trials[below_q]) if below_q else 0
+                    above = len(trials[high + 1])
+                    guess = int(below_q + (target_bytes - below) * (high + 1 - below_q) / (above - below))
+                    if low < guess < high:
+                        # 本次尝试后剩余区间不能超过 2 ** (remaining - 1) - 1
+                        span = 2 ** (remaining - 1) - 1
+                        quality = min(max(guess, high - span), low + span)
+                    else:
+                        interpolate = False
+                if len(encode(quality)) <= target_bytes:
+                    best = quality
+                    low = quality + 1
+                else:
+                    high = quality - 1
+                remaining -= 1
+        fits = best is not None
+        quality = best if fits else min_quality
+        data = encode(quality)
+        _write_encoded(output_path, data)
+        return {'quality': quality, 'trials': len(trials), 'bytes': len(data),
+                'target_bytes': target_bytes, 'fits': fits}
     
     @staticmethod
-    def random_adjust(image_path, output_path, max_rotation, callback=None):
-        """随机微调图片"""
+    def random_adjust(image_path, output_path, max_rotation, callback=None, encoder=None, seed=None,
+                      variants=1):
+        """随机微调图片
+
+        每张图片只解码一次，生成 variants 个不同角度的变体：第1个保存到 output_path，
+        其余保存为同目录下的 名称_2.扩展名、名称_3.扩展名 ……
+        指定 seed 时角度由 seed 和输出的相对路径确定，可重复（见 random_rng）。
+        """
+        encoder = encoder or DEFAULT_ENCODER
+        if variants > 1 and not isinstance(output_path, (str, os.PathLike)):
+            # 内存输出（混合后端、tar分片等写入器）只能容纳一个结果
+            raise ValueError("生成多个变体需要输出到文件夹，不支持混合后端或tar分片等写入器输出")
+        key = _task_key(output_path)
         with Image.open(image_path) as img:
-            width, height = img.size
-            angle = random.uniform(-max_rotation, max_rotation)
-            
-            radian = math.radians(abs(angle))
-            cos_a = math.cos(radian)
-            sin_a = math.sin(radian)
-            new_width = int(width * cos_a + height * sin_a)
-            new_height = int(height * cos_a + width * sin_a)
-            
-            scale = max(width / new_width, height / new_height)
-            scale *= 1.2
-            
-            enlarged_size = (int(img.size[0] * scale), int(img.size[1] * scale))
-            img = img.resize(enlarged_size, Image.Resampling.LANCZOS)
-            img = img.rotate(angle, Image.BICUBIC, expand=False)
-            
-            left = (img.size[0] - width) // 2
-            top = (img.size[1] - height) // 2
-            img = img.crop((left, top, left + width, top + height))
-            img.save(output_path)
+            _decode_image(img)
+            for variant in range(variants):
+                rng = ImageProcessor.random_rng(seed, key, variant)
+                adjusted = ImageProcessor.random_adjust_image(img, max_rotation, rng=rng)
+                encoder.save(adjusted, variant_path(output_path, variant))
             
             if callback:
                 callback()
     
     @staticmethod
-    def adjust_exposure(image_path, output_path, brightness_factor, callback=None):
-        """调整图片曝光度"""
+    def adjust_exposure(image_path, output_path, brightness_factor, callback=None, encoder=None,
+                        contrast=1.0, gamma=1.0, levels=TONE_LEVELS):
+        """调整图片曝光度，可同时调整对比度、伽马和色阶（见 tone_lut）"""
         try:
             with Image.open(image_path) as img:
-                if img.mode in ('RGBA', 'LA'):
-                    alpha = img.getchannel('A')
-                    img = img.convert('RGB')
-                    enhancer = ImageEnhance.Brightness(img)
-                    adjusted = enhancer.enhance(brightness_factor)
-                    adjusted = adjusted.convert('RGBA')
-                    adjusted.putalpha(alpha)
-                else:
-                    enhancer = ImageEnhance.Brightness(img)
-                    adjusted = enhancer.enhance(brightness_factor)
-                
-                if adjusted.mode == 'RGBA':
-                    adjusted.save(output_path, 'PNG')
-                else:
-                    adjusted.save(output_path, quality=95, optimize=True)
+                _decode_image(img)
+                adjusted = ImageProcessor.exposure_image(img, brightness_factor, contrast, gamma, levels)
+                ImageProcessor._save_adjusted(adjusted, output_path, encoder=encoder)
                     
                 if callback:
                     callback()
@@ -200,79 +789,24 @@ class ImageProcessor:
             raise
             
     @staticmethod
-    def apply_filter(image_path, output_path, filter_type, callback=None):
+    def apply_filter(image_path, output_path, filter_type, callback=None, encoder=None):
         """应用滤镜效果
         
         Args:
             image_path: 输入图片路径
             output_path: 输出图片路径
-            filter_type: 滤镜类型，可选值：'grayscale', 'sepia', 'negative', 'blur', 'sharpen', 'contour'
+            filter_type: 滤镜类型，可选值：'grayscale', 'sepia', 'negative', 'blur', 'sharpen', 'contour',
+                'warm', 'cool', 'vintage'
             callback: 回调函数
+            encoder: 输出编码设置 OutputEncoder，默认按扩展名保持原格式
         """
         try:
             with Image.open(image_path) as img:
-                # 保存透明通道（如果有）
-                has_alpha = img.mode in ('RGBA', 'LA')
-                if has_alpha:
-                    alpha = img.getchannel('A')
-                    img = img.convert('RGB')
-                
-                # 应用不同的滤镜效果
-                if filter_type == 'grayscale':
-                    # 灰度
-                    filtered = img.convert('L').convert('RGB')
-                
-                elif filter_type == 'sepia':
-                    # 复古棕褐色
-                    img = img.convert('RGB')
-                    filtered = Image.new('RGB', img.size)
-                    for x in range(img.width):
-                        for y in range(img.height):
-                            r, g, b = img.getpixel((x, y))
-                            # 棕褐色算法
-                            tr = int(0.393 * r + 0.769 * g + 0.189 * b)
-                            tg = int(0.349 * r + 0.686 * g + 0.168 * b)
-                            tb = int(0.272 * r + 0.534 * g + 0.131 * b)
-                            filtered.putpixel((x, y), (min(tr, 255), min(tg, 255), min(tb, 255)))
-                
-                elif filter_type == 'negative':
-                    # 负片效果
-                    img = img.convert('RGB')
-                    filtered = Image.new('RGB', img.size)
-                    for x in range(img.width):
-                        for y in range(img.height):
-                            r, g, b = img.getpixel((x, y))
-                            filtered.putpixel((x, y), (255-r, 255-g, 255-b))
-                
-                elif filter_type == 'blur':
-                    # 模糊效果
-                    from PIL import ImageFilter
-                    filtered = img.filter(ImageFilter.GaussianBlur(radius=2))
-                
-                elif filter_type == 'sharpen':
-                    # 锐化效果
-                    from PIL import ImageFilter
-                    filtered = img.filter(ImageFilter.SHARPEN)
-                
-                elif filter_type == 'contour':
-                    # 轮廓效果
-                    from PIL import ImageFilter
-                    filtered = img.filter(ImageFilter.CONTOUR)
-                
-                else:
-                    # 默认不做处理
-                    filtered = img.copy()
-                
-                # 恢复透明通道
-                if has_alpha:
-                    filtered = filtered.convert('RGBA')
-                    filtered.putalpha(alpha)
+                _decode_image(img)
+                filtered = ImageProcessor.filter_image(img, filter_type)
                 
                 # 保存处理后的图片
-                if filtered.mode == 'RGBA':
-                    filtered.save(output_path, 'PNG')
-                else:
-                    filtered.save(output_path, quality=95, optimize=True)
+                ImageProcessor._save_adjusted(filtered, output_path, encoder=encoder)
                 
                 if callback:
                     callback()
@@ -281,116 +815,2286 @@ class ImageProcessor:
             raise
 
     @staticmethod
-    def process_images_batch(process_func, image_files, base_folder, output_folder, max_workers=None, progress_callback=None, **kwargs):
+    def _save_adjusted(img, output_path, quality=None, encoder=None):
+        """保存调整后的图片，默认质量95；指定quality时优先于encoder中的质量设置"""
+        (encoder or DEFAULT_ENCODER).save(img, output_path, {'quality': 95, 'optimize': True},
+                                          **({'quality': quality} if quality is not None else {}))
+
+    @staticmethod
+    def run_pipeline(image_path, output_path, operations, callback=None, encoder=None):
+        """对单张图片依次执行多个操作，只解码和编码一次
+        
+        Args:
+            image_path: 输入图片路径
+            output_path: 输出图片路径
+            operations: 有序的操作列表 [(操作名, 参数字典)]，操作名见 PIPELINE_OPERATIONS，例如
+                [('resize', {'width': 800}), ('exposure', {'brightness_factor': 1.2}),
+                 ('filter', {'filter_type': 'sepia'}), ('compress', {'quality': 80})]
+                'compress' 只决定最终编码质量（默认95），不会额外编码
+            callback: 回调函数
+            encoder: 输出编码设置 OutputEncoder，默认按扩展名保持原格式
+        Returns:
+            只有调整尺寸且尺寸不变、直接复制时返回 {'copied': True}，否则返回None
+        """
+        ImageProcessor.validate_pipeline(operations)
+        try:
+            with Image.open(image_path) as img:
+                # 第一步是缩小时按目标尺寸降低JPEG解码分辨率
+                first_op, first_params = operations[0] if operations else (None, None)
+                size = ImageProcessor.calc_resize_size(img.size, **first_params) if first_op == 'resize' else None
+                # 只有调整尺寸且尺寸不变时与 resize_image 一样直接复制
+                if len(operations) == 1 and encoder is None and _copy_if_unchanged(img, image_path, output_path, size):
+                    if callback:
+                        callback()
+                    return {'copied': True}
+                _decode_image(img, size)
+                quality = None
+                for op, params in operations:
+                    if op == 'resize':
+                        img = ImageProcessor.scale_image(img, **params)
+                    elif op == 'exposure':
+                        img = ImageProcessor.exposure_image(img, **params)
+                    elif op == 'filter':
+                        img = ImageProcessor.filter_image(img, **params)
+                    elif op == 'random':
+                        params = dict(params)
+                        rng = ImageProcessor.random_rng(params.pop('seed', None), _task_key(output_path))
+                        img = ImageProcessor.random_adjust_image(img, rng=rng, **params)
+                    elif op == 'compress':
+                        quality = params['quality']
+                
+                ImageProcessor._save_adjusted(img, output_path, quality, encoder)
+                
+                if callback:
+                    callback()
+        except Exception as e:
+            print(f"执行组合处理时出错: {str(e)}")
+            raise
+
+    @staticmethod
+    def validate_pipeline(operations):
+        """检查操作列表是否有效，无效时抛出ValueError"""
+        if not operations:
+            raise ValueError("操作列表为空")
+        for op, params in operations:
+            if op not in PIPELINE_OPERATIONS:
+                raise ValueError(f"未知的操作: {op}")
+            required, optional = PIPELINE_OPERATIONS[op]
+            missing = [name for name in required if name not in params]
+            if missing:
+                raise ValueError(f"操作 {op} 缺少参数: {', '.join(missing)}")
+            unknown = [name for name in params if name not in required and name not in optional]
+            if unknown:
+                raise ValueError(f"操作 {op} 不支持参数: {', '.join(unknown)}")
+            if op == 'resize' and params.get('width') is None and params.get('height') is None:
+                raise ValueError("操作 resize 需要指定 width 或 height")
+            if op == 'filter' and params['filter_type'] not in FILTER_TYPES:
+                raise ValueError(f"未知的滤镜类型: {params['filter_type']}")
+
+    @staticmethod
+    def plan_batch(process_func, image_files, base_folder, image_info, largest_first=True, **kwargs):
+        """估算每张图片的处理耗时和输出大小，生成处理计划 BatchPlan
+
+        成本按像素数、源格式和输出格式、操作估算（系数见 DECODE_SECONDS_PER_MP 等），
+        只用于排序和预估，不读取像素。largest_first 为True时按预计耗时从大到小排列，最耗时的图片先开始，
+        避免最后只剩一个工作线程处理大图；为False时保持 image_files 的顺序。
+        调整尺寸后尺寸不变的单帧图片（且未指定输出编码）同时列入 unchanged，处理时由 resize_image 直接复制，
+        按复制估算（耗时为0，输出为源文件大小）。
+
+        Args:
+            image_info: {相对路径: ImageInfo}（见 ImageMetadataIndex.scan），缺少的图片按0成本排在最后
+            **kwargs: 与 process_images_batch 相同的处理参数（含 encoder）
+        """
+        name = getattr(process_func, '__name__', '')
+        if name == 'run_pipeline':
+            steps = list(kwargs.get('operations') or ())
+        elif name in BATCH_FUNCTION_STEPS:
+            steps = [(BATCH_FUNCTION_STEPS[name], kwargs)]
+        else:
+            steps = []
+        encoder = kwargs.get('encoder')
+        plan = BatchPlan()
+        for image_file in image_files:
+            info = image_info.get(image_file)
+            unchanged = (encoder is None and len(steps) == 1 and steps[0][0] == 'resize'
+                         and ImageProcessor.is_noop_resize(info, steps[0][1].get('width'), steps[0][1].get('height'),
+                                                           steps[0][1].get('keep_ratio', True)))
+            if info is None:
+                plan.add(PlannedTask(image_file, 0, None, 0.0, 0))
+                continue
+            try:
+                source_bytes = os.path.getsize(os.path.join(base_folder, image_file))
+            except OSError:
+                source_bytes = 0
+            if unchanged:
+                plan.unchanged.append(image_file)
+                plan.add(PlannedTask(image_file, info.pixels, info.size, 0.0, source_bytes))
+                continue
+            output_name = _output_name(image_file, kwargs)
+            output_format = encoder.image_format(output_name) if encoder else _output_format(output_name)
+            seconds, output_size, output_bytes = ImageProcessor.estimate_task(
+                info, source_bytes, steps, output_format, search=(name == 'compress_image'))
+            variants = kwargs.get('variants', 1) if name == 'random_adjust' else 1
+            plan.add(PlannedTask(image_file, info.pixels, output_size, seconds * variants, output_bytes * variants))
+        if largest_first:
+            plan.tasks.sort(key=lambda task: -task.seconds)
+        return plan
+    
+    @staticmethod
+    def estimate_task(info, source_bytes, steps, output_format, search=False):
+        """估算单张图片的处理，返回 (耗时秒数, 输出尺寸, 输出字节数)
+
+        search 为True时按 compress_image 估算：目标大小压缩需多次试编码，PNG/GIF比较多个无损候选
+        """
+        def mp(size):
+            return size[0] * size[1] / 1e6
+        
+        size = info.size
+        decode_mp = info.pixels / 1e6
+        seconds = 0.0
+        compress = {}
+        for index, (op, params) in enumerate(steps):
+            if op == 'resize':
+                new_size = ImageProcessor.calc_resize_size(size, params.get('width'), params.get('height'),
+                                                           params.get('keep_ratio', True))
+                if index == 0 and info.format == 'JPEG':
+                    # 与 draft_for_size 一致：JPEG按目标尺寸以1/2、1/4、1/8的比例解码
+                    scale = 1
+                    while (scale < 8 and size[0] / (scale * 2) >= new_size[0] * RESIZE_REDUCING_GAP
+                           and size[1] / (scale * 2) >= new_size[1] * RESIZE_REDUCING_GAP):
+                        scale *= 2
+                    size = (size[0] // scale, size[1] // scale)
+                    decode_mp = mp(size)
+                seconds += STEP_SECONDS_PER_MP['resize'] * mp(size)
+                size = new_size
+            elif op == 'filter':
+                seconds += FILTER_SECONDS_PER_MP.get(params.get('filter_type'), _DEFAULT_SECONDS_PER_MP) * mp(size)
+            else:
+                if op == 'compress':
+                    compress = params
+                seconds += STEP_SECONDS_PER_MP.get(op, _DEFAULT_SECONDS_PER_MP) * mp(size)
+        seconds += DECODE_SECONDS_PER_MP.get(info.format, _DEFAULT_SECONDS_PER_MP) * decode_mp
+        
+        target_bytes = None
+        encodes = 1
+        if search and (compress.get('max_bytes') or compress.get('bytes_per_megapixel')):
+            target_bytes = min(filter(None, (compress.get('max_bytes'),
+                                             int((compress.get('bytes_per_megapixel') or 0) * mp(size)) or None)))
+            encodes = _TARGET_SEARCH_ENCODES
+        elif search and output_format in LOSSLESS_OPTIMIZE_FORMATS:
+            encodes = _LOSSLESS_CANDIDATES
+        seconds += ENCODE_SECONDS_PER_MP.get(output_format, _DEFAULT_SECONDS_PER_MP) * mp(size) * encodes
+        
+        if output_format == info.format and source_bytes and info.pixels:
+            output_bytes = int(source_bytes * size[0] * size[1] / info.pixels)
+        else:
+            output_bytes = int(OUTPUT_BYTES_PER_MP.get(output_format, 3 * 1024 * 1024) * mp(size))
+        if target_bytes:
+            output_bytes = min(output_bytes, target_bytes)
+        return seconds, size, output_bytes
+    
+    @staticmethod
+    def process_images_batch(process_func, image_files, base_folder, output_folder, max_workers=None,
+                             progress_callback=None, backend='thread', chunksize=None,
+                             max_in_flight=None, manifest=None, metrics=None, control=None, sink=None,
+                             memory_budget=None, **kwargs):
         """批量处理图片
         
+        任务以有界窗口提交：同时在途的任务不超过 max_in_flight 个，
+        结果按完成顺序处理，输入按需读取，内存占用与批量大小无关。
+        
         Args:
-            process_func: 处理函数 (resize_image, compress_image等)
-            image_files: 图片文件列表
+            process_func: 处理函数 (resize_image, compress_image等)，进程后端要求可被pickle
+            image_files: 图片文件列表，也可以是生成器等可迭代对象（边产出边处理）
             base_folder: 基础文件夹路径
             output_folder: 输出文件夹路径
-            max_workers: 最大工作线程数，默认为None（使用系统默认值）
-            progress_callback: 进度回调函数
+            max_workers: 最大工作线程/进程数，默认为None（使用系统默认值）
+            progress_callback: 进度回调函数 progress_callback(已处理数, 总数)，总数未知时为None
+            backend: 执行后端，'thread'、'process' 或 'hybrid'，见 BATCH_BACKENDS
+            chunksize: 进程后端每块的文件数，默认为None（按文件大小自动打包，文件总数已知时按进程数限制每块的文件数）
+            max_in_flight: 同时在途的任务数（进程后端为任务块数），默认为工作线程/进程数的2倍
+            manifest: 输出清单 OutputManifest，提供时跳过输出已是最新的图片，
+                并在每张图片处理成功后立即记录，中断后重新运行即可续跑
+            metrics: 分阶段统计 BatchMetrics，提供时记录每张图片的读取、解码、处理、编码、
+                写入耗时和字节数、像素数、工作线程/进程，默认为None（不统计，几乎没有额外开销）
+            control: 暂停/取消控制 BatchControl，取消后已完成的图片保留（有清单时可续跑）
+            sink: 输出写入器（如 ShardedTarSink），提供时处理结果编码到内存后交给 sink.write(输出相对路径, 字节)，
+                不再写入 output_folder；调用方负责关闭。不能与 manifest 同时使用
+            memory_budget: 内存预算 MemoryBudget，提供时提交前读取文件头估算每个任务的内存工作集
+                （见 estimate_memory），在途任务的估算总和不超过预算；超出预算的单个任务在没有
+                其他任务时单独运行。默认为None（只受 max_in_flight 限制）
             **kwargs: 传递给处理函数的其他参数
         
         Returns:
-            成功处理的图片数量
+            成功处理的图片数量（不含跳过的图片，跳过数量见 manifest.skipped；是否被取消见 control.cancelled）
         """
-        total_files = len(image_files)
-        processed_count = [0]  # Use list to allow modification in closure
-        errors = []
-        lock = threading.Lock()
+        if backend not in BATCH_BACKENDS:
+            raise ValueError(f"未知的执行后端: {backend}")
+        if sink is not None and manifest is not None:
+            raise ValueError("输出到写入器时不支持增量处理")
+        
+        total_files = _count_files(image_files)
+        if backend == 'thread':
+            workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        else:
+            workers = max_workers or os.cpu_count() or 1
+        window = max_in_flight or workers * 2
+        budget = memory_budget
+        progress = _BatchProgress(total_files, progress_callback)
+        if metrics is not None:
+            metrics.start(getattr(process_func, '__name__', str(process_func)), backend, workers)
+        
+        if manifest is not None:
+            params_key = OutputManifest.params_key(process_func, kwargs)
+            image_files = manifest.filter_pending(
+                image_files, base_folder, output_folder, params_key, on_skip=progress.advance,
+                output_name=lambda image_file: _output_name(image_file, kwargs))
+            on_success = lambda image_file: manifest.record(image_file, params_key)
+        else:
+            on_success = None
+        
+        try:
+            if backend == 'thread':
+                return ImageProcessor._process_batch_threads(
+                    process_func, image_files, base_folder, output_folder,
+                    workers, window, progress, on_success, metrics, control, sink, budget, **kwargs)
+            
+            max_files = _CHUNK_MAX_FILES
+            if total_files:
+                max_files = max(1, min(max_files, math.ceil(total_files / (_CHUNKS_PER_WORKER * workers))))
+            chunks = _iter_chunks(image_files, base_folder, chunksize, max_files)
+            return ImageProcessor._process_batch_pool(
+                process_func, chunks, base_folder, output_folder,
+                workers, window, progress, on_success, metrics, control, sink, budget,
+                hybrid=(backend == 'hybrid'), **kwargs)
+        finally:
+            if metrics is not None:
+                metrics.finish()
+
+    @staticmethod
+    def _process_batch_threads(process_func, image_files, base_folder, output_folder,
+                               workers, window, progress, on_success, metrics, control, sink, budget,
+                               **kwargs):
+        """线程池后端，有写入器时各线程编码到内存后直接写入写入器"""
+        processed_count = 0
+        measure = metrics is not None
 
         def process_single_image(image_file):
+            # 已在队列中的任务开始前检查暂停/取消，并给预览等交互任务让路
+            if control is not None and not control.wait_resumed():
+                return None, None
+            INTERACTIVE_LANE.yield_to_interactive()
+            record = _new_metrics_record() if measure else None
             try:
                 input_path = os.path.join(base_folder, image_file)
-                output_path = os.path.join(output_folder, image_file)
+                output_name = _output_name(image_file, kwargs)
+                if sink is not None:
+                    output = _memory_output(output_name)
+                    _call_measured(record, process_func, input_path, output, kwargs, output_name)
+                    _sink_write(sink, output_name, output.getvalue(), record)
+                    return True, record
                 
-                # 确保输出子目录存在
-                output_subdir = os.path.dirname(output_path)
-                if output_subdir and not os.path.exists(output_subdir):
-                    os.makedirs(output_subdir, exist_ok=True)
+                output_path = os.path.join(output_folder, output_name)
                 
-                def update_progress():
-                    with lock:
-                        processed_count[0] += 1
-                        if progress_callback:
-                            progress_callback(processed_count[0], total_files)
+                # 确保输出子目录存在
+                _ensure_parent_dir(output_path)
                 
                 # 调用处理函数
-                process_func(input_path, output_path, callback=update_progress, **kwargs)
+                _call_measured(record, process_func, input_path, output_path, kwargs, output_name)
                 
-                return True
+                return True, record
             except Exception as e:
                 print(f"处理图片 {image_file} 时出错: {str(e)}")
                 traceback.print_exc()
-                return False
+                return False, record
         
         # 使用线程池执行任务
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_file = {executor.submit(process_single_image, image_file): image_file 
-                             for image_file in image_files}
-            
-            # 收集处理结果
-            for future in future_to_file:
-                image_file = future_to_file[future]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 有界提交，按完成顺序收集处理结果（线程后端在任务开始时让路，提交时不再等待）
+            cost = (lambda f: ImageProcessor.estimate_memory(os.path.join(base_folder, f))) if budget else None
+            for image_file, future in _bounded_completion(
+                    lambda f: executor.submit(process_single_image, f), image_files, window, control,
+                    lane=None, budget=budget, cost=cost):
                 try:
-                    if not future.result():
-                        errors.append(image_file)
+                    ok, record = future.result()
                 except Exception as e:
                     print(f"处理图片 {image_file} 时发生异常: {str(e)}")
-                    errors.append(image_file)
+                    ok, record = False, None
+                if ok is None:
+                    continue  # 批处理已取消，未处理
+                if measure:
+                    metrics.add(image_file, ok, record)
+                if ok:
+                    processed_count += 1
+                    if on_success:
+                        on_success(image_file)
+                    progress.advance()
         
         # 返回成功处理的图片数量
-        return processed_count[0]
-
+        return processed_count
 
-class ImageFileManager:
-    def __init__(self):
-        self.history = []  # 处理历史记录
-    
     @staticmethod
-    def get_image_files(folder_path, include_subfolders=False):
-        """获取文件夹中的所有图片文件"""
-        image_extensions = ('.jpg', '.jpeg', '.png', '.gif', '.bmp')
-        image_files = []
-        
-        if include_subfolders:
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    if file.lower().endswith(image_extensions):
-                        # 获取相对路径
-                        rel_path = os.path.relpath(os.path.join(root, file), folder_path)
-                        image_files.append(rel_path)
-        else:
-            for file in os.listdir(folder_path):
-                if file.lower().endswith(image_extensions):
-                    image_files.append(file)
-        
-        return sorted(image_files)
-    
-    def ensure_output_folder(self, base_folder, suffix, params=None):
-        """确保输出文件夹存在，并根据处理参数生成文件夹名"""
-        # 根据处理参数生成文件夹名
-        folder_name = f"output_{suffix}"
-        if params:
-            param_str = "_".join(f"{k}_{v}" for k, v in params.items())
-            folder_name = f"{folder_name}_{param_str}"
+    def _process_batch_pool(process_func, chunks, base_folder, output_folder,
+                            workers, window, progress, on_success, metrics, control, sink, budget,
+                            hybrid=False, **kwargs):
+        """进程池后端和混合后端
+
+        进程后端把 (输入路径, 输出路径) 分块发给子进程；混合后端由I/O线程读取文件，
+        把原始字节发给子进程，子进程返回编码后的字节再由I/O线程写盘。
+        子进程回传每张图片的 _TaskResult：成功标志和错误信息（混合模式下另有编码结果），
+        启用统计时附带该图片的分阶段计时记录。
+        有写入器时进程后端的子进程回传编码结果，由收集结果的线程写入写入器；
+        混合后端由各I/O线程写入。
+        """
+        # 按需导入，只用线程后端时不加载multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
         
-        output_folder = os.path.join(base_folder, folder_name)
-        os.makedirs(output_folder, exist_ok=True)
+        processed_count = 0
+        measure = metrics is not None
         
-        # 记录处理历史
-        history_entry = {
-            'timestamp': os.path.getctime(output_folder),
-            'operation': suffix,
-            'params': params,
-            'output_folder': output_folder
-        }
-        self.history.append(history_entry)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            if hybrid:
+                io_pool = ThreadPoolExecutor(max_workers=window)
+                submit = lambda chunk: io_pool.submit(
+                    _run_chunk_hybrid, pool, process_func, chunk, base_folder, output_folder, kwargs,
+                    measure, sink)
+            elif sink is not None:
+                io_pool = None
+                submit = lambda chunk: pool.submit(
+                    _run_chunk_paths, process_func,
+                    [(os.path.join(base_folder, f), _output_name(f, kwargs), _output_name(f, kwargs))
+                     for f in chunk],
+                    kwargs, measure, True)
+            else:
+                io_pool = None
+                submit = lambda chunk: pool.submit(
+                    _run_chunk_paths, process_func,
+                    [(os.path.join(base_folder, f), os.path.join(output_folder, _output_name(f, kwargs)),
+                      _output_name(f, kwargs)) for f in chunk],
+                    kwargs, measure)
+            try:
+                # 有界提交，按完成顺序收集结果并汇报进度
+                # 子进程逐张处理一块图片，一块的内存工作集按其中最大的一张估算
+                cost = (lambda chunk: max(ImageProcessor.estimate_memory(os.path.join(base_folder, f))
+                                          for f in chunk)) if budget else None
+                for chunk, future in _bounded_completion(submit, chunks, window, control,
+                                                         budget=budget, cost=cost):
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        print(f"处理图片块 {chunk[0]} 等 {len(chunk)} 张时发生异常: {str(e)}")
+                        if measure:
+                            for image_file in chunk:
+                                metrics.add(image_file, False, None)
+                        continue
+                    for image_file, (ok, error, record, data) in zip(chunk, results):
+                        if ok and sink is not None and not hybrid:
+                            # 子进程回传了编码结果
+                            try:
+                                _sink_write(sink, _output_name(image_file, kwargs), data, record)
+                            except OSError as e:
+                                ok, error = False, str(e)
+                        if measure:
+                            metrics.add(image_file, ok, record)
+                        if ok:
+                            processed_count += 1
+                            if on_success:
+                                on_success(image_file)
+                            progress.advance()
+                        else:
+                            print(f"处理图片 {image_file} 时出错: {error}")
+            finally:
+                if io_pool:
+                    io_pool.shutdown(wait=True)
         
-        return output_folder
+        return processed_count
+
+
+class _BatchProgress:
+    """批处理进度计数，处理成功和跳过的图片都计入已完成数"""
+    def __init__(self, total, callback):
+        self.total = total
+        self.callback = callback
+        self.done = 0
+    
+    def advance(self, count=1):
+        self.done += count
+        if self.callback:
+            self.callback(self.done, self.total)
+
+
+class ProgressTracker:
+    """线程安全、合并更新的批处理进度
+
+    作为 progress_callback 传给批处理：后台线程每处理一张只覆盖一次最新计数（单次赋值，无需加锁），
+    界面线程按固定频率调用 snapshot() 读取，多次更新自然合并为一次刷新。
+    处理速度按两次读取之间的增量做指数平滑，据此估算剩余时间。
+    snapshot() 应只在一个线程（界面主线程）中调用。
+    """
+    # 两次速度采样的最小间隔（秒），太短时增量太小，速度波动大
+    SAMPLE_INTERVAL = 0.5
+    
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing
+        self.reset()
+    
+    def reset(self):
+        """开始新的批处理前调用"""
+        self._state = (0, None)
+        self.started = time.perf_counter()
+        self._sample = (self.started, 0)
+        self._rate = None
+    
+    def __call__(self, done, total):
+        self._state = (done, total)
+    
+    def snapshot(self):
+        """返回 (已完成数, 总数, 每秒处理张数, 预计剩余秒数)，总数未知或速度未知时对应项为None"""
+        done, total = self._state
+        now = time.perf_counter()
+        sample_time, sample_done = self._sample
+        if now - sample_time >= self.SAMPLE_INTERVAL:
+            rate = (done - sample_done) / (now - sample_time)
+            self._rate = rate if self._rate is None else (
+                self.smoothing * rate + (1 - self.smoothing) * self._rate)
+            self._sample = (now, done)
+        eta = None
+        if total is not None and self._rate:
+            eta = max(0, total - done) / self._rate
+        return done, total, self._rate, eta
+
+
+class BatchControl:
+    """批处理的暂停和取消控制（协作式）
+
+    暂停后不再提交新任务，线程后端中尚未开始的图片也会等待；在途的任务照常完成并汇报。
+    取消后停止读取输入，撤销尚未开始的任务，正在处理的图片完成后批处理即返回。
+    各方法可在任意线程中调用。
+    """
+    def __init__(self):
+        self._cancelled = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+    
+    def cancel(self):
+        self._cancelled.set()
+        self._resumed.set()  # 唤醒暂停中等待的任务
+    
+    def pause(self):
+        if not self.cancelled:
+            self._resumed.clear()
+    
+    def resume(self):
+        self._resumed.set()
+    
+    def wait_resumed(self, timeout=None):
+        """暂停时阻塞直到继续或取消，返回是否可以继续处理（未被取消）"""
+        self._resumed.wait(timeout)
+        return not self.cancelled
+
+
+class InteractiveLane:
+    """交互任务（如预览渲染）的优先通道
+
+    交互任务用 with 语句占用通道；批处理在开始新任务前调用 yield_to_interactive()，
+    有交互任务进行时先让路，最多等待 max_wait 秒，避免持续的交互操作让批处理停滞。
+    """
+    def __init__(self, max_wait=0.5):
+        self.max_wait = max_wait
+        self._active = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+    
+    def __enter__(self):
+        with self._lock:
+            self._active += 1
+            self._idle.clear()
+        return self
+    
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._active -= 1
+            if not self._active:
+                self._idle.set()
+    
+    def yield_to_interactive(self):
+        if not self._idle.is_set():
+            self._idle.wait(self.max_wait)
+
+
+# 进程内共享的交互优先通道：预览渲染占用，批处理让路
+INTERACTIVE_LANE = InteractiveLane()
+
+
+class MemoryBudget:
+    """按估算的内存工作集控制同时在途的任务（准入控制）
+
+    提交任务前调用 try_acquire(估算字节数)，任务完成后 release。在途总和加上新任务超出预算时拒绝，
+    由调用方等待在途任务完成后重试；没有在途任务时总是接纳，因此超出预算的单个任务会单独运行。
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak = 0  # 在途估算总和的峰值
+        self.deferred = 0  # 因预算不足推迟提交的次数
+        self._lock = threading.Lock()
+    
+    def try_acquire(self, cost):
+        with self._lock:
+            if self.used and self.used + cost > self.max_bytes:
+                self.deferred += 1
+                return False
+            self.used += cost
+            self.peak = max(self.peak, self.used)
+            return True
+    
+    def release(self, cost):
+        with self._lock:
+            self.used -= cost
+
+
+PlannedTask = namedtuple('PlannedTask', 'image_file pixels output_size seconds output_bytes')
+
+
+class BatchPlan:
+    """批处理计划（见 ImageProcessor.plan_batch）
+
+    tasks 为按处理顺序排列的 PlannedTask（默认按预计耗时从大到小），unchanged 为其中处理后不会变化、直接复制的图片。
+    """
+    def __init__(self):
+        self.tasks = []
+        self.unchanged = []
+        self.skipped = 0  # 按输出清单已是最新、不会处理的图片数（由调用方填写）
+    
+    def add(self, task):
+        self.tasks.append(task)
+    
+    @property
+    def image_files(self):
+        """按计划顺序排列的待处理文件"""
+        return [task.image_file for task in self.tasks]
+    
+    @property
+    def total_seconds(self):
+        """单核合计的预计耗时"""
+        return sum(task.seconds for task in self.tasks)
+    
+    @property
+    def total_bytes(self):
+        return sum(task.output_bytes for task in self.tasks)
+    
+    def estimated_seconds(self, workers):
+        """按计划顺序分配给 workers 个并行时的预计总耗时：每个任务交给最先空闲的工作者"""
+        finish = [0.0] * max(1, workers)
+        for task in self.tasks:
+            heapq.heapreplace(finish, finish[0] + task.seconds)
+        return max(finish)
+    
+    def format_lines(self, workers, limit=10):
+        """计划的文字说明：汇总和预计耗时最长的前 limit 项（为None时列出全部）"""
+        lines = [f"计划处理 {len(self.tasks)} 张图片"]
+        if self.unchanged:
+            lines.append(f"其中 {len(self.unchanged)} 张图片处理后不会变化，将直接复制")
+        if self.skipped:
+            lines.append(f"{self.skipped} 张图片的输出已是最新，将跳过")
+        lines.append(f"预计耗时: 约 {self.estimated_seconds(workers):.1f} 秒（{workers} 个并行），"
+                     f"单核合计 {self.total_seconds:.1f} 秒")
+        lines.append(f"预计输出: 约 {self.total_bytes / 1024 / 1024:.1f} MB")
+        shown = self.tasks if limit is None else self.tasks[:limit]
+        if shown:
+            lines.append("处理顺序:")
+        for task in shown:
+            if task.output_size is None:
+                lines.append(f"  {task.image_file}  无法读取文件头")
+                continue
+            lines.append(f"  {task.image_file}  {task.pixels / 1e6:.1f} MP -> "
+                         f"{task.output_size[0]}x{task.output_size[1]}  "
+                         f"{task.seconds:.2f} 秒  {task.output_bytes / 1024:.0f} KB")
+        if len(shown) < len(self.tasks):
+            lines.append(f"  …… 另有 {len(self.tasks) - len(shown)} 张")
+        return lines
+
+
+# 有暂停/取消控制时，等待任务完成的最长间隔（秒），以便及时响应取消和继续
+_CONTROL_POLL_SECONDS = 0.1
+
+
+def _bounded_completion(submit, items, window, control=None, lane=INTERACTIVE_LANE, budget=None, cost=None):
+    """以有界窗口提交任务，按完成顺序产出 (任务项, future)
+
+    同时在途的future不超过window个，每完成一个才从items中再取下一个，
+    因此items可以是任意长的生成器。lane不为None时每次提交前先给交互任务让路（见 InteractiveLane）。
+    control 为 BatchControl：暂停时不再提交，取消时停止读取items并撤销尚未开始的任务，
+    被撤销的任务不会产出。
+    budget 为 MemoryBudget 时按 cost(任务项) 估算的内存准入：预算不足时暂缓提交，
+    等待在途任务完成释放后再按原顺序提交。
+    """
+    items = iter(items)
+    pending = {}  # future -> (任务项, 占用的预算)
+    held = None  # 已读取但因预算不足尚未提交的 (任务项, 估算字节数)
+    exhausted = False
+    while True:
+        if control is not None and control.cancelled and not exhausted:
+            exhausted = True
+            held = None
+            for future in pending:
+                future.cancel()
+        while len(pending) < window and not (control and control.paused):
+            if held is None:
+                if exhausted:
+                    break
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                held = (item, cost(item) if budget is not None else 0)
+            item, item_cost = held
+            if budget is not None and not budget.try_acquire(item_cost):
+                break  # 等待在途任务完成后再试
+            held = None
+            if lane is not None:
+                lane.yield_to_interactive()
+            pending[submit(item)] = (item, item_cost)
+        if not pending:
+            if exhausted and held is None:
+                return
+            if control is not None and control.paused:
+                # 暂停且没有在途任务：等待继续或取消
+                control.wait_resumed()
+            else:
+                # 没有在途任务但预算仍被占用（预算由多个批次共用）：等待其他批次释放后重试
+                time.sleep(_CONTROL_POLL_SECONDS)
+            continue
+        done, _ = wait(pending, timeout=_CONTROL_POLL_SECONDS if control else None,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            item, item_cost = pending.pop(future)
+            if budget is not None:
+                budget.release(item_cost)
+            if not future.cancelled():
+                yield item, future
+
+
+def _output_name(image_file, kwargs):
+    """输出文件的相对路径：处理参数中的 encoder 指定了输出格式时扩展名随之改变"""
+    encoder = kwargs.get('encoder')
+    return encoder.output_name(image_file) if encoder is not None else image_file
+
+
+def variant_path(output_path, variant):
+    """第 variant 个变体（从0开始）的输出路径：第一个为 output_path 本身，其余加 _序号 后缀"""
+    if variant == 0:
+        return output_path
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}_{variant + 1}{ext}"
+
+
+def _task_key(output_path):
+    """随机数等按图片确定的结果使用的键：批处理中为输出相对于输出根目录的路径（各后端一致，
+    不同子文件夹中的同名文件互不相同），单独调用处理函数时为输出文件名"""
+    key = _metrics_local.output_key
+    if key is None:
+        return _output_filename(output_path)
+    return key.replace(os.sep, '/')
+
+
+def _output_filename(output_path):
+    """输出的文件名（不含目录），output_path可以是路径或带name的内存文件对象"""
+    name = output_path if isinstance(output_path, (str, os.PathLike)) else getattr(output_path, 'name', '')
+    return os.path.basename(os.fspath(name))
+
+
+def _memory_output(output_name):
+    """内存中的输出文件，name用于按扩展名推断保存格式"""
+    output = io.BytesIO()
+    output.name = output_name
+    return output
+
+
+def _sink_write(sink, output_name, data, record):
+    """把编码结果交给写入器，计入该图片的写入耗时"""
+    started = time.perf_counter()
+    sink.write(output_name, data)
+    if record is not None:
+        elapsed = time.perf_counter() - started
+        record['write_s'] += elapsed
+        record['total_s'] += elapsed
+
+
+def _ensure_parent_dir(path):
+    """确保文件所在目录存在"""
+    parent = os.path.dirname(path)
+    if parent and not os.path.exists(parent):
+        os.makedirs(parent, exist_ok=True)
+
+
+def _count_files(image_files):
+    """返回文件总数，流式输入无法预知总数时返回None"""
+    try:
+        return len(image_files)
+    except TypeError:
+        return None
+
+
+def _iter_chunks(image_files, base_folder, chunksize=None, max_files=_CHUNK_MAX_FILES):
+    """把文件序列打包成任务块，边读取输入边产出
+
+    指定chunksize时按固定数量分块；否则按文件大小累计，
+    单块不超过 _CHUNK_BYTES 字节且不超过 max_files 个文件，大文件单独成块。
+    """
+    current = []
+    current_bytes = 0
+    for image_file in image_files:
+        if chunksize:
+            size = 0
+            full = len(current) >= chunksize
+        else:
+            try:
+                size = os.path.getsize(os.path.join(base_folder, image_file))
+            except OSError:
+                size = 0
+            full = current_bytes + size > _CHUNK_BYTES or len(current) >= max_files
+        if current and full:
+            yield current
+            current = []
+            current_bytes = 0
+        current.append(image_file)
+        current_bytes += size
+    if current:
+        yield current
+
+
+# 子进程回传的单张图片结果：data 为编码结果（只在输出到内存时有），失败时 error 为错误信息
+_TaskResult = namedtuple('_TaskResult', 'ok error record data', defaults=(None,))
+
+
+def _run_chunk_paths(process_func, tasks, kwargs, measure=False, in_memory=False):
+    """子进程入口：按路径处理一块图片，返回 [_TaskResult]
+
+    tasks 为 [(输入路径, 输出路径, 输出相对路径)]；in_memory 为True时输出路径为输出文件名，
+    编码结果不写盘而是放在 data 中回传
+    """
+    results = []
+    for input_path, output_path, output_key in tasks:
+        record = _new_metrics_record() if measure else None
+        try:
+            if in_memory:
+                output = _memory_output(output_path)
+                _call_measured(record, process_func, input_path, output, kwargs, output_key)
+                results.append(_TaskResult(True, None, record, output.getvalue()))
+                continue
+            _ensure_parent_dir(output_path)
+            _call_measured(record, process_func, input_path, output_path, kwargs, output_key)
+            results.append(_TaskResult(True, None, record))
+        except Exception as e:
+            results.append(_TaskResult(False, str(e), record))
+    return results
+
+
+def _run_chunk_bytes(process_func, payloads, kwargs, measure=False):
+    """子进程入口：处理内存中的图片数据
+
+    Args:
+        payloads: [(原始字节, 输出文件名)]，输出文件名用于推断保存格式
+    Returns:
+        [_TaskResult]，data 为编码后的字节
+    """
+    results = []
+    for data, output_name in payloads:
+        record = _new_metrics_record() if measure else None
+        try:
+            output = _memory_output(output_name)
+            _call_measured(record, process_func, io.BytesIO(data), output, kwargs, output_name)
+            results.append(_TaskResult(True, None, record, output.getvalue()))
+        except Exception as e:
+            results.append(_TaskResult(False, str(e), record))
+    return results
+
+
+def _run_chunk_hybrid(pool, process_func, chunk, base_folder, output_folder, kwargs, measure=False, sink=None):
+    """混合后端的I/O线程：读取整块文件，交给进程池处理，再写出结果（有写入器时写入写入器）"""
+    payloads = []
+    read_errors = {}
+    read_seconds = {}
+    for index, image_file in enumerate(chunk):
+        started = time.perf_counter()
+        try:
+            with open(os.path.join(base_folder, image_file), 'rb') as f:
+                payloads.append((f.read(), _output_name(image_file, kwargs)))
+        except OSError as e:
+            read_errors[index] = str(e)
+        read_seconds[index] = time.perf_counter() - started
+    
+    encoded = iter(pool.submit(_run_chunk_bytes, process_func, payloads, kwargs, measure).result()
+                   if payloads else [])
+    results = []
+    for index, image_file in enumerate(chunk):
+        if index in read_errors:
+            results.append(_TaskResult(False, read_errors[index], None))
+            continue
+        result = next(encoded)
+        record = result.record
+        if record is not None:
+            # 子进程内的耗时加上I/O线程的读取时间
+            record['read_s'] = read_seconds[index]
+            record['total_s'] += read_seconds[index]
+        if not result.ok:
+            results.append(result)
+            continue
+        started = time.perf_counter()
+        try:
+            output_name = _output_name(image_file, kwargs)
+            if sink is not None:
+                sink.write(output_name, result.data)
+            else:
+                output_path = os.path.join(output_folder, output_name)
+                _ensure_parent_dir(output_path)
+                with open(output_path, 'wb') as f:
+                    f.write(result.data)
+            results.append(_TaskResult(True, None, record))
+        except OSError as e:
+            results.append(_TaskResult(False, str(e), record))
+        if record is not None:
+            elapsed = time.perf_counter() - started
+            record['write_s'] += elapsed
+            record['total_s'] += elapsed
+    return results
+
+
+# 分阶段计时：记录当前线程正在处理的图片，未启用统计时为None，
+# 此时 _decode_image 和 _save_image 退化为原来的延迟解码和直接保存
+class _MetricsLocal(threading.local):
+    record = None
+    output_key = None  # 当前任务输出的相对路径，见 _call_measured
+
+
+_metrics_local = _MetricsLocal()
+
+# 单张图片的计时阶段，transform 为处理函数总耗时减去解码、编码和写入
+METRIC_STAGES = ('read', 'decode', 'transform', 'encode', 'write')
+
+
+def _new_metrics_record():
+    """创建单张图片的计时记录"""
+    record = {f'{stage}_s': 0.0 for stage in METRIC_STAGES}
+    record.update(total_s=0.0, bytes_in=0, bytes_out=0, pixels_in=0, pixels_out=0, worker=None)
+    return record
+
+
+def _call_measured(record, process_func, input_path, output_path, kwargs, output_key=None):
+    """执行单张图片的处理函数，record不为None时记录该图片的分阶段计时
+
+    output_key 为输出相对于输出根目录的路径，处理期间可由 _task_key 读取（见 random_rng）
+    """
+    _metrics_local.output_key = output_key
+    try:
+        if record is None:
+            process_func(input_path, output_path, **kwargs)
+            return
+        _call_recorded(record, process_func, input_path, output_path, kwargs)
+    finally:
+        _metrics_local.output_key = None
+
+
+def _call_recorded(record, process_func, input_path, output_path, kwargs):
+    """执行处理函数并把分阶段计时、字节数和工作者写入record"""
+    record['worker'] = f"{os.getpid()}/{threading.current_thread().name}"
+    if isinstance(input_path, io.BytesIO):
+        record['bytes_in'] = input_path.getbuffer().nbytes
+    else:
+        try:
+            record['bytes_in'] = os.path.getsize(input_path)
+        except OSError:
+            pass
+    
+    _metrics_local.record = record
+    started = time.perf_counter()
+    try:
+        result = process_func(input_path, output_path, **kwargs)
+        if result is not None:
+            # 处理函数返回的单张统计（如目标大小压缩的查找结果）随记录一起汇报
+            record['result'] = result
+    except Exception as e:
+        record['error'] = str(e)
+        raise
+    finally:
+        _metrics_local.record = None
+        elapsed = time.perf_counter() - started
+        record['transform_s'] = max(0.0, elapsed - record['decode_s'] - record['encode_s'] - record['write_s'])
+        record['total_s'] += elapsed
+
+
+def _decode_image(img, draft_size=None):
+    """启用统计时立即解码并计时，否则保持延迟解码
+
+    draft_size 为后续缩小的目标尺寸，解码前按它选择JPEG的解码分辨率（见 draft_for_size）。
+    """
+    record = _metrics_local.record
+    if record is None:
+        return
+    record['pixels_in'] = img.width * img.height
+    if draft_size:
+        ImageProcessor.draft_for_size(img, draft_size)
+    started = time.perf_counter()
+    img.load()
+    record['decode_s'] += time.perf_counter() - started
+
+
+def _save_image(img, output_path, format=None, **params):
+    """保存图片，启用统计时分别记录编码和写盘耗时及输出字节数"""
+    record = _metrics_local.record
+    if record is None:
+        img.save(output_path, format, **params)
+        return
+    
+    record['pixels_out'] += img.width * img.height
+    started = time.perf_counter()
+    if not isinstance(output_path, (str, os.PathLike)):
+        # 输出为内存文件对象（混合后端），只有编码
+        img.save(output_path, format, **params)
+        record['encode_s'] += time.perf_counter() - started
+        record['bytes_out'] = output_path.tell()
+        return
+    
+    # 先编码到内存再写盘，以区分编码和写入耗时；name用于按扩展名推断格式
+    buffer = io.BytesIO()
+    buffer.name = os.fspath(output_path)
+    img.save(buffer, format, **params)
+    encoded = time.perf_counter()
+    record['encode_s'] += encoded - started
+    data = buffer.getbuffer()
+    with open(output_path, 'wb') as f:
+        f.write(data)
+    record['write_s'] += time.perf_counter() - encoded
+    record['bytes_out'] += data.nbytes
+
+
+def _output_format(output_path):
+    """根据输出路径（或带name的内存文件）的扩展名推断保存格式"""
+    name = output_path if isinstance(output_path, (str, os.PathLike)) else getattr(output_path, 'name', '')
+    ext = os.path.splitext(os.fspath(name))[1].lower()
+    return Image.registered_extensions().get(ext)
+
+
+def _encode_image(img, output_path, format=None, **params):
+    """把图片编码到内存，格式由output_path的扩展名推断，返回编码后的字节"""
+    buffer = io.BytesIO()
+    buffer.name = output_path if isinstance(output_path, (str, os.PathLike)) else getattr(output_path, 'name', '')
+    record = _metrics_local.record
+    started = time.perf_counter()
+    img.save(buffer, format, **params)
+    if record is not None:
+        record['encode_s'] += time.perf_counter() - started
+        record['pixels_out'] = img.width * img.height
+    return buffer.getvalue()
+
+
+def _copy_if_unchanged(img, image_path, output_path, size):
+    """调整尺寸的目标尺寸等于原尺寸的单帧图片不解码，原样写出源文件字节，返回是否已复制
+
+    image_path可以是路径或内存文件对象（混合后端），与 ImageProcessor.is_noop_resize 的判断一致。
+    """
+    if size != img.size or getattr(img, 'n_frames', 1) != 1:
+        return False
+    if isinstance(image_path, (str, os.PathLike)):
+        with open(image_path, 'rb') as f:
+            data = f.read()
+    else:
+        data = image_path.getvalue()
+    _write_encoded(output_path, data)
+    return True
+
+
+def _write_encoded(output_path, data):
+    """写出已编码的字节，output_path可以是路径或内存文件对象"""
+    record = _metrics_local.record
+    started = time.perf_counter()
+    if isinstance(output_path, (str, os.PathLike)):
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        if record is not None:
+            record['write_s'] += time.perf_counter() - started
+    else:
+        output_path.write(data)
+    if record is not None:
+        record['bytes_out'] = len(data)
+
+
+def _reduce_lossless(img):
+    """不改变像素值的模式缩减：去掉完全不透明的透明通道，各通道相同的RGB转为灰度"""
+    if img.mode in ('RGBA', 'LA') and img.getchannel('A').getextrema() == (255, 255):
+        img = img.convert(img.mode[:-1])
+    if img.mode == 'RGB':
+        from PIL import ImageChops
+        r, g, b = img.split()
+        if ImageChops.difference(r, g).getbbox() is None and ImageChops.difference(g, b).getbbox() is None:
+            img = r
+    return img
+
+
+def _try_palette(img, max_error):
+    """把RGB/RGBA图片量化为256色调色板
+
+    返回 (调色板图片, 误差)；误差为0-255刻度的均方根误差（RGBA按预乘透明度计算，
+    完全透明像素的颜色不计入），超过max_error时返回 (None, 误差)。max_error为None时总是采用。
+    先用快速的八叉树量化，RGB图片误差超限时再试较慢但更准确的中位切分；
+    大图先在缩小图上用中位切分试算，误差明显超限时直接放弃，不再量化原图。
+    """
+    methods = [Image.Quantize.FASTOCTREE]
+    if img.mode == 'RGB':
+        methods.append(Image.Quantize.MEDIANCUT)  # RGBA只能使用八叉树方法
+    
+    if max_error is not None and img.getcolors(256) is None:
+        if max_error <= 0:
+            return None, None
+        scale = math.ceil(math.sqrt(img.width * img.height / _PALETTE_SAMPLE_PIXELS))
+        if scale > 1:
+            sample = img.reduce(scale)
+            error = _palette_error(sample, _quantize(sample, methods[-1]))
+            if error > max_error * 2:
+                return None, error
+    
+    for method in methods:
+        quantized = _quantize(img, method)
+        error = _palette_error(img, quantized)
+        if max_error is None or error <= max_error:
+            return quantized, error
+    return None, error
+
+
+def _quantize(img, method):
+    """不抖动的自适应调色板量化"""
+    return img.quantize(256, method=method, dither=Image.Dither.NONE)
+
+
+def _palette_error(img, quantized):
+    """量化前后的均方根误差"""
+    from PIL import ImageChops, ImageStat
+    mode = 'RGBa' if img.mode == 'RGBA' else img.mode
+    diff = ImageChops.difference(img.convert(mode), quantized.convert(img.mode).convert(mode))
+    rms = ImageStat.Stat(diff).rms
+    return math.sqrt(sum(v * v for v in rms) / len(rms))
+
+
+def _read_source_bytes(image_path):
+    """读取源文件的原始字节，无法读取时返回None"""
+    if isinstance(image_path, io.BytesIO):
+        return image_path.getvalue()
+    try:
+        with open(image_path, 'rb') as f:
+            return f.read()
+    except (OSError, TypeError):
+        return None
+
+
+def _float32(value):
+    """按单精度浮点数舍入（与Pillow内部的单精度计算保持一致）"""
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+# 16位灰度缩放为8位的查找表（取高字节），首次使用时生成
+_high_byte_lut = None
+
+
+def _band_image(img):
+    """把图片规范为逐通道处理的8位模式（见 BAND_LAYOUTS）
+
+    L、LA、RGB、RGBA 原样返回，不复制；调色板图片按是否有透明度转为RGBA或RGB；
+    1位图和浮点灰度转为L；16位灰度（I;16、I）按比例缩放为L（Pillow的直接转换会把大于255的值截断，
+    曝光度和大部分滤镜对16位灰度另行处理，只有需要8位数据的颜色矩阵滤镜经过这里）；
+    其他模式（如CMYK）转为RGB。
+    """
+    if img.mode in BAND_LAYOUTS:
+        return img
+    if img.mode in ('P', 'PA'):
+        return img.convert('RGBA' if img.mode == 'PA' or img.has_transparency_data else 'RGB')
+    if img.mode in ('1', 'F'):
+        return img.convert('L')
+    if img.mode.startswith('I'):
+        return _gray_to_8bit(img)
+    return img.convert('RGB')
+
+
+def _gray_to_8bit(img):
+    """16位灰度图片按比例（取高字节）缩放为8位L"""
+    global _high_byte_lut
+    if _high_byte_lut is None:
+        _high_byte_lut = [value >> 8 for value in range(65536)]
+    if img.mode != 'I':
+        img = img.convert('I')
+    return img.point(_high_byte_lut, 'L')
+
+
+def _to_gray16(img):
+    """16位灰度图片转为 I;16（I模式中超出0-65535的值被截断）"""
+    return img if img.mode == 'I;16' else img.convert('I;16')
+
+
+def _point16(img, tables):
+    """对16位灰度图片应用65536项查找表，tables为结果的 (低字节表, 高字节表)，返回 I;16
+
+    Pillow的point不支持16位到16位的查表，这里分别查出低字节和高字节两张L图，
+    按 I;16（小端）的字节顺序交错后重新组成16位图片。
+    """
+    if img.mode != 'I':
+        img = img.convert('I')
+    low = img.point(tables[0], 'L')
+    high = img.point(tables[1], 'L')
+    return Image.frombytes('I;16', img.size, Image.merge('LA', (low, high)).tobytes())
+
+
+def _split_lut16(lut):
+    return [value & 0xFF for value in lut], [value >> 8 for value in lut]
+
+
+@functools.lru_cache(maxsize=8)
+def _tone_tables16(brightness_factor, contrast, gamma, levels):
+    """16位色调查找表（按字节拆分，见 _point16），批处理中同一参数只生成一次"""
+    return _split_lut16(ImageProcessor.tone_lut(brightness_factor, contrast, gamma, levels, depth=16))
+
+
+@functools.lru_cache(maxsize=None)
+def _filter_tables16(filter_type):
+    """把256项的查找表滤镜按线性插值扩展到16位（对负片等线性查找表结果精确）"""
+    lut8 = LUT_FILTERS[filter_type]
+    lut = []
+    for value in range(65536):
+        low, frac = divmod(value, 257)
+        high = min(low + 1, 255)
+        lut.append(min(max(int(round((lut8[low] + (lut8[high] - lut8[low]) * frac / 257) * 257)), 0), 65535))
+    return _split_lut16(lut)
+
+
+def _filter_gray16(img, filter_type):
+    """16位灰度图片的灰度、查找表和卷积滤镜，结果为 I;16"""
+    if filter_type in LUT_FILTERS:
+        return _point16(img, _filter_tables16(filter_type))
+    img = _to_gray16(img)
+    if filter_type not in KERNEL_FILTERS:
+        # 灰度滤镜及未知滤镜：原样返回
+        return img.copy()
+    from PIL import ImageFilter
+    name, params = KERNEL_FILTERS[filter_type]
+    if name == 'GaussianBlur':
+        # Pillow的高斯模糊不支持16位模式：5x5二项式核的方差为1，
+        # 重复 radius² 次近似标准差为 radius 的高斯模糊
+        row = (1, 4, 6, 4, 1)
+        kernel = ImageFilter.Kernel((5, 5), [a * b for a in row for b in row], 256)
+        for _ in range(max(1, round(params['radius'] ** 2))):
+            img = img.filter(kernel)
+        return img
+    kernel = getattr(ImageFilter, name)
+    return img.filter(kernel(**params) if params is not None else kernel)
+
+
+def _tone_palette(img, lut):
+    """对调色板图片只调整调色板的颜色，索引和透明度不变"""
+    adjusted = img.copy()
+    rawmode = img.palette.mode
+    palette = img.getpalette(rawmode)
+    step = len(rawmode)
+    colors = 3 if rawmode.startswith('RGB') else 1
+    adjusted.putpalette([lut[v] if i % step < colors else v for i, v in enumerate(palette)], rawmode)
+    return adjusted
+
+
+def _flatten_alpha(img, background=255):
+    """把带透明通道的图片合成到纯色（默认白色）背景上，用于不支持透明度的格式；LA合成为L，其他合成为RGB"""
+    if img.mode == 'LA':
+        flat = Image.new('L', img.size, background)
+        flat.paste(img.getchannel('L'), mask=img.getchannel('A'))
+        return flat
+    rgba = img.convert('RGBA')
+    flat = Image.new('RGB', rgba.size, (background,) * 3)
+    flat.paste(rgba, mask=rgba.getchannel('A'))
+    return flat
+
+
+class OutputEncoder:
+    """统一的输出编码设置，所有处理函数都通过它保存图片
+
+    format 为 OUTPUT_FORMATS 中的名称，为None时按输出文件扩展名保持原格式；
+    指定格式时输出文件的扩展名随之改变（见 output_name）。options 为编码参数：
+        quality: 质量（JPEG、WebP、AVIF）
+        progressive: 渐进式JPEG
+        subsampling: 色度抽样，如 '4:4:4'、'4:2:0'（JPEG、AVIF）
+        lossless: WebP无损压缩
+        method: WebP编码速度与压缩率的权衡，0最快，6最小
+        speed: AVIF编码速度，0最慢最小，10最快
+        compress_level: PNG的zlib压缩级别 0-9
+        optimize: JPEG优化哈夫曼表 / PNG最高压缩级别
+    每个处理函数提供自己的默认参数，encoder中的设置覆盖默认值，只传给对应格式支持的参数。
+    不支持透明度的格式（JPEG）会把透明图片合成到白色背景上。
+    """
+    OPTIONS = ('quality', 'progressive', 'subsampling', 'lossless', 'method', 'speed',
+               'compress_level', 'optimize')
+    
+    # 各格式接受的编码参数，不在表中的格式（GIF、BMP等）参数原样传给Pillow
+    FORMAT_OPTIONS = {
+        'JPEG': ('quality', 'optimize', 'progressive', 'subsampling'),
+        'WEBP': ('quality', 'lossless', 'method'),
+        'AVIF': ('quality', 'speed', 'subsampling'),
+        'PNG': ('optimize', 'compress_level', 'compress_type'),
+    }
+    
+    def __init__(self, format=None, **options):
+        if format is not None and format not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {format}")
+        unknown = set(options) - set(self.OPTIONS)
+        if unknown:
+            raise ValueError(f"未知的编码参数: {', '.join(sorted(unknown))}")
+        if format in ('webp', 'avif'):
+            # 按需导入，检查Pillow是否编译了对应的编码器
+            from PIL import features
+            if not features.check(format):
+                raise ValueError(f"当前Pillow不支持 {format} 编码")
+        self.format = format
+        self.options = {k: v for k, v in options.items() if v is not None}
+    
+    def cache_key(self):
+        """增量处理清单中的参数标识，只由格式和编码参数决定，需要稳定（见 OutputManifest.params_key）"""
+        options = ", ".join(f"{k}={v!r}" for k, v in sorted(self.options.items()))
+        return f"OutputEncoder({self.format!r}{', ' + options if options else ''})"
+    
+    def __repr__(self):
+        return self.cache_key()
+    
+    def __str__(self):
+        name = OUTPUT_FORMATS[self.format][0] if self.format else "保持原格式"
+        options = ", ".join(f"{k}={v}" for k, v in sorted(self.options.items()))
+        return f"{name} ({options})" if options else name
+    
+    def output_name(self, image_file):
+        """输出文件名（相对路径），指定格式时替换扩展名"""
+        if self.format is None:
+            return image_file
+        return os.path.splitext(image_file)[0] + OUTPUT_FORMATS[self.format][1]
+    
+    def image_format(self, output_path):
+        """本次保存使用的Pillow格式名"""
+        if self.format is not None:
+            return OUTPUT_FORMATS[self.format][0]
+        return _output_format(output_path)
+    
+    def _prepare(self, img, output_path, defaults, overrides):
+        image_format = self.image_format(output_path)
+        params = dict(defaults or {})
+        params.update(self.options)
+        params.update(overrides)
+        allowed = self.FORMAT_OPTIONS.get(image_format)
+        if allowed is not None:
+            if image_format == 'PNG' and 'compress_level' in self.options and 'optimize' not in self.options:
+                # optimize 会强制使用最高压缩级别，指定了级别时以级别为准
+                params.pop('optimize', None)
+            params = {k: v for k, v in params.items() if k in allowed}
+        
+        if img.mode in GRAY16_MODES:
+            # 16位灰度：支持的格式保持16位，其他格式按比例缩放为8位
+            img = _to_gray16(img) if image_format in HIGH_DEPTH_FORMATS else _gray_to_8bit(img)
+        elif image_format == 'JPEG':
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                img = _flatten_alpha(img)
+            elif img.mode not in ('RGB', 'L', 'CMYK'):
+                img = img.convert('RGB')
+        elif image_format == 'PNG' and img.mode == 'CMYK':
+            img = img.convert('RGB')
+        return img, image_format, params
+    
+    def save(self, img, output_path, defaults=None, **overrides):
+        """保存图片：defaults 为处理函数的默认参数，overrides 优先于encoder中的设置"""
+        img, image_format, params = self._prepare(img, output_path, defaults, overrides)
+        _save_image(img, output_path, image_format, **params)
+    
+    def encode(self, img, output_path, defaults=None, **overrides):
+        """按与save相同的设置编码到内存，返回字节（output_path只用于推断格式）"""
+        img, image_format, params = self._prepare(img, output_path, defaults, overrides)
+        return _encode_image(img, output_path, image_format, **params)
+
+
+# 默认编码设置：按扩展名保持原格式，参数使用各处理函数的默认值
+DEFAULT_ENCODER = OutputEncoder()
+
+
+class BatchMetrics:
+    """批处理的分阶段统计
+
+    汇总每张图片的读取、解码、处理、编码、写入耗时，输入/输出字节数、像素数和工作线程/进程，
+    可选把每张图片的记录写成JSON Lines，批处理结束后把汇总写成Prometheus文本格式
+    （可供node_exporter的textfile收集器读取）。汇总只保存累计值，内存占用与批量大小无关。
+    """
+    def __init__(self, jsonl_path=None, prometheus_path=None):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.operation = None
+        self.backend = None
+        self.workers = None
+        self.succeeded = 0
+        self.failed = 0
+        self.stage_seconds = dict.fromkeys(METRIC_STAGES, 0.0)
+        self.busy_seconds = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.pixels_in = 0
+        self.pixels_out = 0
+        self.worker_images = {}
+        self.slowest = (None, 0.0)
+        self.size_target = {'images': 0, 'over_target': 0, 'quality_images': 0, 'quality_sum': 0, 'trials': 0}
+        self.lossless = {'images': 0, 'saved': 0, 'palette': 0, 'kept_original': 0}
+        self.copied = 0  # 处理后不会变化、直接复制的图片数
+        self.wall_seconds = 0.0
+        self._started = None
+        self._jsonl = None
+    
+    def start(self, operation, backend, workers):
+        """批处理开始时调用"""
+        self.operation = operation
+        self.backend = backend
+        self.workers = workers
+        self._started = time.perf_counter()
+        if self.jsonl_path:
+            _ensure_parent_dir(self.jsonl_path)
+            self._jsonl = open(self.jsonl_path, 'w', encoding='utf-8')
+    
+    def add(self, image_file, ok, record):
+        """记录一张图片的处理结果，record为None表示没有计时数据（如整块任务失败）"""
+        if ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        if record is not None:
+            for stage in METRIC_STAGES:
+                self.stage_seconds[stage] += record[f'{stage}_s']
+            self.busy_seconds += record['total_s']
+            self.bytes_in += record['bytes_in']
+            self.bytes_out += record['bytes_out']
+            self.pixels_in += record['pixels_in']
+            self.pixels_out += record['pixels_out']
+            worker = record['worker']
+            self.worker_images[worker] = self.worker_images.get(worker, 0) + 1
+            if ok and record['total_s'] > self.slowest[1]:
+                self.slowest = (image_file, record['total_s'])
+            result = record.get('result')
+            if result and 'target_bytes' in result:
+                self.size_target['images'] += 1
+                self.size_target['over_target'] += not result['fits']
+                if result['quality'] is not None:
+                    self.size_target['quality_images'] += 1
+                    self.size_target['quality_sum'] += result['quality']
+                self.size_target['trials'] += result['trials']
+            if result and result.get('copied'):
+                self.copied += 1
+            if result and 'kept_original' in result:
+                self.lossless['images'] += 1
+                self.lossless['saved'] += result['saved'] or 0
+                self.lossless['palette'] += result['palette']
+                self.lossless['kept_original'] += result['kept_original']
+        if self._jsonl:
+            event = {'file': image_file, 'ok': ok}
+            if record is not None:
+                event.update({k: round(v, 6) if isinstance(v, float) else v for k, v in record.items()})
+            self._jsonl.write(json.dumps(event, ensure_ascii=False) + '\n')
+    
+    def finish(self):
+        """批处理结束时调用：关闭JSON Lines文件并写出Prometheus文本"""
+        if self._started is not None:
+            self.wall_seconds = time.perf_counter() - self._started
+        if self._jsonl:
+            self._jsonl.close()
+            self._jsonl = None
+        if self.prometheus_path:
+            _ensure_parent_dir(self.prometheus_path)
+            temp_path = f"{self.prometheus_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+            os.replace(temp_path, self.prometheus_path)
+    
+    def summary(self):
+        """汇总结果字典"""
+        images = self.succeeded + self.failed
+        return {
+            'operation': self.operation,
+            'backend': self.backend,
+            'workers': self.workers,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'images_per_s': round(images / self.wall_seconds, 2) if self.wall_seconds else None,
+            'stage_seconds': {stage: round(v, 4) for stage, v in self.stage_seconds.items()},
+            'busy_seconds': round(self.busy_seconds, 4),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'megapixels_in': round(self.pixels_in / 1e6, 3),
+            'megapixels_out': round(self.pixels_out / 1e6, 3),
+            'worker_images': dict(self.worker_images),
+            'slowest': {'file': self.slowest[0], 'seconds': round(self.slowest[1], 4)},
+            **({'size_target': self._size_target_summary()} if self.size_target['images'] else {}),
+            **({'lossless': dict(self.lossless)} if self.lossless['images'] else {}),
+            **({'copied': self.copied} if self.copied else {}),
+        }
+    
+    def _size_target_summary(self):
+        images = self.size_target['images']
+        return {
+            'images': images,
+            'over_target': self.size_target['over_target'],
+            'mean_quality': (round(self.size_target['quality_sum'] / self.size_target['quality_images'], 1)
+                             if self.size_target['quality_images'] else None),
+            'mean_trials': round(self.size_target['trials'] / images, 2),
+        }
+    
+    def format_summary(self):
+        """汇总结果的文字说明（多行），用于界面和命令行显示"""
+        stage_names = {'read': '读取', 'decode': '解码', 'transform': '处理', 'encode': '编码', 'write': '写入'}
+        lines = [f"耗时 {self.wall_seconds:.2f} 秒，工作线程/进程 {len(self.worker_images)} 个"]
+        if self.busy_seconds:
+            shares = "，".join(f"{stage_names[stage]} {seconds / self.busy_seconds:.0%}"
+                              for stage, seconds in self.stage_seconds.items() if seconds)
+            lines.append(f"各阶段占比: {shares}")
+        if self.bytes_in:
+            lines.append(f"输入 {self.bytes_in / 1e6:.1f} MB，输出 {self.bytes_out / 1e6:.1f} MB")
+        if self.slowest[0] is not None:
+            lines.append(f"最慢: {self.slowest[0]} ({self.slowest[1]:.2f} 秒)")
+        if self.size_target['images']:
+            target = self._size_target_summary()
+            lines.append(f"目标大小: 平均质量 {target['mean_quality']}，平均尝试 {target['mean_trials']} 次，"
+                         f"{target['over_target']} 张在最低质量下仍超出")
+        if self.lossless['images']:
+            lines.append(f"无损优化: {self.lossless['images']} 张共节省 {self.lossless['saved'] / 1e6:.2f} MB，"
+                         f"{self.lossless['palette']} 张转为调色板，{self.lossless['kept_original']} 张保留原文件")
+        return lines
+    
+    def to_prometheus(self):
+        """以Prometheus文本格式输出汇总"""
+        labels = f'operation="{self.operation}",backend="{self.backend}"'
+        metrics = [
+            ('image_batch_images_total', 'counter', '处理的图片数',
+             [(f'{labels},status="ok"', self.succeeded), (f'{labels},status="failed"', self.failed)]),
+            ('image_batch_stage_seconds_total', 'counter', '各阶段累计耗时（秒）',
+             [(f'{labels},stage="{stage}"', seconds) for stage, seconds in self.stage_seconds.items()]),
+            ('image_batch_bytes_total', 'counter', '输入/输出字节数',
+             [(f'{labels},direction="in"', self.bytes_in), (f'{labels},direction="out"', self.bytes_out)]),
+            ('image_batch_pixels_total', 'counter', '输入/输出像素数',
+             [(f'{labels},direction="in"', self.pixels_in), (f'{labels},direction="out"', self.pixels_out)]),
+            ('image_batch_wall_seconds', 'gauge', '批处理总耗时（秒）', [(labels, self.wall_seconds)]),
+            ('image_batch_workers', 'gauge', '实际参与处理的工作线程/进程数', [(labels, len(self.worker_images))]),
+        ]
+        if self.lossless['images']:
+            metrics.append(('image_batch_lossless_saved_bytes_total', 'counter', 'PNG/GIF无损优化节省的字节数',
+                            [(labels, self.lossless['saved'])]))
+        lines = []
+        for name, metric_type, help_text, samples in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{name}{{{sample_labels}}} {value}" for sample_labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+class OutputManifest:
+    """输出文件夹的处理清单，用于增量处理和中断续跑
+
+    清单以JSON Lines格式保存在输出文件夹的 MANIFEST_NAME 文件中，每处理成功一张图片追加一行：
+    源文件相对路径、大小、修改时间（或内容哈希）和处理参数。重新运行时，
+    源文件和参数都未变化且输出文件仍存在的图片会被跳过。
+    """
+    def __init__(self, output_folder, use_hash=False):
+        """
+        Args:
+            output_folder: 输出文件夹路径
+            use_hash: 为True时用源文件内容哈希代替修改时间判断是否变化（较慢，但不受复制、解压等改变mtime的影响）
+        """
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, MANIFEST_NAME)
+        self.use_hash = use_hash
+        self.entries = {}
+        self.skipped = 0
+        self.processed = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._load()
+    
+    @staticmethod
+    def params_key(process_func, kwargs):
+        """由处理函数和参数生成稳定的参数标识
+
+        编码器用 OutputEncoder.cache_key 序列化（__str__ 是界面显示用的文字，可能随文案改变），
+        其他无法直接序列化的参数退回到 str。
+        """
+        def default(value):
+            if isinstance(value, OutputEncoder):
+                return value.cache_key()
+            return str(value)
+        name = getattr(process_func, '__qualname__', repr(process_func))
+        return f"{name}:{json.dumps(kwargs, sort_keys=True, default=default)}"
+    
+    def _load(self):
+        """读取已有清单；同一文件保留最后一条记录，中断时写了一半的行会被忽略"""
+        if not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                    self.entries[entry['file']] = entry
+                except (ValueError, KeyError):
+                    continue
+        # 重复记录过多时压缩清单
+        if lines > 2 * len(self.entries) + 100:
+            self._rewrite()
+    
+    def _rewrite(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(temp_path, self.path)
+    
+    def _source_signature(self, source_path):
+        """源文件特征：大小、修改时间，启用哈希时附加内容哈希"""
+        stat = os.stat(source_path)
+        signature = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if self.use_hash:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(source_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            signature['hash'] = digest.hexdigest()
+        return signature
+    
+    def is_up_to_date(self, image_file, signature, params_key, output_path):
+        """判断输出是否已是最新"""
+        entry = self.entries.get(image_file)
+        if not entry or entry.get('params') != params_key or entry.get('size') != signature['size']:
+            return False
+        if self.use_hash:
+            if entry.get('hash') != signature['hash']:
+                return False
+        elif entry.get('mtime_ns') != signature['mtime_ns']:
+            return False
+        return os.path.exists(output_path)
+    
+    def filter_pending(self, image_files, base_folder, output_folder, params_key, on_skip=None,
+                       output_name=None):
+        """逐个检查输入文件，只产出需要处理的文件，跳过的文件计入 skipped
+
+        output_name 把输入的相对路径映射为输出的相对路径（输出格式改变扩展名时），默认相同
+        """
+        for image_file in image_files:
+            try:
+                signature = self._source_signature(os.path.join(base_folder, image_file))
+            except OSError:
+                # 源文件无法读取，交给处理函数报告错误
+                yield image_file
+                continue
+            output_file = output_name(image_file) if output_name else image_file
+            if self.is_up_to_date(image_file, signature, params_key,
+                                  os.path.join(output_folder, output_file)):
+                self.skipped += 1
+                if on_skip:
+                    on_skip()
+                continue
+            with self._lock:
+                self._pending[image_file] = signature
+            yield image_file
+    
+    def record(self, image_file, params_key):
+        """记录一张图片处理成功，立即写入清单文件"""
+        with self._lock:
+            signature = self._pending.pop(image_file, None)
+            if signature is None:
+                return
+            entry = {'file': image_file, 'params': params_key, **signature}
+            self.entries[image_file] = entry
+            self.processed += 1
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+class _TarShard:
+    """一个正在写入的tar分片，写入时文件名带 .part 后缀"""
+    def __init__(self, path):
+        import tarfile
+        self.path = path
+        self.tar = tarfile.open(path + '.part', 'w', format=tarfile.PAX_FORMAT)
+        self.entries = []  # [(成员名, 数据偏移, 字节数)]
+    
+    @property
+    def size(self):
+        return self.tar.offset
+    
+    def add(self, name, data):
+        import tarfile
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        # 数据紧跟在成员头之后，记录其偏移以便不解析tar直接读取
+        header = info.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        offset = self.tar.offset + len(header)
+        self.tar.addfile(info, io.BytesIO(data))
+        self.entries.append((name, offset, len(data)))
+    
+    def close(self):
+        self.tar.close()
+        os.replace(self.path + '.part', self.path)
+
+
+class ShardedTarSink:
+    """把批处理结果写入大小受限的tar分片（WebDataset格式），代替逐个文件写入输出文件夹
+
+    每张图片是分片中的一个成员，成员名为输出文件的相对路径（如 sub/img1.jpg，
+    WebDataset按去掉扩展名的部分 sub/img1 作为样本键）。分片依次命名为 prefix-000000.tar、
+    prefix-000001.tar ……，已有分片时接着编号，不会覆盖。写入中的分片带 .part 后缀，
+    达到 max_bytes 或关闭时才改为正式名称，读取方只会看到完整的分片。
+
+    每个写入线程同时占用一个打开的分片，多个线程并发写入不同的分片而不互相等待；
+    成员直接写入磁盘，内存中只有单张图片的编码结果。分片完成时把其中每个成员追加到索引文件
+    SHARD_INDEX_NAME：{"key", "file", "shard", "offset", "size"}，offset为数据在分片中的字节偏移。
+    """
+    def __init__(self, output_folder, prefix='shard', max_bytes=DEFAULT_SHARD_BYTES):
+        os.makedirs(output_folder, exist_ok=True)
+        self.output_folder = output_folder
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(output_folder, SHARD_INDEX_NAME)
+        self.count = 0  # 已写入的成员数
+        self.shards = []  # 已完成的分片文件名
+        self._lock = threading.Lock()
+        self._idle = []  # 打开且未被占用的分片
+        self._next = self._next_number()
+        self._index = open(self.index_path, 'a', encoding='utf-8')
+    
+    def _next_number(self):
+        """已有分片的最大编号加1"""
+        pattern = f"{self.prefix}-"
+        numbers = [int(name[len(pattern):-4]) for name in os.listdir(self.output_folder)
+                   if name.startswith(pattern) and name.endswith('.tar') and name[len(pattern):-4].isdigit()]
+        return max(numbers) + 1 if numbers else 0
+    
+    def _new_shard(self):
+        # 调用方持有 self._lock
+        name = f"{self.prefix}-{self._next:06d}.tar"
+        self._next += 1
+        return _TarShard(os.path.join(self.output_folder, name))
+    
+    def write(self, output_name, data):
+        """写入一张图片的编码结果，output_name为输出文件的相对路径，可在多个线程中同时调用"""
+        import tarfile
+        name = output_name.replace(os.sep, '/')
+        with self._lock:
+            shard = self._idle.pop() if self._idle else self._new_shard()
+        # 成员头和数据按512字节对齐，结束分片时还会补齐到 RECORDSIZE；写入后可能超出上限时先结束当前分片
+        # （空分片总是写入，单张超限时独占一个分片）
+        if shard.entries and shard.size + 512 + len(data) + 511 + tarfile.RECORDSIZE > self.max_bytes:
+            self._finish(shard)
+            with self._lock:
+                shard = self._new_shard()
+        shard.add(name, data)
+        with self._lock:
+            self.count += 1
+            self._idle.append(shard)
+    
+    def _finish(self, shard):
+        """关闭分片并把其中的成员写入索引"""
+        shard.close()
+        shard_name = os.path.basename(shard.path)
+        with self._lock:
+            for name, offset, size in shard.entries:
+                self._index.write(json.dumps({'key': os.path.splitext(name)[0], 'file': name, 'shard': shard_name,
+                                              'offset': offset, 'size': size}, ensure_ascii=False) + '\n')
+            self._index.flush()
+            self.shards.append(shard_name)
+    
+    def close(self):
+        """结束所有打开的分片，批处理结束（没有写入线程）后调用"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for shard in idle:
+            self._finish(shard)
+        self._index.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ThumbnailStore:
+    """持久化的磁盘缩略图缓存，参考freedesktop缩略图规范
+
+    缩略图以源文件URI的MD5命名保存为PNG，并在PNG文本块中记录
+    Thumb::URI、Thumb::MTime和Thumb::Size，源文件修改后缓存自动失效。
+    总大小超过 max_bytes 时按缩略图文件的修改时间（命中时会刷新）淘汰最旧的条目。
+    """
+    def __init__(self, cache_dir=None, preview_size=PREVIEW_SIZE, max_bytes=THUMBNAIL_STORE_BYTES):
+        if cache_dir is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            cache_dir = os.path.join(base, 'image_resizer', 'thumbnails',
+                                     f"{preview_size[0]}x{preview_size[1]}")
+        self.cache_dir = cache_dir
+        self.preview_size = preview_size
+        self.max_bytes = max_bytes
+        self._bytes = None  # 首次写入时统计
+        self._lock = threading.Lock()
+        self._fill_generation = 0
+    
+    @staticmethod
+    def _uri(image_path):
+        return pathlib.Path(os.path.abspath(image_path)).as_uri()
+    
+    def path_for(self, image_path):
+        """源文件对应的缩略图路径"""
+        digest = hashlib.md5(self._uri(image_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.png')
+    
+    def get(self, image_path, stat=None):
+        """读取有效的缩略图，不存在或已过期时返回None"""
+        thumb_path = self.path_for(image_path)
+        try:
+            stat = stat or os.stat(image_path)
+            with Image.open(thumb_path) as thumb:
+                info = thumb.info
+                if (info.get('Thumb::MTime') != str(int(stat.st_mtime))
+                        or info.get('Thumb::Size') != str(stat.st_size)):
+                    return None
+                thumb.load()
+            # 刷新修改时间，作为淘汰时的最近使用时间
+            os.utime(thumb_path)
+            return thumb
+        except (OSError, SyntaxError):
+            return None
+    
+    def put(self, image_path, thumb, stat=None):
+        """保存缩略图，先写临时文件再替换，避免并发读取到写了一半的文件"""
+        stat = stat or os.stat(image_path)
+        if thumb.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            thumb = thumb.convert('RGBA' if 'A' in thumb.getbands() else 'RGB')
+        from PIL import PngImagePlugin
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Thumb::URI', self._uri(image_path))
+        info.add_text('Thumb::MTime', str(int(stat.st_mtime)))
+        info.add_text('Thumb::Size', str(stat.st_size))
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        thumb_path = self.path_for(image_path)
+        temp_path = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        thumb.save(temp_path, 'PNG', pnginfo=info, compress_level=1)
+        new_size = os.path.getsize(temp_path)
+        
+        with self._lock:
+            # 覆盖已有缩略图（源文件修改后重新生成）时只计入大小的变化
+            try:
+                old_size = os.path.getsize(thumb_path)
+            except OSError:
+                old_size = 0
+            os.replace(temp_path, thumb_path)
+            if self._bytes is None:
+                self._bytes = self._scan()[1]
+            else:
+                self._bytes += new_size - old_size
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+    
+    def _scan(self):
+        """列出缓存中的缩略图，返回 ([(修改时间, 大小, 路径)], 总大小)"""
+        entries = []
+        total = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.png'):
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((st.st_mtime, st.st_size, entry.path))
+                        total += st.st_size
+        except OSError:
+            pass
+        return entries, total
+    
+    def evict(self):
+        """按最近使用时间淘汰旧缩略图，直到总大小降到上限的90%以下"""
+        with self._lock:
+            entries, total = self._scan()
+            entries.sort()
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    continue
+            self._bytes = total
+    
+    def load(self, image_path):
+        """读取缩略图，缓存中没有时从源文件生成并保存"""
+        stat = os.stat(image_path)
+        thumb = self.get(image_path, stat)
+        if thumb is None:
+            thumb = ImageProcessor.make_thumbnail(image_path, self.preview_size)
+            try:
+                self.put(image_path, thumb, stat)
+            except OSError as e:
+                print(f"保存缩略图缓存时出错: {str(e)}")
+        return thumb
+    
+    def fill_async(self, image_paths):
+        """在后台线程中为尚未缓存的图片生成缩略图
+
+        再次调用时，上一次尚未完成的填充会停止。
+        """
+        with self._lock:
+            self._fill_generation += 1
+            generation = self._fill_generation
+        
+        def fill():
+            for image_path in image_paths:
+                if generation != self._fill_generation:
+                    return
+                try:
+                    stat = os.stat(image_path)
+                    if not os.path.exists(self.path_for(image_path)) or self.get(image_path, stat) is None:
+                        self.put(image_path, ImageProcessor.make_thumbnail(image_path, self.preview_size), stat)
+                except Exception as e:
+                    print(f"生成缩略图 {image_path} 时出错: {str(e)}")
+        
+        threading.Thread(target=fill, daemon=True).start()
+
+
+class PreviewCache:
+    """预览缩略图的内存LRU缓存
+
+    以 (路径, 修改时间) 为键缓存解码后的缩略图，总内存不超过 max_bytes，
+    超出时淘汰最久未使用的条目。load 同步生成缩略图（供渲染线程使用），
+    prefetch 在后台线程中预先生成相邻图片的缩略图。
+    提供 store（ThumbnailStore）时，内存未命中会先读取磁盘缓存，新生成的缩略图也会写入磁盘。
+    """
+    def __init__(self, preview_size=PREVIEW_SIZE, max_bytes=PREVIEW_CACHE_BYTES, store=None):
+        self.preview_size = preview_size
+        self.max_bytes = max_bytes
+        self.store = store
+        self._items = OrderedDict()  # 键 -> (缩略图, 字节数)
+        self._bytes = 0
+        self._queue = deque()  # 等待预取的路径
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    @staticmethod
+    def cache_key(image_path):
+        """缓存键：路径和修改时间，文件变化后自动失效"""
+        return image_path, os.stat(image_path).st_mtime_ns
+    
+    @staticmethod
+    def _image_bytes(img):
+        return img.width * img.height * len(img.getbands())
+    
+    def get(self, image_path):
+        """取缓存的缩略图，未命中返回None"""
+        try:
+            key = self.cache_key(image_path)
+        except OSError:
+            return None
+        with self._cond:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+    
+    def put(self, key, img):
+        """加入缓存并按内存上限淘汰旧条目"""
+        nbytes = self._image_bytes(img)
+        with self._cond:
+            old = self._items.pop(key, None)
+            if old:
+                self._bytes -= old[1]
+            self._items[key] = (img, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+    
+    def load(self, image_path):
+        """同步获取缩略图，未命中时生成并缓存"""
+        key = self.cache_key(image_path)
+        with self._cond:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+                return item[0]
+        if self.store is not None:
+            img = self.store.load(image_path)
+        else:
+            img = ImageProcessor.make_thumbnail(image_path, self.preview_size)
+        self.put(key, img)
+        return img
+    
+    def prefetch(self, image_paths):
+        """在后台预取缩略图，之前排队但尚未开始的预取会被丢弃"""
+        with self._cond:
+            self._queue.clear()
+            self._queue.extend(image_paths)
+            if self._queue:
+                self._ensure_worker()
+                self._cond.notify()
+    
+    def clear(self):
+        """清空缓存和排队的请求"""
+        with self._cond:
+            self._queue.clear()
+            self._items.clear()
+            self._bytes = 0
+    
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                image_path = self._queue.popleft()
+            try:
+                self.load(image_path)
+            except Exception as e:
+                print(f"预取缩略图 {image_path} 时出错: {str(e)}")
+
+
+class PreviewRenderer:
+    """在后台线程中渲染效果预览
+
+    只保留最新的一次请求：新请求到达时，尚未开始的旧请求被丢弃，
+    正在渲染的旧请求完成后其结果也会被丢弃，不会回调。
+    效果在 PreviewCache 提供的低分辨率代理图上渲染。
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self._latest = None
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def submit(self, image_path, process_type, params, callback):
+        """提交渲染请求，完成后在后台线程中回调 callback(路径, 预览图, 错误)"""
+        with self._cond:
+            self._generation += 1
+            self._latest = (self._generation, image_path, process_type, params, callback)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+    
+    def cancel(self):
+        """取消尚未回调的请求"""
+        with self._cond:
+            self._generation += 1
+            self._latest = None
+    
+    def _is_current(self, generation):
+        with self._cond:
+            return generation == self._generation
+    
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._latest is None:
+                    self._cond.wait()
+                generation, image_path, process_type, params, callback = self._latest
+                self._latest = None
+            # 渲染期间占用交互优先通道，批处理暂缓开始新的图片
+            with INTERACTIVE_LANE:
+                result, error = self._render(generation, image_path, process_type, params)
+            if self._is_current(generation):
+                callback(image_path, result, error)
+
+    def _render(self, generation, image_path, process_type, params):
+        """渲染一次预览，返回 (预览图, 错误)"""
+        try:
+            proxy = self.cache.load(image_path)
+            if not self._is_current(generation):
+                return None, None
+            source_size = None
+            if process_type == 'resize':
+                source_size = ImageProcessor.read_image_size(image_path)
+            return ImageProcessor.render_preview(proxy, process_type, source_size, **params), None
+        except Exception as e:
+            return None, e
+
+
+class ImageInfo(namedtuple('ImageInfo', 'format width height mode frames orientation')):
+    """从文件头读取的图片信息，见 ImageProcessor.read_image_info"""
+    __slots__ = ()
+    
+    @property
+    def size(self):
+        """像素数据的尺寸（未按EXIF方向旋转），与处理时 img.size 一致"""
+        return self.width, self.height
+    
+    @property
+    def pixels(self):
+        return self.width * self.height
+    
+    @property
+    def display_size(self):
+        """按EXIF方向显示时的尺寸"""
+        return (self.height, self.width) if self.orientation in (5, 6, 7, 8) else (self.width, self.height)
+
+
+class ImageMetadataIndex:
+    """持久化的图片元数据索引（SQLite），避免每次列出、排序或规划处理时重新打开图片
+
+    以源文件的绝对路径为键，记录修改时间、文件大小和只读文件头得到的 ImageInfo。
+    scan 只对新增或修改时间/大小变化的文件读取文件头（在线程池中并行），其余直接使用索引中的结果；
+    无法识别的文件也会记录，未变化时不再重复尝试。已删除文件的条目不影响查询，不做清理。
+    数据库在首次使用时打开，可在多个线程中使用；无法打开时（如缓存目录不可写）退化为只读文件头。
+    """
+    def __init__(self, db_path=None, max_workers=None):
+        if db_path is None:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            db_path = os.path.join(base, 'image_resizer', METADATA_INDEX_NAME)
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.scanned = 0  # 最近一次scan中读取了文件头的文件数
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    def _connection(self):
+        """打开数据库并建表，调用方持有 self._lock；无法打开时返回None"""
+        import sqlite3
+        if self._conn is None:
+            try:
+                if self.db_path != ':memory:':
+                    os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+                conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute("""CREATE TABLE IF NOT EXISTS images (
+                    path TEXT PRIMARY KEY, mtime_ns INTEGER, file_size INTEGER,
+                    format TEXT, width INTEGER, height INTEGER, mode TEXT,
+                    frames INTEGER, orientation INTEGER)""")
+                conn.commit()
+            except (OSError, sqlite3.Error) as e:
+                print(f"无法打开元数据索引 {self.db_path}: {str(e)}")
+                self._conn = False
+            else:
+                self._conn = conn
+        return self._conn or None
+    
+    @staticmethod
+    def _read(path):
+        """读取文件头，无法识别时返回None"""
+        try:
+            return ImageProcessor.read_image_info(path)
+        except (OSError, ValueError, SyntaxError):
+            return None
+    
+    @staticmethod
+    def _row_info(row):
+        return ImageInfo(*row) if row[0] is not None else None
+    
+    def _load_rows(self, conn, folder):
+        """读取folder下所有条目，返回 {绝对路径: (修改时间, 文件大小, 信息)}"""
+        # 按路径前缀做范围查询，可以使用主键索引
+        prefix = os.path.join(folder, '')
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = conn.execute(
+            "SELECT path, mtime_ns, file_size, format, width, height, mode, frames, orientation "
+            "FROM images WHERE path >= ? AND path < ?", (prefix, upper))
+        return {row[0]: (row[1], row[2], self._row_info(row[3:])) for row in rows}
+    
+    def scan(self, folder, image_files):
+        """获取folder下各文件（相对路径）的信息，返回 {相对路径: ImageInfo}，无法读取的文件为None
+
+        只对索引中没有或已变化的文件读取文件头，新读取的结果在一个事务中写回索引。
+        """
+        folder = os.path.abspath(folder)
+        with self._lock:
+            conn = self._connection()
+            known = self._load_rows(conn, folder) if conn else {}
+        
+        result = {}
+        stale = []  # [(相对路径, 绝对路径, 修改时间, 文件大小)]
+        for image_file in image_files:
+            path = os.path.join(folder, image_file)
+            try:
+                st = os.stat(path)
+            except OSError:
+                result[image_file] = None
+                continue
+            row = known.get(path)
+            if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+                result[image_file] = row[2]
+            else:
+                stale.append((image_file, path, st.st_mtime_ns, st.st_size))
+        
+        self.scanned = len(stale)
+        if not stale:
+            return result
+        # 读取文件头以I/O为主，线程数与线程后端的默认值一致
+        workers = self.max_workers or min(32, (os.cpu_count() or 1) + 4)
+        with ThreadPoolExecutor(max_workers=min(workers, len(stale))) as executor:
+            infos = list(executor.map(self._read, [path for _, path, _, _ in stale]))
+        rows = []
+        for (image_file, path, mtime_ns, file_size), info in zip(stale, infos):
+            result[image_file] = info
+            rows.append((path, mtime_ns, file_size) + (tuple(info) if info else (None,) * 6))
+        self._store(rows)
+        return result
+    
+    def _store(self, rows):
+        import sqlite3
+        with self._lock:
+            conn = self._connection()
+            if not conn:
+                return
+            try:
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            except sqlite3.Error as e:
+                print(f"写入元数据索引时出错: {str(e)}")
+    
+    def get(self, image_path):
+        """单个文件的信息，索引中的条目已过期时重新读取文件头；文件无法识别时返回None"""
+        path = os.path.abspath(image_path)
+        st = os.stat(path)
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT mtime_ns, file_size, format, width, height, mode, frames, orientation "
+                "FROM images WHERE path = ?", (path,)).fetchone() if conn else None
+        if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+            return self._row_info(row[2:])
+        info = self._read(path)
+        self._store([(path, st.st_mtime_ns, st.st_size) + (tuple(info) if info else (None,) * 6)])
+        return info
+    
+    def close(self):
+        with self._lock:
+            if self._conn:
+                self._conn.close()
+            self._conn = None
+
+
+class ImageFileStream:
+    """可重复迭代的流式图片文件来源
+
+    每次迭代都重新扫描文件夹并边扫描边产出文件，不在内存中保存完整列表。
+    迭代结束后 count 为本次产出的文件数。exclude_dirs 中的子文件夹（相对路径）不会被扫描。
+    """
+    def __init__(self, folder_path, include_subfolders=False, exclude_dirs=()):
+        self.folder_path = folder_path
+        self.include_subfolders = include_subfolders
+        self.exclude_dirs = set(exclude_dirs)
+        self.count = 0
+    
+    def __iter__(self):
+        self.count = 0
+        for image_file in ImageFileManager.iter_image_files(
+                self.folder_path, self.include_subfolders, self.exclude_dirs):
+            self.count += 1
+            yield image_file
+    
+    def __bool__(self):
+        return bool(self.folder_path)
+
+
+class ImageFileManager:
+    def __init__(self):
+        self.history = []  # 处理历史记录
+    
+    @staticmethod
+    def get_image_files(folder_path, include_subfolders=False, sort=True):
+        """获取文件夹中的所有图片文件
+        
+        Args:
+            folder_path: 文件夹路径
+            include_subfolders: 是否包含子文件夹
+            sort: 是否按路径排序，为False时按扫描顺序返回
+        """
+        image_files = list(ImageFileManager.iter_image_files(folder_path, include_subfolders))
+        return sorted(image_files) if sort else image_files
+    
+    @staticmethod
+    def iter_image_files(folder_path, include_subfolders=False, exclude_dirs=()):
+        """基于os.scandir流式扫描图片文件，边扫描边产出相对路径
+        
+        不排序、不缓存整个列表，适合文件数量极多的目录树；
+        当前目录的文件先于其子目录产出，不跟随目录符号链接（与os.walk默认行为一致）。
+        
+        Args:
+            exclude_dirs: 跳过的子文件夹（相对路径），用于避免扫描到正在写入的输出文件夹
+        """
+        pending = ['']
+        while pending:
+            rel_dir = pending.pop()
+            subdirs = []
+            try:
+                with os.scandir(os.path.join(folder_path, rel_dir)) as entries:
+                    for entry in entries:
+                        try:
+                            if include_subfolders and entry.is_dir(follow_symlinks=False):
+                                subdir = os.path.join(rel_dir, entry.name)
+                                if subdir not in exclude_dirs:
+                                    subdirs.append(subdir)
+                            elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                                yield os.path.join(rel_dir, entry.name)
+                        except OSError:
+                            continue
+            except OSError as e:
+                # 根目录无法读取时直接报错，子目录出错时跳过（与os.walk一致）
+                if not rel_dir:
+                    raise
+                print(f"无法读取文件夹 {rel_dir}: {str(e)}")
+                continue
+            # 倒序入栈，使子目录按扫描顺序依次处理
+            pending.extend(reversed(subdirs))
+    
+    @staticmethod
+    def output_folder_path(base_folder, suffix, params=None):
+        """根据操作和处理参数生成输出文件夹路径，不创建文件夹"""
+        folder_name = f"output_{suffix}"
+        if params:
+            param_str = "_".join(f"{k}_{v}" for k, v in params.items())
+            folder_name = f"{folder_name}_{param_str}"
+        return os.path.join(base_folder, folder_name)
+    
+    def ensure_output_folder(self, base_folder, suffix, params=None):
+        """确保输出文件夹存在，并根据处理参数生成文件夹名"""
+        output_folder = self.output_folder_path(base_folder, suffix, params)
+        os.makedirs(output_folder, exist_ok=True)
+        
+        # 记录处理历史
+        history_entry = {
+            'timestamp': os.path.getctime(output_folder),
+            'operation': suffix,
+            'params': params,
+            'output_folder': output_folder
+        }
+        self.history.append(history_entry)
+        
+        return output_folder
+    
+    def open_manifest(self, output_folder, use_hash=False):
+        """打开输出文件夹的处理清单，用于跳过已是最新的输出"""
+        return OutputManifest(output_folder, use_hash)
     
     def get_history(self):
         """获取处理历史记录"""
@@ -0,0 +1,19 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from model import MemoryBudget, _bounded_completion
+
+
+def test_shared_budget_without_control_waits_for_release():
+    # 预算被其他批次占满，且没有 control 时应等待释放，而不是在 None 上调用 wait_resumed
+    budget = MemoryBudget(100)
+    assert budget.try_acquire(100)
+    timer = threading.Timer(0.3, budget.release, args=(100,))
+    timer.start()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        done = [item for item, future in _bounded_completion(
+            lambda item: executor.submit(lambda: item), range(3), window=2, lane=None,
+            budget=budget, cost=lambda item: 60)]
+    timer.join()
+    assert sorted(done) == [0, 1, 2]
+    assert budget.used == 0
@@ -0,0 +1,57 @@
+import io
+import math
+
+import pytest
+from PIL import Image
+
+from model import ImageProcessor, BatchMetrics, OutputEncoder, METRIC_STAGES
+
+
+def test_kept_original_reports_source_mode(tmp_path):
+    # 纯色RGB图片：候选会被量化为调色板，但最高压缩级别的源文件已足够小，应保留原文件
+    source = tmp_path / 'in.png'
+    Image.new('RGB', (8, 8), (200, 10, 10)).save(source, 'PNG', compress_level=9)
+    original = source.read_bytes()
+    output = tmp_path / 'out.png'
+    
+    stats = ImageProcessor.compress_image(str(source), str(output))
+    assert stats['kept_original']
+    assert output.read_bytes() == original
+    assert stats['mode'] == 'RGB'
+    assert stats['palette'] is False
+    assert stats['palette_error'] is None
+    
+    metrics = BatchMetrics()
+    record = {f'{stage}_s': 0.0 for stage in METRIC_STAGES}
+    record.update(total_s=0.0, bytes_in=len(original), bytes_out=len(original),
+                  pixels_in=64, pixels_out=64, worker='test', result=stats)
+    metrics.add('in.png', True, record)
+    assert metrics.lossless['palette'] == 0
+    assert metrics.lossless['kept_original'] == 1
+
+
+def _jpeg_sizes(img, qualities):
+    sizes = {}
+    for q in qualities:
+        buffer = io.BytesIO()
+        img.save(buffer, 'JPEG', quality=q, optimize=True)
+        sizes[q] = buffer.tell()
+    return sizes
+
+
+@pytest.mark.parametrize('seed', [1, 2])
+def test_target_search_trials_capped_at_bisection(seed):
+    # 噪声与平滑区域混合，字节数随质量的变化不是线性的
+    noise = Image.effect_noise((160, 120), 20 + seed * 30).convert('RGB')
+    img = Image.blend(noise, Image.linear_gradient('L').resize((160, 120)).convert('RGB'), 0.5)
+    sizes = _jpeg_sizes(img, range(1, 96))
+    # 顶端1次，其余在 [1, 94] 中查找，不超过二分的 ceil(log2(95)) 次
+    cap = 1 + math.ceil(math.log2(95))
+    for target in range(sizes[1] - 100, sizes[95] + 100, (sizes[95] - sizes[1]) // 60):
+        output = io.BytesIO()
+        output.name = 'out.jpg'
+        stats = ImageProcessor._compress_to_target(img, output, target, 95, 1, OutputEncoder('jpeg'))
+        expected = max((q for q, size in sizes.items() if size <= target), default=None)
+        assert stats['quality'] == (expected or 1)
+        assert stats['fits'] == (expected is not None)
+        assert stats['trials'] <= cap, (target, stats)
@@ -0,0 +1,69 @@
+import array
+
+import pytest
+from PIL import Image
+
+from model import ImageProcessor
+
+
+@pytest.fixture
+def gray16_png(tmp_path):
+    """16位灰度PNG，取值覆盖 0-65535，大部分不是257的倍数（8位处理后会丢失）"""
+    size = (512, 64)
+    values = array.array('H', (i * 2 for i in range(size[0] * size[1])))
+    img = Image.frombytes('I;16', size, values.tobytes())
+    path = tmp_path / 'gray16.png'
+    img.save(path)
+    return str(path)
+
+
+def _open(path):
+    with Image.open(path) as img:
+        img.load()
+        return img
+
+
+def _values(img):
+    """I;16 图片的像素值"""
+    return array.array('H', img.convert('I;16').tobytes()).tolist()
+
+
+def test_exposure_keeps_16_bit_png(gray16_png, tmp_path):
+    output = str(tmp_path / 'out.png')
+    ImageProcessor.adjust_exposure(gray16_png, output, 1.0, gamma=1.2)
+    result = _open(output)
+    assert result.mode == 'I;16'
+    assert len(set(_values(result))) > 256
+
+
+def test_identity_tone_is_lossless_for_16_bit(gray16_png):
+    source = _open(gray16_png)
+    adjusted = ImageProcessor.exposure_image(source, 1.0)
+    assert adjusted.mode == 'I;16'
+    assert adjusted.tobytes() == source.convert('I;16').tobytes()
+
+
+def test_negative_is_exact_for_16_bit(gray16_png):
+    source = _open(gray16_png)
+    result = ImageProcessor.filter_image(source, 'negative')
+    assert result.mode == 'I;16'
+    assert _values(result) == [65535 - v for v in _values(source)]
+
+
+@pytest.mark.parametrize('filter_type', ['blur', 'sharpen', 'grayscale'])
+def test_filters_keep_16_bit(gray16_png, filter_type):
+    result = ImageProcessor.filter_image(_open(gray16_png), filter_type)
+    assert result.mode == 'I;16'
+
+
+def test_jpeg_output_is_scaled_to_8_bit(gray16_png, tmp_path):
+    output = str(tmp_path / 'out.jpg')
+    ImageProcessor.adjust_exposure(gray16_png, output, 1.2)
+    result = _open(output)
+    assert result.mode == 'L'
+    assert result.getextrema()[1] > 200
+
+
+def test_colour_filters_scale_to_8_bit(gray16_png):
+    result = ImageProcessor.filter_image(_open(gray16_png), 'sepia')
+    assert result.mode == 'RGB'
@@ -0,0 +1,16 @@
+from model import ImageProcessor, OutputEncoder, OutputManifest
+
+
+def test_params_key_uses_encoder_cache_key():
+    encoder = OutputEncoder('jpeg', quality=80)
+    key = OutputManifest.params_key(ImageProcessor.resize_image, {'width': 100, 'encoder': encoder})
+    assert encoder.cache_key() in key
+    assert str(encoder) not in key
+    
+    # 相同设置得到相同标识，编码参数变化时标识随之变化
+    same = OutputManifest.params_key(ImageProcessor.resize_image,
+                                     {'width': 100, 'encoder': OutputEncoder('jpeg', quality=80)})
+    other = OutputManifest.params_key(ImageProcessor.resize_image,
+                                      {'width': 100, 'encoder': OutputEncoder('jpeg', quality=90)})
+    assert key == same
+    assert key != other
@@ -0,0 +1,27 @@
+import pytest
+
+from model import ImageProcessor
+
+
+@pytest.mark.parametrize('operations, message', [
+    ([('resize', {})], 'width 或 height'),
+    ([('resize', {'w': 100})], '不支持参数: w'),
+    ([('exposure', {'brightness_factor': 1.2, 'brightness': 2})], '不支持参数: brightness'),
+    ([('filter', {'filter_type': 'bogus'})], '未知的滤镜类型: bogus'),
+    ([('compress', {})], '缺少参数: quality'),
+    ([('crop', {})], '未知的操作: crop'),
+    ([], '操作列表为空'),
+])
+def test_validate_pipeline_rejects(operations, message):
+    with pytest.raises(ValueError, match=message):
+        ImageProcessor.validate_pipeline(operations)
+
+
+def test_validate_pipeline_accepts_optional_params():
+    ImageProcessor.validate_pipeline([
+        ('resize', {'height': 100, 'keep_ratio': False}),
+        ('exposure', {'brightness_factor': 1.1, 'contrast': 1.2, 'gamma': 0.9}),
+        ('filter', {'filter_type': 'contour'}),
+        ('random', {'max_rotation': 3, 'seed': 7}),
+        ('compress', {'quality': 80}),
+    ])
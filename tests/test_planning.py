@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from PIL import Image
+
+from controller import ImageResizerController
+
+# 文件名顺序与像素数顺序不同
+SIZES = {'a.png': (40, 30), 'b.png': (400, 300), 'c.png': (120, 90)}
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    for name, size in SIZES.items():
+        Image.effect_noise(size, 32).save(folder / name)
+    controller = ImageResizerController()
+    controller.select_folder(str(folder))
+    controller.set_output_folder(str(tmp_path / 'out'))
+    return controller
+
+
+def _processing_order(controller, monkeypatch):
+    """运行一次压缩，返回交给批处理的文件顺序"""
+    seen = []
+    
+    def fake_batch(process_func, image_files, *args, **kwargs):
+        seen.extend(image_files)
+        return len(seen)
+    
+    monkeypatch.setattr(controller.image_processor, 'process_images_batch', fake_batch)
+    success, message = controller.process_compress(80)
+    assert success, message
+    return seen
+
+
+def test_default_order_is_largest_first_regardless_of_listing(controller, monkeypatch):
+    controller.load_images()
+    assert controller.image_files == ['a.png', 'b.png', 'c.png']
+    assert _processing_order(controller, monkeypatch) == ['b.png', 'c.png', 'a.png']
+
+
+def test_listing_order_when_largest_first_disabled(controller, monkeypatch):
+    controller.set_largest_first(False)
+    controller.load_images()
+    assert _processing_order(controller, monkeypatch) == ['a.png', 'b.png', 'c.png']
+    
+    controller.set_listing('width')
+    assert _processing_order(controller, monkeypatch) == ['b.png', 'c.png', 'a.png']
+
+
+def test_dry_run_writes_nothing(controller, tmp_path):
+    controller.set_dry_run(True)
+    controller.load_images()
+    success, message = controller.process_compress(80)
+    assert success
+    assert controller.last_plan.image_files == ['b.png', 'c.png', 'a.png']
+    assert not os.path.exists(tmp_path / 'out')
+
+
+def test_unchanged_files_go_through_batch(controller, tmp_path):
+    # 宽度120时 c.png 尺寸不变，直接复制，但与其他图片一样计入进度和清单
+    progress = []
+    controller.set_progress_callback(lambda done, total: progress.append((done, total)))
+    controller.load_images()
+    success, message = controller.process_resize(width=120)
+    assert success, message
+    assert controller.last_plan.unchanged == ['c.png']
+    assert "1 张图片处理后不会变化，已直接复制" in message
+    assert progress[-1] == (3, 3)
+    assert (tmp_path / 'out' / 'c.png').read_bytes() == (tmp_path / 'src' / 'c.png').read_bytes()
+    
+    # 再次运行时按清单全部跳过，不会重新复制
+    success, message = controller.process_resize(width=120)
+    assert success, message
+    assert "跳过未变化的 3 张" in message
+    assert "直接复制" not in message
+
+
+def test_cancel_stops_unchanged_copies(controller, tmp_path):
+    controller.set_max_workers(1)
+    controller.set_progress_callback(lambda done, total: controller.cancel_batch())
+    controller.load_images()
+    success, message = controller.process_resize(width=120)
+    assert not os.path.exists(tmp_path / 'out' / 'c.png')
+    assert "处理已取消" in message
+
+
+def test_listing_order_skips_metadata_scan(controller, monkeypatch):
+    controller.set_largest_first(False)
+    controller.load_images()
+    
+    def no_scan(*args, **kwargs):
+        raise AssertionError("按列表顺序处理时不应扫描文件头")
+    
+    monkeypatch.setattr(controller, 'scan_metadata', no_scan)
+    success, message = controller.process_resize(width=120)
+    assert success, message
+    assert controller.last_plan is None
+    # 不生成计划时仍能汇报直接复制的图片
+    assert "1 张图片处理后不会变化，已直接复制" in message
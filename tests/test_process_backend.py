@@ -0,0 +1,54 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+import model
+from model import ImageProcessor, ShardedTarSink, SHARD_INDEX_NAME
+
+
+@pytest.fixture
+def small_images(tmp_path):
+    folder = tmp_path / 'src'
+    folder.mkdir()
+    names = [f'img{i}.png' for i in range(8)]
+    for i, name in enumerate(names):
+        Image.new('RGB', (16, 12), (i * 30, 0, 0)).save(folder / name)
+    return str(folder), names
+
+
+def test_small_batch_is_spread_across_workers(small_images, tmp_path, monkeypatch):
+    folder, names = small_images
+    chunks = []
+    original = model._iter_chunks
+    
+    def recording(*args, **kwargs):
+        for chunk in original(*args, **kwargs):
+            chunks.append(list(chunk))
+            yield chunk
+    
+    monkeypatch.setattr(model, '_iter_chunks', recording)
+    processed = ImageProcessor.process_images_batch(
+        ImageProcessor.resize_image, names, folder, str(tmp_path / 'out'),
+        max_workers=4, backend='process', width=8)
+    assert processed == len(names)
+    # 8个小文件、4个进程：每块不超过 ceil(8 / (4 * 4)) = 1 个文件，而不是全部打包成一块
+    assert len(chunks) == len(names)
+    assert sorted(f for chunk in chunks for f in chunk) == sorted(names)
+
+
+def test_process_backend_sink_receives_encoded_data(small_images, tmp_path):
+    folder, names = small_images
+    output = str(tmp_path / 'out')
+    sink = ShardedTarSink(output)
+    try:
+        processed = ImageProcessor.process_images_batch(
+            ImageProcessor.resize_image, names, folder, output, max_workers=2, backend='process',
+            sink=sink, width=8)
+    finally:
+        sink.close()
+    assert processed == len(names)
+    with open(os.path.join(output, SHARD_INDEX_NAME), encoding='utf-8') as f:
+        entries = [json.loads(line) for line in f]
+    assert sorted(entry['file'] for entry in entries) == sorted(names)
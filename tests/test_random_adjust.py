@@ -0,0 +1,68 @@
+import os
+
+import pytest
+from PIL import Image
+
+from model import ImageProcessor, ImageFileManager, ShardedTarSink
+
+
+def _make_tree(folder):
+    """两个子文件夹中各有一张同名、内容相同的图片"""
+    img = Image.effect_noise((64, 48), 64).convert('RGB')
+    for sub in ('a', 'b'):
+        os.makedirs(os.path.join(folder, sub))
+        img.save(os.path.join(folder, sub, 'x.png'))
+    return ImageFileManager.get_image_files(folder, include_subfolders=True)
+
+
+def _read(path):
+    with Image.open(path) as img:
+        return img.tobytes()
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process', 'hybrid'])
+def test_seed_is_keyed_on_relative_output_path(tmp_path, backend):
+    source = str(tmp_path / 'src')
+    files = _make_tree(source)
+    outputs = {}
+    for run in ('first', 'second'):
+        output = str(tmp_path / f'{backend}_{run}')
+        processed = ImageProcessor.process_images_batch(
+            ImageProcessor.random_adjust, files, source, output, max_workers=2, backend=backend,
+            max_rotation=30, seed=7)
+        assert processed == 2
+        outputs[run] = {f: _read(os.path.join(output, f)) for f in files}
+    
+    a, b = os.path.join('a', 'x.png'), os.path.join('b', 'x.png')
+    # 同名文件在不同子文件夹中得到不同的随机结果，重复运行结果相同
+    assert outputs['first'][a] != outputs['first'][b]
+    assert outputs['first'] == outputs['second']
+
+
+def test_seed_matches_across_backends(tmp_path):
+    source = str(tmp_path / 'src')
+    files = _make_tree(source)
+    results = []
+    for backend in ('thread', 'process', 'hybrid'):
+        output = str(tmp_path / backend)
+        ImageProcessor.process_images_batch(
+            ImageProcessor.run_pipeline, files, source, output, max_workers=2, backend=backend,
+            operations=[('random', {'max_rotation': 30, 'seed': 7})])
+        results.append({f: _read(os.path.join(output, f)) for f in files})
+    assert results[0] == results[1] == results[2]
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_variants_to_sink_are_rejected_with_output_reason(tmp_path, backend, capsys):
+    source = str(tmp_path / 'src')
+    files = _make_tree(source)
+    output = str(tmp_path / 'out')
+    sink = ShardedTarSink(output)
+    try:
+        processed = ImageProcessor.process_images_batch(
+            ImageProcessor.random_adjust, files, source, output, max_workers=2, backend=backend,
+            sink=sink, max_rotation=5, variants=2)
+    finally:
+        sink.close()
+    assert processed == 0
+    assert "生成多个变体需要输出到文件夹" in capsys.readouterr().out
@@ -0,0 +1,22 @@
+import os
+
+from PIL import Image
+
+from model import ThumbnailStore
+
+
+def test_put_overwrite_keeps_byte_count(tmp_path):
+    source = tmp_path / 'a.png'
+    Image.new('RGB', (64, 48), (10, 20, 30)).save(source)
+    other = tmp_path / 'b.png'
+    Image.new('RGB', (64, 48), (30, 20, 10)).save(other)
+    store = ThumbnailStore(cache_dir=str(tmp_path / 'cache'))
+    
+    store.put(str(source), Image.new('RGB', (32, 24), (10, 20, 30)))
+    store.put(str(other), Image.new('RGB', (32, 24), (30, 20, 10)))
+    # 同一源文件重复写入（大小不同的缩略图）不应累加旧文件的大小
+    for size in ((32, 24), (16, 12), (32, 24)):
+        store.put(str(source), Image.effect_noise(size, 50).convert('RGB'))
+    
+    assert store._bytes == store._scan()[1]
+    assert len(os.listdir(store.cache_dir)) == 2
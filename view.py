@@ -1,10 +1,16 @@
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from PIL import Image, ImageTk
+from PIL import ImageTk
 import threading
 from controller import ImageResizerController
 
+# 预览防抖间隔（毫秒）：滑块连续移动时只在停止后渲染一次
+PREVIEW_DEBOUNCE_MS = 80
+
+# 批处理进度的刷新间隔（毫秒）：主线程按此频率读取进度，后台线程不直接操作界面
+PROGRESS_POLL_MS = 100
+
 class ImageResizerApp:
     def __init__(self, root):
         self.root = root
@@ -12,11 +18,13 @@ class ImageResizerApp:
         self.root.geometry("1000x700")
         self.controller = ImageResizerController()
         
-        # 设置进度回调
-        self.controller.set_progress_callback(self.update_progress)
+        # 设置进度回调：后台线程只更新计数，界面在主线程中定时读取
+        self.progress_tracker = self.controller.progress_tracker
+        self.controller.set_progress_callback(self.progress_tracker)
+        self.progress_after_id = None  # 等待中的进度刷新
         
-        # 设置最大工作线程数（可根据系统性能调整）
-        self.controller.set_max_workers(4)  # 使用4个线程进行处理
+        # 设置最大工作线程数（默认与CPU核心数一致，可在界面中调整）
+        self.controller.set_max_workers(os.cpu_count() or 4)
         
         # 设置整体样式
         style = ttk.Style()
@@ -33,6 +41,8 @@ class ImageResizerApp:
         # 进度条变量
         self.progress_var = tk.DoubleVar(value=0.0)
         self.is_processing = False
+        self.preview_path = None  # 当前预览的图片路径
+        self.preview_after_id = None  # 等待中的预览刷新（用于防抖）
         
         self._init_ui()
     
@@ -71,6 +81,26 @@ class ImageResizerApp:
                                   wraplength=400)
         self.path_label.pack(pady=(0, 5), padx=5)
         
+        # 排序和尺寸筛选（使用元数据索引，不重新打开图片）
+        self.listing_frame = ttk.Frame(self.left_frame)
+        self.listing_frame.pack(fill='x', padx=5, pady=(0, 5))
+        ttk.Label(self.listing_frame, text="列表排序:").pack(side='left')
+        self.sort_var = tk.StringVar(value=self.controller.sort_types[self.controller.sort_by])
+        sort_combo = ttk.Combobox(self.listing_frame,
+                                  textvariable=self.sort_var,
+                                  values=list(self.controller.sort_types.values()),
+                                  state='readonly',
+                                  width=6)
+        sort_combo.pack(side='left', padx=(2, 8))
+        sort_combo.bind('<<ComboboxSelected>>', lambda e: self.apply_listing())
+        ttk.Label(self.listing_frame, text="最小宽:").pack(side='left')
+        self.min_width_var = tk.StringVar(value="")
+        ttk.Entry(self.listing_frame, textvariable=self.min_width_var, width=6).pack(side='left', padx=(2, 8))
+        ttk.Label(self.listing_frame, text="最小高:").pack(side='left')
+        self.min_height_var = tk.StringVar(value="")
+        ttk.Entry(self.listing_frame, textvariable=self.min_height_var, width=6).pack(side='left', padx=2)
+        ttk.Button(self.listing_frame, text="筛选", command=self.apply_listing).pack(side='left', padx=(5, 0))
+        
         # 创建列表框和滚动条
         self.listbox_frame = ttk.Frame(self.left_frame)
         self.listbox_frame.pack(fill='both', expand=True, padx=5, pady=5)
@@ -126,6 +156,18 @@ class ImageResizerApp:
         self.progress_label = ttk.Label(self.progress_frame, text="就绪")
         self.progress_label.pack(pady=(0, 5))
         
+        # 暂停/取消按钮，仅在处理过程中可用
+        self.batch_buttons_frame = ttk.Frame(self.progress_frame)
+        self.batch_buttons_frame.pack(pady=(0, 5))
+        self.pause_button = ttk.Button(self.batch_buttons_frame, text="暂停",
+                                       command=self.toggle_pause, state='disabled')
+        self.pause_button.pack(side='left', padx=5)
+        self.cancel_button = ttk.Button(self.batch_buttons_frame, text="取消",
+                                        command=self.cancel_processing, state='disabled')
+        self.cancel_button.pack(side='left', padx=5)
+        
+        self._init_settings_frame()
+        
         # 功能区域（使用Notebook来组织不同功能）
         self.notebook = ttk.Notebook(self.right_frame)
         self.notebook.pack(fill='both', expand=True)
@@ -135,7 +177,94 @@ class ImageResizerApp:
         self._init_random_tab()
         self._init_exposure_tab()
         self._init_filter_tab()
-        self._init_filter_tab()
+        self._init_pipeline_tab()
+        
+        # 切换功能标签页时按新的处理类型刷新预览
+        self.notebook.bind('<<NotebookTabChanged>>', lambda e: self.schedule_effect_preview())
+    
+    def _init_settings_frame(self):
+        # 处理设置：执行后端和并行数
+        self.settings_frame = ttk.Frame(self.right_frame)
+        self.settings_frame.pack(fill='x', pady=(0, 10))
+        
+        ttk.Label(self.settings_frame, text="执行方式:").pack(side='left', padx=(5, 0))
+        self.backend_var = tk.StringVar(value=self.controller.backend_types[self.controller.backend])
+        ttk.Combobox(self.settings_frame,
+                     textvariable=self.backend_var,
+                     values=list(self.controller.backend_types.values()),
+                     state='readonly',
+                     width=8).pack(side='left', padx=5)
+        
+        ttk.Label(self.settings_frame, text="并行数:").pack(side='left', padx=(10, 0))
+        self.workers_var = tk.IntVar(value=self.controller.max_workers)
+        ttk.Spinbox(self.settings_frame,
+                    from_=1, to=128,
+                    textvariable=self.workers_var,
+                    width=5).pack(side='left', padx=5)
+        
+        self.incremental_var = tk.BooleanVar(value=self.controller.incremental)
+        ttk.Checkbutton(self.settings_frame,
+                        text="跳过未变化的图片",
+                        variable=self.incremental_var).pack(side='left', padx=(10, 0))
+        
+        self.metrics_var = tk.BooleanVar(value=self.controller.collect_metrics)
+        ttk.Checkbutton(self.settings_frame,
+                        text="统计耗时",
+                        variable=self.metrics_var).pack(side='left', padx=(10, 0))
+        
+        # 大图优先：按预计耗时从大到小处理；取消时按文件列表的顺序处理
+        self.largest_first_var = tk.BooleanVar(value=self.controller.largest_first)
+        ttk.Checkbutton(self.settings_frame,
+                        text="大图优先",
+                        variable=self.largest_first_var).pack(side='left', padx=(10, 0))
+        
+        # 只预估：显示处理顺序、预计耗时和输出大小，不处理图片
+        self.dry_run_var = tk.BooleanVar(value=self.controller.dry_run)
+        ttk.Checkbutton(self.settings_frame,
+                        text="仅预估",
+                        variable=self.dry_run_var).pack(side='left', padx=(10, 0))
+        
+        # 输出格式单独一行
+        self.output_settings_frame = ttk.Frame(self.right_frame)
+        self.output_settings_frame.pack(fill='x', pady=(0, 10))
+        ttk.Label(self.output_settings_frame, text="输出格式:").pack(side='left', padx=(5, 0))
+        self.output_format_var = tk.StringVar(value=self.controller.output_format_types['original'])
+        ttk.Combobox(self.output_settings_frame,
+                     textvariable=self.output_format_var,
+                     values=list(self.controller.output_format_types.values()),
+                     state='readonly',
+                     width=10).pack(side='left', padx=5)
+        
+        # 训练数据等大量小文件可写入tar分片（WebDataset格式）
+        self.shard_var = tk.BooleanVar(value=self.controller.shard_bytes is not None)
+        ttk.Checkbutton(self.output_settings_frame,
+                        text="输出为tar分片",
+                        variable=self.shard_var).pack(side='left', padx=(10, 0))
+    
+    def apply_settings(self):
+        """把界面上的处理设置同步到控制器，设置无效时提示并返回False"""
+        for backend, text in self.controller.backend_types.items():
+            if text == self.backend_var.get():
+                self.controller.set_backend(backend)
+        try:
+            self.controller.set_max_workers(max(1, int(self.workers_var.get())))
+        except (ValueError, tk.TclError):
+            self.workers_var.set(self.controller.max_workers)
+        self.controller.set_incremental(self.incremental_var.get(), self.controller.use_hash)
+        self.controller.set_metrics(self.metrics_var.get(), self.controller.metrics_jsonl,
+                                    self.controller.metrics_prometheus)
+        self.controller.set_dry_run(self.dry_run_var.get())
+        self.controller.set_largest_first(self.largest_first_var.get())
+        if self.shard_var.get() != (self.controller.shard_bytes is not None):
+            self.controller.set_shard_output(self.shard_var.get())
+        for preset, text in self.controller.output_format_types.items():
+            if text == self.output_format_var.get():
+                try:
+                    self.controller.set_output_format(preset)
+                except ValueError as e:
+                    messagebox.showerror("错误", str(e))
+                    return False
+        return True
     
     def _init_resize_tab(self):
         # 调整尺寸标签页
@@ -164,7 +293,12 @@ class ImageResizerApp:
         self.keep_ratio_var = tk.BooleanVar(value=True)
         ttk.Checkbutton(self.resize_frame, 
                        text="保持原始比例",
-                       variable=self.keep_ratio_var).pack(pady=5)
+                       variable=self.keep_ratio_var,
+                       command=self.schedule_effect_preview).pack(pady=5)
+        
+        # 输入尺寸时刷新预览
+        self.width_var.trace_add('write', lambda *args: self.schedule_effect_preview())
+        self.height_var.trace_add('write', lambda *args: self.schedule_effect_preview())
         
         ttk.Button(self.resize_frame,
                   text="开始调整尺寸",
@@ -183,7 +317,7 @@ class ImageResizerApp:
                  from_=1, to=100,
                  orient='horizontal',
                  variable=self.quality_var,
-                 command=lambda v: self.quality_label.config(text=str(int(float(v)))))
+                 command=lambda v: self._on_slider(self.quality_label, str(int(float(v)))))
         quality_scale.pack(fill='x', pady=5)
         
         ttk.Label(self.compress_frame,
@@ -192,6 +326,14 @@ class ImageResizerApp:
                       "86-100: 高质量，文件较大",
                  justify='left').pack(pady=5)
         
+        # 目标大小（可选）：填写后在压缩质量以内查找不超过该大小的最高质量
+        self.target_size_frame = ttk.Frame(self.compress_frame)
+        self.target_size_frame.pack(fill='x', pady=5)
+        ttk.Label(self.target_size_frame, text="目标大小:").pack(side='left')
+        self.target_kb_var = tk.StringVar()
+        ttk.Entry(self.target_size_frame, textvariable=self.target_kb_var, width=10).pack(side='left', padx=5)
+        ttk.Label(self.target_size_frame, text="KB（可选，留空按固定质量压缩）").pack(side='left')
+        
         ttk.Button(self.compress_frame,
                   text="开始压缩",
                   command=self.process_compress).pack(pady=15, padx=10, fill='x')
@@ -209,9 +351,20 @@ class ImageResizerApp:
                  from_=1, to=45,
                  orient='horizontal',
                  variable=self.rotation_var,
-                 command=lambda v: self.rotation_label.config(text=f"{int(float(v))}°"))
+                 command=lambda v: self._on_slider(self.rotation_label, f"{int(float(v))}°"))
         rotation_scale.pack(fill='x', pady=5)
         
+        # 每张图片的变体数和随机种子（留空时每次结果不同）
+        self.variants_frame = ttk.Frame(self.random_frame)
+        self.variants_frame.pack(fill='x', pady=5)
+        ttk.Label(self.variants_frame, text="变体数:").pack(side='left')
+        self.variants_var = tk.IntVar(value=1)
+        ttk.Spinbox(self.variants_frame, from_=1, to=20, textvariable=self.variants_var,
+                    width=5).pack(side='left', padx=5)
+        ttk.Label(self.variants_frame, text="随机种子:").pack(side='left', padx=(10, 0))
+        self.seed_var = tk.StringVar()
+        ttk.Entry(self.variants_frame, textvariable=self.seed_var, width=10).pack(side='left', padx=5)
+        
         ttk.Button(self.random_frame,
                   text="开始随机微调",
                   command=self.process_random).pack(pady=15, padx=10, fill='x')
@@ -229,13 +382,46 @@ class ImageResizerApp:
                  from_=0.1, to=2.0,
                  orient='horizontal',
                  variable=self.exposure_var,
-                 command=lambda v: self.exposure_label.config(text=f"{float(v):.1f}"))
+                 command=lambda v: self._on_slider(self.exposure_label, f"{float(v):.1f}"))
         exposure_scale.pack(fill='x', pady=5)
         
         ttk.Label(self.exposure_frame,
                  text="0.1-0.9: 降低曝光度\n1.0: 保持原样\n1.1-2.0: 提高曝光度",
                  justify='left').pack(pady=5)
         
+        # 对比度和伽马，与曝光度合成一张查找表
+        ttk.Label(self.exposure_frame, text="对比度:").pack(pady=(5, 0))
+        self.contrast_var = tk.DoubleVar(value=1.0)
+        self.contrast_label = ttk.Label(self.exposure_frame, text="1.0")
+        self.contrast_label.pack()
+        ttk.Scale(self.exposure_frame,
+                 from_=0.5, to=2.0,
+                 orient='horizontal',
+                 variable=self.contrast_var,
+                 command=lambda v: self._on_slider(self.contrast_label, f"{float(v):.1f}")).pack(fill='x', pady=5)
+        
+        ttk.Label(self.exposure_frame, text="伽马:").pack(pady=(5, 0))
+        self.gamma_var = tk.DoubleVar(value=1.0)
+        self.gamma_label = ttk.Label(self.exposure_frame, text="1.0")
+        self.gamma_label.pack()
+        ttk.Scale(self.exposure_frame,
+                 from_=0.3, to=3.0,
+                 orient='horizontal',
+                 variable=self.gamma_var,
+                 command=lambda v: self._on_slider(self.gamma_label, f"{float(v):.1f}")).pack(fill='x', pady=5)
+        
+        # 色阶：输入的黑点和白点
+        self.levels_frame = ttk.Frame(self.exposure_frame)
+        self.levels_frame.pack(fill='x', pady=5)
+        ttk.Label(self.levels_frame, text="色阶 黑点:").pack(side='left')
+        self.black_var = tk.IntVar(value=0)
+        ttk.Spinbox(self.levels_frame, from_=0, to=254, textvariable=self.black_var,
+                    width=5, command=self.schedule_effect_preview).pack(side='left', padx=5)
+        ttk.Label(self.levels_frame, text="白点:").pack(side='left', padx=(10, 0))
+        self.white_var = tk.IntVar(value=255)
+        ttk.Spinbox(self.levels_frame, from_=1, to=255, textvariable=self.white_var,
+                    width=5, command=self.schedule_effect_preview).pack(side='left', padx=5)
+        
         ttk.Button(self.exposure_frame,
                   text="开始调整曝光度",
                   command=self.process_exposure).pack(pady=15, padx=10, fill='x')
@@ -252,73 +438,200 @@ class ImageResizerApp:
         self.load_images()
     
     def load_images(self):
-        # 清空列表框
-        self.listbox.delete(0, tk.END)
-        
         # 获取所有图片文件
         image_files = self.controller.load_images(self.include_subfolders.get())
+        self._fill_listbox(image_files)
         
-        # 更新列表框
+        # 在后台填充磁盘缩略图缓存
+        self.controller.warm_thumbnails()
+    
+    def _fill_listbox(self, image_files):
+        self.listbox.delete(0, tk.END)
         for file in image_files:
             self.listbox.insert(tk.END, file)
     
+    def apply_listing(self):
+        """按界面上的排序方式和最小宽高重新生成文件列表"""
+        sort_by = next((key for key, text in self.controller.sort_types.items()
+                        if text == self.sort_var.get()), 'name')
+        try:
+            min_width = int(self.min_width_var.get() or 0)
+            min_height = int(self.min_height_var.get() or 0)
+            image_files = self.controller.set_listing(sort_by, min_width, min_height)
+        except ValueError:
+            messagebox.showerror("错误", "最小宽度和高度请输入非负整数！")
+            return
+        self._fill_listbox(image_files)
+        self.preview_path = None
+        self.controller.cancel_preview()
+        self.image_label.config(image='')
+        self.size_label.config(text="")
+    
     def show_preview(self, event):
         selection = self.listbox.curselection()
         if selection:
             try:
-                image_file = self.controller.image_files[selection[0]]
-                image_path = os.path.join(self.controller.current_folder, image_file)
-                image = Image.open(image_path)
-                
-                # 获取并显示原始图片尺寸
-                original_size = image.size
-                self.size_label.config(text=f"图片尺寸: {original_size[0]} x {original_size[1]} 像素")
-                
-                # 调整图片大小以适应预览窗口
-                preview_size = (300, 300)
-                image.thumbnail(preview_size, Image.Resampling.LANCZOS)
-                
-                # 创建PhotoImage对象
-                photo = ImageTk.PhotoImage(image)
+                image_path = self.controller.get_image_path(selection[0])
                 
-                # 更新预览标签
-                self.image_label.config(image=photo)
-                self.image_label.image = photo  # 保持引用
+                # 尺寸等信息来自元数据索引（只读取文件头），无需完整解码
+                info = self.controller.get_image_info(image_path)
+                text = f"图片尺寸: {info.width} x {info.height} 像素  {info.format} {info.mode}"
+                if info.frames > 1:
+                    text += f"  {info.frames} 帧"
+                self.size_label.config(text=text)
             except Exception as e:
                 messagebox.showerror("错误", f"无法加载图片: {str(e)}")
                 self.size_label.config(text="")  # 清空尺寸信息
+                return
+            
+            # 立即渲染当前图片的预览，同时在后台预取相邻图片
+            self.preview_path = image_path
+            self.controller.prefetch_previews(selection[0])
+            self.schedule_effect_preview(delay=0)
+    
+    def _on_slider(self, label, text):
+        """滑块移动时更新数值标签并刷新预览"""
+        label.config(text=text)
+        self.schedule_effect_preview()
+    
+    def schedule_effect_preview(self, delay=PREVIEW_DEBOUNCE_MS):
+        """防抖刷新预览：参数连续变化时只在停止delay毫秒后渲染一次"""
+        if self.preview_after_id is not None:
+            self.root.after_cancel(self.preview_after_id)
+        self.preview_after_id = self.root.after(delay, self._render_effect_preview)
+    
+    def _current_effect(self):
+        """当前标签页对应的处理类型和参数，无可预览的效果时返回 (None, {})"""
+        tab = self.notebook.select()
+        try:
+            if tab == str(self.resize_frame):
+                width = int(self.width_var.get()) if self.width_var.get() else None
+                height = int(self.height_var.get()) if self.height_var.get() else None
+                if width or height:
+                    return 'resize', {'width': width, 'height': height,
+                                      'keep_ratio': self.keep_ratio_var.get()}
+            elif tab == str(self.compress_frame):
+                return 'compress', {'quality': self.quality_var.get()}
+            elif tab == str(self.random_frame):
+                return 'random', {'max_rotation': self.rotation_var.get()}
+            elif tab == str(self.exposure_frame):
+                return 'exposure', self._tone_params()
+            elif tab == str(self.filter_frame):
+                return 'filter', {'filter_type': self.filter_var.get()}
+        except (ValueError, tk.TclError):
+            pass  # 输入尚不完整时显示原图
+        return None, {}
+    
+    def _render_effect_preview(self):
+        """在后台线程中基于缩略图渲染当前效果，只保留最新一次请求"""
+        self.preview_after_id = None
+        if not self.preview_path:
+            self.controller.cancel_preview()
+            return
+        process_type, params = self._current_effect()
+        self.controller.render_preview(self.preview_path, process_type, params,
+                                       self._on_preview_ready)
+    
+    def _on_preview_ready(self, image_path, image, error):
+        """预览渲染完成（在后台线程中调用），转到主线程显示"""
+        self.root.after(0, lambda: self._display_preview(image_path, image, error))
+    
+    def _display_preview(self, image_path, image, error):
+        if image_path != self.preview_path:
+            return  # 已经选中了其他图片
+        if error:
+            messagebox.showerror("错误", f"无法加载图片: {str(error)}")
+            self.size_label.config(text="")
+            return
+        
+        # 创建PhotoImage对象
+        photo = ImageTk.PhotoImage(image)
+        
+        # 更新预览标签
+        self.image_label.config(image=photo)
+        self.image_label.image = photo  # 保持引用
     
     def delete_selected(self):
         selection = self.listbox.curselection()
         if selection:
             index = selection[0]
             self.listbox.delete(index)
-            del self.controller.image_files[index]
+            self.controller.remove_image(index)
             # 清除预览和尺寸信息
+            self.preview_path = None
+            self.controller.cancel_preview()
             self.image_label.config(image='')
             self.size_label.config(text="")
     
-    def update_progress(self, current, total):
-        """更新进度条"""
-        progress = current / total * 100 if total > 0 else 0
-        self.progress_var.set(progress)
-        self.progress_label.config(text=f"处理中... {current}/{total} ({progress:.1f}%)")
-        self.root.update_idletasks()  # 强制更新UI
+    def poll_progress(self):
+        """在主线程中定时读取批处理进度并刷新显示"""
+        self.update_progress(*self.progress_tracker.snapshot())
+        self.progress_after_id = self.root.after(PROGRESS_POLL_MS, self.poll_progress)
+    
+    def update_progress(self, current, total, rate=None, eta=None):
+        """更新进度条，总数未知（流式扫描）时只显示已处理数量"""
+        control = self.controller.batch_control
+        if control.cancelled:
+            status = "正在取消..."
+        elif control.paused:
+            status = "已暂停"
+        elif current == 0 and not rate:
+            return
+        else:
+            status = "处理中..."
+        if total:
+            progress = current / total * 100
+            self.progress_var.set(progress)
+            text = f"{status} {current}/{total} ({progress:.1f}%)"
+        else:
+            text = f"{status} {current}"
+        if rate:
+            text += f"  {rate:.1f} 张/秒"
+        if eta is not None:
+            minutes, seconds = divmod(int(eta + 0.5), 60)
+            text += f"  剩余 {minutes}:{seconds:02d}"
+        self.progress_label.config(text=text)
     
     def reset_progress(self):
         """重置进度条"""
+        if self.progress_after_id:
+            self.root.after_cancel(self.progress_after_id)
+            self.progress_after_id = None
         self.progress_var.set(0)
         self.progress_label.config(text="就绪")
+        self.pause_button.config(text="暂停", state='disabled')
+        self.cancel_button.config(state='disabled')
         self.is_processing = False
     
+    def toggle_pause(self):
+        """暂停或继续当前批处理"""
+        if self.controller.batch_control.paused:
+            self.controller.resume_batch()
+            self.pause_button.config(text="暂停")
+        else:
+            self.controller.pause_batch()
+            self.pause_button.config(text="继续")
+    
+    def cancel_processing(self):
+        """取消当前批处理，正在处理的图片完成后停止"""
+        self.controller.cancel_batch()
+        self.pause_button.config(state='disabled')
+        self.cancel_button.config(state='disabled')
+    
     def process_in_thread(self, process_func, *args, **kwargs):
         """在线程中处理图片"""
         if self.is_processing:
-            messagebox.showwarning("警告", "有处理任务正在进行中，请等待完成")
+            messagebox.showwarning("警告", "有处理任务正在进行中，请等待完成或先取消")
             return
         
+        if not self.apply_settings():
+            return
         self.is_processing = True
         self.progress_label.config(text="准备处理...")
+        self.progress_tracker.reset()
+        self.poll_progress()
+        self.pause_button.config(text="暂停", state='normal')
+        self.cancel_button.config(state='normal')
         
         def run():
             try:
@@ -359,21 +672,52 @@ class ImageResizerApp:
             messagebox.showerror("错误", "请输入有效的数字！")
     
     def process_compress(self):
+        try:
+            target_kb = float(self.target_kb_var.get()) if self.target_kb_var.get().strip() else None
+        except ValueError:
+            messagebox.showerror("错误", "请输入有效的目标大小！")
+            return
         self.process_in_thread(
             self.controller.process_compress,
-            self.quality_var.get()
+            self.quality_var.get(),
+            max_bytes=int(target_kb * 1024) if target_kb else None
         )
     
     def process_random(self):
+        try:
+            variants = self.variants_var.get()
+        except tk.TclError:
+            messagebox.showerror("错误", "请输入有效的变体数！")
+            return
         self.process_in_thread(
             self.controller.process_random,
-            self.rotation_var.get()
+            self.rotation_var.get(),
+            seed=self.seed_var.get().strip() or None,
+            variants=variants
         )
     
+    def _tone_params(self):
+        """曝光度标签页的设置，对比度、伽马、色阶只在偏离默认值时给出"""
+        params = {'brightness_factor': round(self.exposure_var.get(), 1)}
+        if round(self.contrast_var.get(), 1) != 1.0:
+            params['contrast'] = round(self.contrast_var.get(), 1)
+        if round(self.gamma_var.get(), 1) != 1.0:
+            params['gamma'] = round(self.gamma_var.get(), 1)
+        levels = (self.black_var.get(), self.white_var.get())
+        if levels != (0, 255):
+            params['levels'] = levels
+        return params
+    
     def process_exposure(self):
+        try:
+            params = self._tone_params()
+        except tk.TclError:
+            messagebox.showerror("错误", "请输入有效的色阶！")
+            return
         self.process_in_thread(
             self.controller.process_exposure,
-            self.exposure_var.get()
+            params.pop('brightness_factor'),
+            **params
         )
     
     def _init_filter_tab(self):
@@ -390,15 +734,8 @@ class ImageResizerApp:
         # 滤镜类型选择
         self.filter_var = tk.StringVar(value="grayscale")
         
-        # 创建单选按钮
-        filters = [
-            ("灰度", "grayscale"),
-            ("复古棕褐色", "sepia"),
-            ("负片", "negative"),
-            ("模糊", "blur"),
-            ("锐化", "sharpen"),
-            ("轮廓", "contour")
-        ]
+        # 创建单选按钮（滤镜列表来自控制器）
+        filters = [(text, value) for value, text in self.controller.filter_types.items()]
         
         # 使用网格布局放置单选按钮
         for i, (text, value) in enumerate(filters):
@@ -408,7 +745,8 @@ class ImageResizerApp:
                 self.filter_select_frame,
                 text=text,
                 value=value,
-                variable=self.filter_var
+                variable=self.filter_var,
+                command=self.schedule_effect_preview
             ).grid(row=row, column=col, sticky='w', padx=5, pady=2)
         
         # 应用滤镜按钮
@@ -424,8 +762,87 @@ class ImageResizerApp:
             self.filter_var.get()
         )
 
+    
+    def _init_pipeline_tab(self):
+        # 组合处理标签页：按顺序组合多个操作，每张图片只解码和编码一次
+        self.pipeline_frame = ttk.Frame(self.notebook, padding="15")
+        self.notebook.add(self.pipeline_frame, text="组合处理")
+        
+        ttk.Label(self.pipeline_frame,
+                 text="添加步骤（使用对应标签页中的当前设置）:").pack(pady=(0, 5))
+        
+        add_frame = ttk.Frame(self.pipeline_frame)
+        add_frame.pack(fill='x', pady=5)
+        self.pipeline_op_var = tk.StringVar(value=self.controller.operation_types['resize'])
+        ttk.Combobox(add_frame,
+                     textvariable=self.pipeline_op_var,
+                     values=list(self.controller.operation_types.values()),
+                     state='readonly',
+                     width=10).pack(side='left', padx=5)
+        ttk.Button(add_frame, text="添加步骤",
+                  command=self.add_pipeline_step).pack(side='left', padx=5)
+        
+        self.pipeline_listbox = tk.Listbox(self.pipeline_frame,
+                                           height=5,
+                                           font=('Microsoft YaHei UI', 10))
+        self.pipeline_listbox.pack(fill='both', expand=True, pady=5)
+        
+        edit_frame = ttk.Frame(self.pipeline_frame)
+        edit_frame.pack(fill='x', pady=5)
+        ttk.Button(edit_frame, text="删除步骤",
+                  command=self.remove_pipeline_step).pack(side='left', expand=True, fill='x', padx=5)
+        ttk.Button(edit_frame, text="清空",
+                  command=self.clear_pipeline).pack(side='left', expand=True, fill='x', padx=5)
+        
+        ttk.Button(self.pipeline_frame,
+                  text="开始组合处理",
+                  command=self.process_pipeline).pack(pady=15, padx=10, fill='x')
+    
+    def _current_step_params(self, operation):
+        """从各功能标签页读取当前设置，作为组合处理步骤的参数"""
+        if operation == 'resize':
+            width = int(self.width_var.get()) if self.width_var.get() else None
+            height = int(self.height_var.get()) if self.height_var.get() else None
+            if not (width or height):
+                raise ValueError("请在调整尺寸标签页中至少输入宽度或高度！")
+            return {'width': width, 'height': height, 'keep_ratio': self.keep_ratio_var.get()}
+        elif operation == 'exposure':
+            return self._tone_params()
+        elif operation == 'filter':
+            return {'filter_type': self.filter_var.get()}
+        elif operation == 'random':
+            return {'max_rotation': self.rotation_var.get()}
+        elif operation == 'compress':
+            return {'quality': self.quality_var.get()}
+        return {}
+    
+    def add_pipeline_step(self):
+        operation = next((op for op, text in self.controller.operation_types.items()
+                          if text == self.pipeline_op_var.get()), None)
+        if operation is None:
+            return
+        try:
+            step = self.controller.add_pipeline_step(operation, **self._current_step_params(operation))
+        except ValueError as e:
+            messagebox.showwarning("警告", str(e))
+            return
+        self.pipeline_listbox.insert(tk.END, self.controller.describe_pipeline_step(step))
+    
+    def remove_pipeline_step(self):
+        selection = self.pipeline_listbox.curselection()
+        if selection:
+            self.controller.remove_pipeline_step(selection[0])
+            self.pipeline_listbox.delete(selection[0])
+    
+    def clear_pipeline(self):
+        self.controller.clear_pipeline()
+        self.pipeline_listbox.delete(0, tk.END)
+    
+    def process_pipeline(self):
+        self.process_in_thread(self.controller.process_pipeline)
+
 
 if __name__ == '__main__':
     root = tk.Tk()
     app = ImageResizerApp(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()